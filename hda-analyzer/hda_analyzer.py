@@ -16,7 +16,9 @@
 hda_analyzer - a tool to analyze HDA codecs widgets and connections
 
 Usage: hda_analyzer [[codec_proc] ...]
-   or: hda_analyzer --monitor
+   or: hda_analyzer --monitor [--fast=ms] [--slow=ms] [--format=text|jsonl]
+   or: hda_analyzer [--graph] [--layout=layered|grid] [--timings] [--no-cache]
+                    [[codec_proc] ...]
 
     codec_proc might specify multiple codec files per card:
         codec_proc_file1+codec_proc_file2
@@ -24,11 +26,28 @@ Usage: hda_analyzer [[codec_proc] ...]
     or codec_proc might be a hash for codec database at www.alsa-project.org
     or codec_proc might be a URL for codec dump or alsa-info.sh dump
 
+    The --layout option selects the graph layout: layered (default,
+    widgets in columns by the signal flow from converters to pins) or
+    grid (the classic placement to the HDACodec.graph() grid).
+
+    The --timings option prints how long the analysis of each codec
+    took (codecs are probed concurrently, one thread per hwdep device).
+
+    The parsed codec_proc dumps are cached in ~/.cache/hda-analyzer
+    (keyed by the SHA-1 of the dump contents) and the graph layouts in
+    ~/.cache/hda-analyzer/layouts (keyed by the codec topology, so all
+    codecs of one model share the layout), --no-cache disables it.
+
     Monitor mode: check for codec changes in realtime and dump diffs.
+        Pin sense, GPIO data and power states are polled at the fast
+        rate (default 20ms), other volatile state at the slow rate
+        (default 1000ms). The jsonl format prints one JSON object per
+        changed field (raw and decoded old/new values).
 """
 
 import os
 import sys
+from time import time
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gdk', '3.0')
@@ -36,12 +55,18 @@ from gi.repository import GObject as gobject
 from gi.repository import Gtk as gtk
 from gi.repository import Pango as pango
 
-from hda_codec import HDACodec, HDA_card_list, HDA_Exporter_pyscript, \
+from hda_codec import HDACodec, HDA_card_list, HDA_codec_discover, \
+                      HDA_Exporter_pyscript, \
                       EAPDBTL_BITS, PIN_WIDGET_CONTROL_BITS, \
                       PIN_WIDGET_CONTROL_VREF, DIG1_BITS, GPIO_IDS, \
                       HDA_INPUT, HDA_OUTPUT
-from hda_proc import DecodeProcFile, DecodeAlsaInfoFile, HDACodecProc
+from hda_proc import DecodeProcFile, DecodeAlsaInfoFile, IterProcFile, \
+                     HDACodecProc
+from hda_cache import ProcCache, LayoutCache
+from hda_diff import CodecSnapshot
 from hda_guilib import *
+from hda_layout import GRAPH_LAYOUTS
+import hda_graph
 from hda_graph import create_graph
 
 def gethttpfile(url, size=1024*1024):
@@ -58,10 +83,9 @@ def gethttpfile(url, size=1024*1024):
   h.close()
   return res
 
-def read_nodes2(card, codec):
-  try:
-    c = HDACodec(card, codec)
-  except OSError as error:
+def read_nodes2(card, codec, c, elapsed, timings=False):
+  if isinstance(c, OSError):
+    error = c
     if error.errno == 13:
       print("Codec %i/%i unavailable - permissions..." % (card, codec))
     elif error.errno == 16:
@@ -69,27 +93,33 @@ def read_nodes2(card, codec):
     elif error.errno != 2:
       print("Codec %i/%i access problem (%s)" % (card, codec, error.strerror))
     return
-  c.analyze()
+  if timings:
+    print("Codec %i/%i analyzed in %.1f ms (%i ioctls)" % \
+          (card, codec, elapsed * 1000, c.ioctls))
   if not card in CODEC_TREE:
     CODEC_TREE[card] = {}
     DIFF_TREE[card] = {}
   CODEC_TREE[card][c.device] = c
-  DIFF_TREE[card][c.device] = c.dump()
+  DIFF_TREE[card][c.device] = CodecSnapshot(c)
 
 def read_nodes3(card, codec, proc_file):
-  c = HDACodecProc(card, codec, proc_file)
+  read_nodes4(card, HDACodecProc(card, codec, proc_file))
+
+def read_nodes4(card, c):
   c.analyze()
   if not card in CODEC_TREE:
     CODEC_TREE[card] = {}
     DIFF_TREE[card] = {}
   CODEC_TREE[card][c.device] = c
-  DIFF_TREE[card][c.device] = c.dump()
-
-def read_nodes(proc_files):
-  l = HDA_card_list()
-  for c in l:
-    for i in range(4):
-      read_nodes2(c.card, i)
+  DIFF_TREE[card][c.device] = CodecSnapshot(c)
+
+def read_nodes(proc_files, timings=False, cache=None):
+  start = time()
+  cards = [c.card for c in HDA_card_list()]
+  for card, codec, c, elapsed in HDA_codec_discover(cards):
+    read_nodes2(card, codec, c, elapsed, timings)
+  if timings and cards:
+    print("Codec discovery took %.1f ms" % ((time() - start) * 1000))
   card = 1000
   for f in proc_files:
     a = f.split('+')
@@ -107,10 +137,21 @@ def read_nodes(proc_files):
         else:
           print('  Success')
       else:
-        proc_file = DecodeProcFile(a[0])
-      proc_file = DecodeAlsaInfoFile(proc_file)
-      for i in proc_file:
-        read_nodes3(card, idx, i)
+        proc_file = None
+      if cache and proc_file is None:
+        codecs = cache.load(a[0], card)
+      elif cache:
+        codecs = cache.load_text(proc_file, card)
+      else:
+        if proc_file is None:
+          proc_file = IterProcFile(a[0])
+        else:
+          proc_file = DecodeAlsaInfoFile(proc_file)
+        # a list, the card is incremented by the loop below
+        codecs = [HDACodecProc(card + i, idx, text) \
+                    for i, text in enumerate(proc_file)]
+      for c in codecs:
+        read_nodes4(card, c)
         card += 1
       a = []
     for i in a:
@@ -483,34 +524,41 @@ mailing list, too.
     
     return scrolled_window, buffer
 
-def monitor():
-  from time import sleep
-  print("Watching %s cards" % len(CODEC_TREE))
-  dumps = {}
+def monitor(fast=None, slow=None, format='text'):
+  from hda_monitor import CodecMonitor, PollScheduler, EventWriter, \
+                          POLL_FAST, POLL_SLOW
+  writer = None
+  if format == 'jsonl':
+    writer = EventWriter(sys.stdout.fileno())
+  else:
+    print("Watching %s cards" % len(CODEC_TREE))
+  monitors = []
+  for card in CODEC_TREE:
+    for codec in CODEC_TREE[card]:
+      c = CODEC_TREE[card][codec]
+      if c.hwaccess:
+        monitors.append(CodecMonitor(c, fast or POLL_FAST, slow or POLL_SLOW))
+  if not monitors:
+    sys.stderr.write("Nothing to monitor (no hwdep access)\n")
+    return
+  scheduler = PollScheduler(monitors)
   while 1:
-    ok = False
-    for card in CODEC_TREE:
-      if not card in dumps:
-        dumps[card] = {}
-      for codec in CODEC_TREE[card]:
-        if not codec in dumps[card]:
-          dumps[card][codec] = ''
-        c = CODEC_TREE[card][codec]
-        if c.hwaccess:
-          ok = True
-        c.reread()
-        diff = ''
-        dump1 = c.dump()
-        if dumps[card][codec]:
-          diff = do_diff1(c, dumps[card][codec])
-        dumps[card][codec] = dump1
-        if diff:
-          print("======================================")
-          print(diff)
-    if not ok:
-      print("Nothing to monitor (no hwdep access)")
-      break
-    sleep(1)
+    due = {}
+    for m, name in scheduler.wait():
+      if not m in due:
+        due[m] = []
+      due[m].append(name)
+    for m in due:
+      if writer:
+        for event in m.events(due[m]):
+          writer.write(event)
+        continue
+      diff = m.diff(due[m])
+      if diff:
+        print("======================================")
+        print(diff)
+    if writer:
+      writer.flush()
 
 def main(argv):
   cmd = None
@@ -520,10 +568,39 @@ def main(argv):
   if len(argv) > 1 and argv[1] in ('-m', '-monitor', '--monitor'):
     cmd = 'monitor'
     del argv[1]
+  poll = {}
+  while cmd == 'monitor' and len(argv) > 1 and \
+        argv[1].split('=')[0] in ('--fast', '--slow', '--format'):
+    name, value = argv[1][2:].split('=', 1)
+    if name == 'format':
+      if not value in ('text', 'jsonl'):
+        print("Unknown monitor format '%s'" % value)
+        return 0
+      poll[name] = value
+    else:
+      poll[name] = int(value) / 1000.0
+    del argv[1]
   if len(argv) > 1 and argv[1] in ('-g', '-graph', '--graph'):
     cmd = 'graph'
     del argv[1]
-  if read_nodes(sys.argv[1:]) == 0:
+  if len(argv) > 1 and argv[1].startswith('--layout='):
+    layout = argv[1][9:]
+    if not layout in GRAPH_LAYOUTS:
+      print("Unknown graph layout '%s'" % layout)
+      return 0
+    hda_graph.GRAPH_LAYOUT = layout
+    del argv[1]
+  timings = False
+  if len(argv) > 1 and argv[1] in ('-t', '-timings', '--timings'):
+    timings = True
+    del argv[1]
+  cache = ProcCache()
+  if len(argv) > 1 and argv[1] == '--no-cache':
+    cache = None
+    del argv[1]
+  else:
+    hda_graph.GRAPH_LAYOUT_CACHE = LayoutCache(os.path.join(cache.dir, 'layouts'))
+  if read_nodes(sys.argv[1:], timings, cache) == 0:
     print("No HDA codecs were found or insufficient priviledges for ")
     print("/dev/snd/controlC* and /dev/snd/hwdepC*D* device files.")
     print()
@@ -534,7 +611,7 @@ def main(argv):
     return 0
   else:
     if cmd == 'monitor':
-      monitor()
+      monitor(**poll)
       return 1
     if cmd == 'graph':
       for card in CODEC_TREE:
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+"""
+hda_batch - analyze a corpus of codec dumps
+
+Usage: hda_batch [-j jobs] [--resume] [--store dir] -o results path ...
+   or: hda_batch --print results
+
+    Each path is a directory (walked recursively), a tar archive
+    (optionally compressed), a zip archive or a single codec proc or
+    alsa-info.sh dump. The dumps might be compressed (gzip, bz2, xz or
+    zstd when a zstd module is available). All dumps are decompressed,
+    parsed and analyzed by a pool of worker processes (default one per
+    CPU) and one result row per codec (or per failed dump) is stored to
+    the columnar results file.
+
+    The results are written in blocks, so with --resume an interrupted
+    run continues with the dumps which are not in the results file yet.
+    The --print mode prints the results file as text.
+
+    Each result row has the codec fingerprint (a hash of the static codec
+    state like capabilities, connections and pin default configs). With
+    --store, the static state of each unique codec is stored once to
+    the store directory and the rows get only the dynamic delta (amp
+    values, pin controls, power states) to the first codec seen with
+    the same fingerprint.
+"""
+
+import os
+import sys
+import io
+import json
+import struct
+import tarfile
+import zipfile
+from array import array
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+from time import time
+
+from hda_proc import SplitProcFile, OpenProcFile, HDACodecProc
+from hda_dedup import CodecStore
+
+# column name -> array typecode ('s' is a string column)
+BATCH_COLUMNS = [
+  ('path', 's'),		# dump file (archive:member for archives)
+  ('codec', 'i'),		# codec index in the dump, -1 for unreadable dump
+  ('name', 's'),
+  ('vendor_id', 'I'),
+  ('subsystem_id', 'I'),
+  ('revision_id', 'I'),
+  ('nodes', 'I'),
+  ('seconds', 'd'),		# parse and analyze time
+  ('error', 's'),		# empty when the codec was analyzed
+  ('fingerprint', 's'),		# HDACodec.fingerprint()
+  ('delta', 's')		# JSON dynamic delta for --store
+]
+
+BATCH_MAGIC = b'HDABATCH 2\n'
+BATCH_BLOCK = struct.Struct('<4sII')	# b'BLCK', rows, payload bytes
+BATCH_ROWS = 1024			# rows per block (and per pool batch)
+
+def encode_block(rows, columns=BATCH_COLUMNS):
+  """return the block with columns of given result rows"""
+  payload = []
+  for col, (name, type) in enumerate(columns):
+    if type == 's':
+      blob = bytearray()
+      offsets = array('I', [0])
+      for row in rows:
+        blob += row[col].encode('utf-8', 'replace')
+        offsets.append(len(blob))
+      payload.append(offsets.tobytes())
+      payload.append(bytes(blob))
+    else:
+      payload.append(array(type, [row[col] for row in rows]).tobytes())
+  payload = b''.join(payload)
+  return BATCH_BLOCK.pack(b'BLCK', len(rows), len(payload)) + payload
+
+def decode_block(payload, count, swap, columns=BATCH_COLUMNS):
+  """return column name -> list of values"""
+  res = {}
+  pos = 0
+  for name, type in columns:
+    if type == 's':
+      offsets = array('I')
+      size = offsets.itemsize * (count + 1)
+      offsets.frombytes(payload[pos:pos+size])
+      if swap:
+        offsets.byteswap()
+      pos += size
+      blob = payload[pos:pos+offsets[-1]]
+      pos += offsets[-1]
+      res[name] = [blob[offsets[i]:offsets[i+1]].decode('utf-8')
+                   for i in range(count)]
+    else:
+      vals = array(type)
+      size = vals.itemsize * count
+      vals.frombytes(payload[pos:pos+size])
+      if swap:
+        vals.byteswap()
+      pos += size
+      res[name] = vals
+  return res
+
+def write_header(fd):
+  header = {'columns': BATCH_COLUMNS, 'byteorder': sys.byteorder}
+  fd.write(BATCH_MAGIC + (json.dumps(header) + '\n').encode())
+
+def read_results(filename, columns=None):
+  """
+  Read the results file, return (column name -> values, file size of
+  complete blocks). A truncated block from an interrupted run is ignored.
+  """
+  res = {}
+  for name, type in BATCH_COLUMNS:
+    if type == 's':
+      res[name] = []
+    else:
+      res[name] = array(type)
+  with open(filename, 'rb') as fd:
+    if fd.readline() != BATCH_MAGIC:
+      raise ValueError("%s is not a hda_batch results file" % filename)
+    header = json.loads(fd.readline())
+    if [tuple(a) for a in header['columns']] != BATCH_COLUMNS:
+      raise ValueError("%s: unknown columns" % filename)
+    swap = header['byteorder'] != sys.byteorder
+    good = fd.tell()
+    while 1:
+      data = fd.read(BATCH_BLOCK.size)
+      if len(data) < BATCH_BLOCK.size:
+        break
+      magic, count, size = BATCH_BLOCK.unpack(data)
+      payload = fd.read(size)
+      if magic != b'BLCK' or len(payload) < size:
+        break
+      block = decode_block(payload, count, swap)
+      for name in columns or res:
+        res[name] += block[name]
+      good = fd.tell()
+  return res, good
+
+def read_dump(path, data=None):
+  """return the (decompressed) dump text from the file or archive member"""
+  if not data is None:
+    path = io.BytesIO(data)
+  with OpenProcFile(path) as fd:
+    return fd.read()
+
+def error_row(path, idx, elapsed, msg):
+  return (path, idx, '', 0, 0, 0, 0, elapsed, msg, '', '', None, None)
+
+def analyze_dump(job):
+  """
+  Return result rows for one dump, job is (path, contents or None, states).
+  Each row is followed by the static and dynamic codec state (for --store)
+  when states is set, by None, None otherwise.
+  """
+  path, data, states = job
+  res = []
+  try:
+    text = read_dump(path, data)
+  except Exception as msg:	# also EOFError, LZMAError, zlib.error
+    return [error_row(path, -1, 0.0, str(msg) or 'read error')]
+  with redirect_stdout(io.StringIO()):	# drop the parser warnings
+    for idx, section in enumerate(SplitProcFile(io.StringIO(text))):
+      start = time()
+      try:
+        c = HDACodecProc(0, idx, section)
+        if not c.proc_codec_id:
+          raise ValueError("no codec found")
+        c.analyze()
+        res.append((path, idx, c.proc_codec_id or '',
+                    c.vendor_id & 0xffffffff, c.subsystem_id & 0xffffffff,
+                    c.revision_id & 0xffffffff, len(c.nodes),
+                    time() - start, '', c.fingerprint(), '') + \
+                   (states and (c.static_state(), c.dynamic_state()) or \
+                    (None, None)))
+      except Exception as msg:
+        res.append(error_row(path, idx, time() - start,
+                             '%s: %s' % (msg.__class__.__name__, msg)))
+  if not res:
+    res.append(error_row(path, -1, 0.0, 'no codec found'))
+  return res
+
+def iter_jobs(path, done):
+  """
+  Yield (path, contents or None) jobs for all dumps in path. A missing or
+  unreadable path is yielded as a plain file, so the worker reports it.
+  """
+  archive = None
+  if not os.path.isdir(path):
+    try:
+      if tarfile.is_tarfile(path):
+        archive = 'tar'
+      elif zipfile.is_zipfile(path):
+        archive = 'zip'
+    except OSError:
+      pass
+  if os.path.isdir(path):
+    for dir, dirs, files in os.walk(path):
+      dirs.sort()
+      for f in sorted(files):
+        name = os.path.join(dir, f)
+        if not name in done:
+          yield name, None
+  elif archive == 'tar':
+    with tarfile.open(path) as tar:
+      for member in tar:
+        name = path + ':' + member.name
+        if member.isfile() and not name in done:
+          yield name, tar.extractfile(member).read()
+  elif archive == 'zip':
+    with zipfile.ZipFile(path) as zip:
+      for info in zip.infolist():
+        name = path + ':' + info.filename
+        if not info.is_dir() and not name in done:
+          yield name, zip.read(info)
+  elif not path in done:
+    yield path, None
+
+def iter_batches(paths, done, size=BATCH_ROWS):
+  batch = []
+  for path in paths:
+    for job in iter_jobs(path, done):
+      batch.append(job)
+      if len(batch) >= size:
+        yield batch
+        batch = []
+  if batch:
+    yield batch
+
+class Progress:
+
+  def __init__(self, interval=1.0, out=sys.stderr):
+    self.interval = interval
+    self.out = out
+    self.start = self.last = time()
+    self.dumps = 0
+    self.codecs = 0
+    self.errors = 0
+
+  def add(self, rows):
+    self.dumps += 1
+    for row in rows:
+      if row[8]:
+        self.errors += 1
+      else:
+        self.codecs += 1
+    now = time()
+    if now - self.last >= self.interval:
+      self.last = now
+      self.show()
+
+  def show(self, end='\r'):
+    elapsed = max(time() - self.start, 1e-6)
+    self.out.write("%i dumps, %i codecs, %i errors, %.1f dumps/s%s" % \
+                   (self.dumps, self.codecs, self.errors,
+                    self.dumps / elapsed, end))
+    self.out.flush()
+
+def run_batch(paths, output, jobs=None, resume=False, progress=None,
+              store=None):
+  """
+  Analyze all dumps in paths, append the result rows to output. With
+  the store (CodecStore), the static state of each unique codec is
+  stored once and the rows get the dynamic delta to it.
+  """
+  done = set()
+  if resume and os.path.exists(output):
+    res, good = read_results(output, ['path'])
+    done = set(res['path'])
+    fd = open(output, 'r+b')
+    fd.truncate(good)
+    fd.seek(good)
+  else:
+    fd = open(output, 'wb')
+    write_header(fd)
+  states = not store is None
+  with fd, Pool(jobs) as pool:
+    for batch in iter_batches(paths, done):
+      batch = [(path, data, states) for path, data in batch]
+      rows = []
+      for res in pool.imap_unordered(analyze_dump, batch, chunksize=16):
+        for row in res:
+          static, dynamic = row[-2:]
+          row = row[:-2]
+          if store and not static is None:
+            delta = json.dumps(store.put(row[9], static, dynamic))
+            row = row[:10] + (delta, )
+          rows.append(row)
+        if progress:
+          progress.add(res)
+      fd.write(encode_block(rows))
+      fd.flush()
+      os.fsync(fd.fileno())
+
+def print_results(filename):
+  res, good = read_results(filename)
+  names = [name for name, type in BATCH_COLUMNS]
+  print('\t'.join(names))
+  for i in range(len(res['path'])):
+    row = []
+    for name, type in BATCH_COLUMNS:
+      val = res[name][i]
+      if name.endswith('_id'):
+        val = '0x%08x' % val
+      elif type == 'd':
+        val = '%.6f' % val
+      row.append(str(val))
+    print('\t'.join(row))
+
+def main(argv):
+  if len(argv) > 2 and argv[1] == '--print':
+    print_results(argv[2])
+    return 1
+  jobs = None
+  resume = False
+  output = None
+  store = None
+  while len(argv) > 1 and argv[1].startswith('-'):
+    if argv[1] == '--resume':
+      resume = True
+      del argv[1]
+    elif argv[1] == '-j' and len(argv) > 2:
+      jobs = int(argv[2])
+      del argv[1:3]
+    elif argv[1] == '-o' and len(argv) > 2:
+      output = argv[2]
+      del argv[1:3]
+    elif argv[1] == '--store' and len(argv) > 2:
+      store = CodecStore(argv[2])
+      del argv[1:3]
+    else:
+      print("Unknown option '%s'" % argv[1])
+      return 0
+  if not output or len(argv) < 2:
+    print(__doc__)
+    return 0
+  if os.path.exists(output) and not resume:
+    print("Results file '%s' exists, use --resume to continue." % output)
+    return 0
+  progress = Progress()
+  run_batch(argv[1:], output, jobs, resume, progress, store)
+  progress.show('\n')
+  if store:
+    print("%i unique codecs stored" % store.added)
+  return 1
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
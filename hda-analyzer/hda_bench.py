@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+"""
+hda_bench - measure the cost of HDA codec analysis
+
+Usage: hda_bench [-n count] [--sim] [codec_proc ...]
+   or: hda_bench --startup [-l latency_us] codec_proc ...
+   or: hda_bench --memory [-n count] codec_proc ...
+   or: hda_bench --parse [-n count] [--lazy] codec_proc ...
+   or: hda_bench --cache codec_proc ...
+   or: hda_bench --decompress codec_proc ...
+   or: hda_bench --snapshot [-n count] codec_proc ...
+   or: hda_bench --graph [-c copies] codec_proc ...
+
+    Without codec_proc arguments, all codecs accessible through
+    /dev/snd/hwC*D* are measured. The codec_proc files are emulated
+    (no ioctls are issued for them). With --sim, the codec_proc files
+    are loaded to the in-memory simulator, so the same code paths as
+    for the hwdep interface (verb cache, batches, monitor) are measured.
+
+    The startup mode compares the sequential and the concurrent codec
+    discovery. Each codec from codec_proc files is placed to own card
+    and every verb is delayed by latency_us (default 100us) to simulate
+    the hwdep round trip.
+
+    The memory mode analyzes all codec_proc files count times (default
+    10) and reports the memory held by the analyzed node model and the
+    analyze() throughput.
+
+    The parse mode parses all codec_proc files count times (default 100)
+    and reports the proc parser throughput. With --lazy, only the codec
+    header is parsed and the node sections are indexed.
+
+    The cache mode compares the time to load and analyze all codec_proc
+    files without the parse cache, with an empty cache (parse and store)
+    and with a filled cache (a temporary cache directory is used).
+
+    The decompress mode streams all (possibly compressed) codec_proc
+    files through the codec splitter and reports the decompression
+    throughput.
+
+    The snapshot mode stores the binary snapshots of all codec_proc files
+    to a temporary directory and compares the time to load and analyze
+    them count times (default 100) from the proc text and the snapshots.
+
+    The graph mode builds the codec graph layout (node placement, route
+    collision checks and whitespace compaction) with the plain route list
+    and with the grid index, the scan row uses also the previous 5 pixel
+    scan compaction. With -c, each codec is turned to a synthetic one with all its
+    widgets repeated copies times (so 7 copies of a 35 node codec give
+    a 245 node codec). The layered layout is timed too and both layouts
+    are compared by the graph size, the number of route lines (bends) and
+    the route crossings. Finally, the time to restore the grid layout
+    from the layout cache is shown.
+"""
+
+import os
+import re
+import sys
+import gc
+import errno
+import tracemalloc
+import shutil
+import tempfile
+from time import time
+from io import StringIO
+from contextlib import redirect_stdout
+
+from hda_codec import HDACodec, HDA_card_list, HDA_codec_discover
+from hda_proc import IterProcFile, HDACodecProc, HDAProcBackend, \
+                     ProcCompression, PROC_NODE_HEADER
+from hda_sim import HDA_sim_snapshot, HDA_snapshot_save, HDASnapshotBackend
+from hda_monitor import CodecMonitor
+from hda_cache import ProcCache
+from hda_layout import GraphLayout, LayeredLayout, RouteIndex, RouteGrid, \
+                       GRAPH_EXTRA, layout_codec
+from hda_cache import LayoutCache
+
+def bench_analyze(codec, count=10):
+  """return (ioctls, seconds) per one analyze() call"""
+  ioctls = codec.ioctls
+  start = time()
+  for i in range(count):
+    codec.analyze()
+  elapsed = time() - start
+  return (codec.ioctls - ioctls) / count, elapsed / count
+
+def bench_reread(codec, count=10):
+  """return (ioctls, seconds) per one reread() call"""
+  ioctls = codec.ioctls
+  start = time()
+  for i in range(count):
+    codec.reread()
+  elapsed = time() - start
+  return (codec.ioctls - ioctls) / count, elapsed / count
+
+def bench_monitor(codec, count=10):
+  """return (verbs, seconds) per one poll of all monitor groups"""
+  monitor = CodecMonitor(codec)
+  ioctls = codec.ioctls
+  start = time()
+  for i in range(count):
+    monitor.diff()
+  elapsed = time() - start
+  return (codec.ioctls - ioctls) / count, elapsed / count
+
+def bench_codecs(proc_files, sim=False):
+  res = []
+  if not proc_files:
+    for card in HDA_card_list():
+      for device in range(4):
+        try:
+          res.append(HDACodec(card.card, device))
+        except OSError:
+          pass
+  card = 1000
+  for f in proc_files:
+    for proc_file in IterProcFile(f):
+      c = HDACodecProc(card, 0, proc_file)
+      if sim:
+        c = HDACodec(card, 0, backend=HDA_sim_snapshot(HDAProcBackend(c)))
+      res.append(c)
+      card += 1
+  return res
+
+def bench_startup(proc_files, latency):
+  sims = {}
+  for f in proc_files:
+    for proc_file in IterProcFile(f):
+      c = HDACodecProc(len(sims), 0, proc_file)
+      sims[(len(sims), 0)] = HDA_sim_snapshot(HDAProcBackend(c), latency)
+
+  def factory(card, device):
+    if not (card, device) in sims:
+      raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+    return HDACodec(card, device, backend=sims[(card, device)])
+
+  cards = range(len(sims))
+  res = []
+  for parallel in [False, True]:
+    start = time()
+    codecs = HDA_codec_discover(cards, factory=factory, parallel=parallel)
+    res.append((time() - start, codecs))
+  return res
+
+def bench_memory(proc_files, count=10):
+  """return (codecs, nodes, bytes, seconds) for analyze() of proc files"""
+  texts = []
+  for f in proc_files:
+    texts += IterProcFile(f)
+  codecs = []
+  for i in range(count):
+    for text in texts:
+      codecs.append(HDACodecProc(1000 + len(codecs), 0, text))
+  gc.collect()
+  tracemalloc.start()
+  for c in codecs:
+    c.analyze()
+  gc.collect()
+  size = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  start = time()
+  for c in codecs:
+    c.analyze()
+  elapsed = time() - start
+  nodes = 0
+  for c in codecs:
+    nodes += len(c.nodes)
+  return len(codecs), nodes, size, elapsed
+
+def bench_parse(proc_files, count=100, lazy=False):
+  """return (bytes, lines, seconds) for parsing of proc files"""
+  texts = []
+  for f in proc_files:
+    texts += IterProcFile(f)
+  size = 0
+  lines = 0
+  for text in texts:
+    size += len(text) * count
+    lines += text.count('\n') * count
+  start = time()
+  for i in range(count):
+    for text in texts:
+      HDACodecProc(1000, 0, text, lazy=lazy)
+  return size, lines, time() - start
+
+def main_parse(argv):
+  count = 100
+  if len(argv) > 2 and argv[1] == '-n':
+    count = int(argv[2])
+    del argv[1:3]
+  lazy = False
+  if len(argv) > 1 and argv[1] == '--lazy':
+    lazy = True
+    del argv[1]
+  if len(argv) < 2:
+    print("No codec_proc files were given.")
+    return 0
+  size, lines, elapsed = bench_parse(argv[1:], count, lazy)
+  print("%i bytes, %i lines parsed in %.3f s" % (size, lines, elapsed))
+  print("  parse: %8.2f MB/s, %10.1f lines/s" % \
+        (size / elapsed / 1000000.0, lines / elapsed))
+  return 1
+
+def bench_cache(proc_files):
+  """return [(name, codecs, seconds)] for load and analyze of proc files"""
+
+  def load(cache):
+    start = time()
+    count = 0
+    for f in proc_files:
+      if cache:
+        codecs = cache.load(f)
+      else:
+        codecs = (HDACodecProc(1000, 0, text) for text in IterProcFile(f))
+      for c in codecs:
+        c.analyze()
+        count += 1
+    return count, time() - start
+
+  dir = tempfile.mkdtemp(prefix='hda-cache-')
+  try:
+    cache = ProcCache(dir)
+    res = [('no cache', ) + load(None)]
+    res.append(('cold cache', ) + load(cache))
+    res.append(('warm cache', ) + load(cache))
+  finally:
+    shutil.rmtree(dir)
+  return res
+
+def main_cache(argv):
+  if len(argv) < 2:
+    print("No codec_proc files were given.")
+    return 0
+  res = bench_cache(argv[1:])
+  for name, codecs, elapsed in res:
+    print("%-10s: %i codecs in %8.1f ms (%.3f ms per codec)" % \
+          (name, codecs, elapsed * 1000, elapsed * 1000 / max(codecs, 1)))
+  print("speedup: %.1fx" % (res[0][2] / res[2][2]))
+  return 1
+
+def bench_decompress(proc_file):
+  """return (compression, file bytes, text bytes, codecs, seconds)"""
+  with open(proc_file, 'rb') as fd:
+    compression = ProcCompression(fd.read(8)) or 'none'
+  size = 0
+  codecs = 0
+  start = time()
+  for text in IterProcFile(proc_file):
+    size += len(text)
+    codecs += 1
+  return compression, os.path.getsize(proc_file), size, codecs, time() - start
+
+def main_decompress(argv):
+  if len(argv) < 2:
+    print("No codec_proc files were given.")
+    return 0
+  for f in argv[1:]:
+    try:
+      compression, fsize, size, codecs, elapsed = bench_decompress(f)
+    except ValueError as msg:
+      print("%s: %s" % (f, msg))
+      continue
+    elapsed = max(elapsed, 1e-6)
+    print("%s (%s): %i -> %i bytes, %i codecs in %.1f ms" % \
+          (f, compression, fsize, size, codecs, elapsed * 1000))
+    print("  throughput: %8.2f MB/s in, %8.2f MB/s out" % \
+          (fsize / elapsed / 1000000.0, size / elapsed / 1000000.0))
+  return 1
+
+def bench_snapshot(proc_files, count=100):
+  """return (codecs, snapshot bytes, proc seconds, snapshot seconds)"""
+  texts = []
+  for f in proc_files:
+    texts += IterProcFile(f)
+  dir = tempfile.mkdtemp(prefix='hda-snapshot-')
+  try:
+    snapshots = []
+    size = 0
+    for text in texts:
+      name = os.path.join(dir, '%i.snap' % len(snapshots))
+      HDA_snapshot_save(name, HDAProcBackend(HDACodecProc(1000, 0, text)))
+      size += os.path.getsize(name)
+      snapshots.append(name)
+    start = time()
+    for i in range(count):
+      for text in texts:
+        HDACodecProc(1000, 0, text).analyze()
+    proc = time() - start
+    start = time()
+    for i in range(count):
+      for name in snapshots:
+        HDACodec(1000, 0, backend=HDASnapshotBackend(name)).analyze()
+    snap = time() - start
+  finally:
+    shutil.rmtree(dir)
+  return len(texts), size, proc, snap
+
+def main_snapshot(argv):
+  count = 100
+  if len(argv) > 2 and argv[1] == '-n':
+    count = int(argv[2])
+    del argv[1:3]
+  if len(argv) < 2:
+    print("No codec_proc files were given.")
+    return 0
+  codecs, size, proc, snap = bench_snapshot(argv[1:], count)
+  print("%i codecs, %i snapshot bytes per codec" % (codecs, size // codecs))
+  print("  proc text: %8.3f ms per codec" % (proc * 1000 / count / codecs))
+  print("  snapshot:  %8.3f ms per codec (speedup %.1fx)" % \
+        (snap * 1000 / count / codecs, proc / snap))
+  return 1
+
+def synthetic_proc(text, copies):
+  """return the codec proc text with all node sections repeated copies times"""
+  nodes = list(PROC_NODE_HEADER.finditer(text))
+  if not nodes or copies < 2:
+    return text
+  first = int(nodes[0].group(1), 0)
+  span = int(nodes[-1].group(1), 0) - first + 1
+  body = text[nodes[0].start():].splitlines(True)
+  res = [text[:nodes[0].start()]]
+  for copy in range(copies):
+    shift = lambda m: '0x%02x' % (int(m.group(0), 16) + copy * span)
+    conn = False
+    for line in body:
+      if line.startswith('Node ') or conn:
+        line = re.sub(r'0x[0-9a-f]+', shift, line, line.startswith('Node ') and 1 or 0)
+      conn = line.startswith('  Connection:')
+      res.append(line)
+  return ''.join(res)
+
+def scan_compress(layout, size, has, compress):
+  """the compaction before the sorted sweeps: one 5 pixel step per check"""
+  while 1:
+    first = None
+    for a in range(15, size, 5):
+      found = False
+      for item in layout.nodes + layout.routes:
+        if getattr(item, has)(a):
+          found = True
+          break
+      if not found:
+        if first is None:
+          first = a
+        last = a
+      elif first is not None:
+        break
+    else:
+      return size
+    gap = (last - first) + 5
+    for item in layout.nodes + layout.routes:
+      getattr(item, compress)(first, gap)
+    size -= gap
+
+def bench_graph(codec, index_class, scan=False):
+  """
+  Return (layout, routing seconds, compaction seconds, total seconds,
+  displaced routes), with scan the previous compaction is used.
+  """
+  graph = codec.graph(dump=False)
+  if not graph:
+    return None, 0, 0, 0, 0
+  out = StringIO()
+  routing = compaction = 0
+  start = time()
+  with redirect_stdout(out):
+    for extra in GRAPH_EXTRA:
+      layout = GraphLayout(codec, graph, index_class=index_class)
+      index = layout.place_nodes(extra)
+      t = time()
+      res = layout.place_routes(index)
+      routing += time() - t
+      if res:
+        t = time()
+        if scan:
+          sx = scan_compress(layout, layout.size[0], 'has_x', 'compressx')
+          sy = scan_compress(layout, layout.size[1], 'has_y', 'compressy')
+          layout.size = (sx, sy)
+        else:
+          layout.compress()
+        compaction = time() - t
+        break
+  return layout, routing, compaction, time() - start, \
+         out.getvalue().count('displaced route')
+
+def bench_layered(codec):
+  """return (layout, total seconds)"""
+  start = time()
+  layout = LayeredLayout(codec)
+  layout.build()
+  return layout, time() - start
+
+def route_crossings(layout):
+  """return the number of crossings of route lines from different routes"""
+  horiz = []
+  vert = []
+  for idx in range(len(layout.routes)):
+    for x1, y1, x2, y2 in layout.routes[idx].lines:
+      if y1 == y2 and x1 != x2:
+        horiz.append((y1, min(x1, x2), max(x1, x2), idx))
+      elif x1 == x2 and y1 != y2:
+        vert.append((x1, min(y1, y2), max(y1, y2), idx))
+  res = 0
+  for y, x1, x2, r1 in horiz:
+    for x, y1, y2, r2 in vert:
+      if r1 != r2 and x1 < x < x2 and y1 < y < y2:
+        res += 1
+  return res
+
+def graph_metrics(layout):
+  lines = 0
+  for route in layout.routes:
+    lines += len(route.lines)
+  return "size %5ix%-5i lines %5i crossings %5i" % \
+         (layout.size[0], layout.size[1], lines, route_crossings(layout))
+
+def main_graph(argv):
+  copies = 1
+  if len(argv) > 2 and argv[1] == '-c':
+    copies = int(argv[2])
+    del argv[1:3]
+  if len(argv) < 2:
+    print("No codec_proc files were given.")
+    return 0
+  for f in argv[1:]:
+    for text in IterProcFile(f):
+      codec = HDACodecProc(1000, 0, synthetic_proc(text, copies))
+      try:
+        codec.analyze()
+      except ValueError as msg:
+        print("%s: %s" % (f, msg))
+        continue
+      print("Codec 0x%08x, %i nodes:" % (codec.vendor_id, len(codec.nodes)))
+      res = []
+      for name, index_class, scan in [('scan', RouteIndex, True),
+                                      ('list', RouteIndex, False),
+                                      ('grid', RouteGrid, False)]:
+        layout, routing, compaction, elapsed, displaced = \
+          bench_graph(codec, index_class, scan)
+        if layout is None:
+          print("  no graph")
+          break
+        res.append(([node.myarea for node in layout.nodes],
+                    [route.lines for route in layout.routes], layout.size))
+        print("  %s: %5i routes, %3i displaced, routing %8.1f ms, "
+              "compaction %8.1f ms, total %8.1f ms" % \
+              (name, len(layout.routes), displaced, routing * 1000,
+               compaction * 1000, elapsed * 1000))
+      if res and res.count(res[0]) != len(res):
+        print("  layouts differ!")
+      if res:
+        print("  grid layout:    %s" % graph_metrics(layout))
+        grid = elapsed
+        layout, elapsed = bench_layered(codec)
+        print("  layered: %5i routes, total %8.1f ms (%.1fx faster than grid)" % \
+              (len(layout.routes), elapsed * 1000, grid / elapsed))
+        print("  layered layout: %s" % graph_metrics(layout))
+        cache = LayoutCache()
+        with redirect_stdout(StringIO()):
+          layout_codec(codec, 'grid', cache=cache)
+        start = time()
+        layout = layout_codec(codec, 'grid', cache=cache)
+        print("  cached:  %5i routes, total %8.1f ms (grid layout restored)" % \
+              (len(layout.routes), (time() - start) * 1000))
+  return 1
+
+def main_memory(argv):
+  count = 10
+  if len(argv) > 2 and argv[1] == '-n':
+    count = int(argv[2])
+    del argv[1:3]
+  if len(argv) < 2:
+    print("No codec_proc files were given.")
+    return 0
+  codecs, nodes, size, elapsed = bench_memory(argv[1:], count)
+  print("%i codecs, %i nodes" % (codecs, nodes))
+  print("  memory:  %8.1f kB per codec, %6i bytes per node" % \
+        (size / 1024.0 / codecs, size // nodes))
+  print("  analyze: %8.1f codecs/s, %8.1f nodes/s" % \
+        (codecs / elapsed, nodes / elapsed))
+  return 1
+
+def main_startup(argv):
+  latency = 100
+  if len(argv) > 2 and argv[1] == '-l':
+    latency = int(argv[2])
+    del argv[1:3]
+  if len(argv) < 2:
+    print("No codec_proc files were given.")
+    return 0
+  res = bench_startup(argv[1:], latency / 1000000.0)
+  for card, device, c, elapsed in res[1][1]:
+    if not isinstance(c, OSError):
+      print("Codec %i/%i (0x%08x): %8.1f ms" % \
+            (card, device, c.vendor_id, elapsed * 1000))
+  print("sequential discovery: %8.1f ms" % (res[0][0] * 1000))
+  print("parallel discovery:   %8.1f ms (speedup %.1fx)" % \
+        (res[1][0] * 1000, res[0][0] / res[1][0]))
+  return 1
+
+def main(argv):
+  if len(argv) > 1 and argv[1] == '--startup':
+    del argv[1]
+    return main_startup(argv)
+  if len(argv) > 1 and argv[1] == '--memory':
+    del argv[1]
+    return main_memory(argv)
+  if len(argv) > 1 and argv[1] == '--parse':
+    del argv[1]
+    return main_parse(argv)
+  if len(argv) > 1 and argv[1] == '--cache':
+    del argv[1]
+    return main_cache(argv)
+  if len(argv) > 1 and argv[1] == '--decompress':
+    del argv[1]
+    return main_decompress(argv)
+  if len(argv) > 1 and argv[1] == '--snapshot':
+    del argv[1]
+    return main_snapshot(argv)
+  if len(argv) > 1 and argv[1] == '--graph':
+    del argv[1]
+    return main_graph(argv)
+  count = 10
+  if len(argv) > 2 and argv[1] == '-n':
+    count = int(argv[2])
+    del argv[1:3]
+  sim = False
+  if len(argv) > 1 and argv[1] == '--sim':
+    sim = True
+    del argv[1]
+  codecs = bench_codecs(argv[1:], sim)
+  if not codecs:
+    print("No HDA codecs were found.")
+    return 0
+  for codec in codecs:
+    codec.analyze()
+    ioctls, elapsed = bench_analyze(codec, count)
+    print("Codec %i/%i (0x%08x), %i nodes:" % \
+          (codec.card, codec.device, codec.vendor_id, len(codec.nodes)))
+    print("  analyze: %8.1f ioctls, %8.3f ms" % (ioctls, elapsed * 1000))
+    ioctls, elapsed = bench_reread(codec, count)
+    print("  reread:  %8.1f ioctls, %8.3f ms" % (ioctls, elapsed * 1000))
+    if codec.hwaccess:
+      ioctls, elapsed = bench_monitor(codec, count)
+      print("  monitor: %8.1f ioctls, %8.3f ms" % (ioctls, elapsed * 1000))
+      print("  verb cache: %i hits, %i misses" % \
+            (codec.cache_hits, codec.cache_misses))
+  return 1
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
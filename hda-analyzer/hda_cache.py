@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+import os
+import struct
+import marshal
+from hashlib import sha1
+from io import StringIO
+
+from hda_proc import HDACodecProc, SplitProcFile, IterProcFile, OpenProcFile
+
+# bump when the HDACodecProc state layout, the parser output or the key changes
+PROC_CACHE_VERSION = 2
+PROC_CACHE_MAGIC = b'HDAC'
+PROC_CACHE_HEADER = struct.Struct('<4sII')	# magic, version, marshal version
+PROC_CACHE_LIMIT = 64 * 1024 * 1024
+LAYOUT_CACHE_MAGIC = b'HDAL'
+LAYOUT_CACHE_VERSION = 1	# the layout code version is in the key
+
+def proc_cache_dir():
+  base = os.environ.get('XDG_CACHE_HOME') or \
+         os.path.join(os.path.expanduser('~'), '.cache')
+  return os.path.join(base, 'hda-analyzer')
+
+def proc_file_key(proc_file, size=65536):
+  """
+  Return SHA-1 hex digest of the decompressed dump contents, so the plain
+  and compressed copies of one dump share the key (and load_text() too).
+  """
+  h = sha1()
+  with OpenProcFile(proc_file) as fd:
+    while 1:
+      data = fd.read(size)
+      if not data:
+        break
+      h.update(data.encode('utf-8', 'replace'))
+  return h.hexdigest()
+
+class ProcCache:
+
+  """
+  On-disk cache of parsed codec dumps. The key is the SHA-1 of the dump
+  contents, the value is the marshalled list of HDACodecProc states for
+  all codecs in the dump. Entries with other version stamp are ignored.
+  The least recently used entries are removed when the cache directory
+  grows over the limit.
+  """
+
+  def __init__(self, dir=None, limit=PROC_CACHE_LIMIT):
+    self.dir = dir or proc_cache_dir()
+    self.limit = limit
+    self.hits = 0
+    self.misses = 0
+
+  def path(self, key):
+    return os.path.join(self.dir, key + '.bin')
+
+  def get(self, key):
+    """return list of codec states or None"""
+    path = self.path(key)
+    try:
+      with open(path, 'rb') as fd:
+        data = fd.read()
+    except OSError:
+      return None
+    if len(data) < PROC_CACHE_HEADER.size:
+      return None
+    header = PROC_CACHE_HEADER.unpack_from(data)
+    if header != (PROC_CACHE_MAGIC, PROC_CACHE_VERSION, marshal.version):
+      return None
+    try:
+      res = marshal.loads(data[PROC_CACHE_HEADER.size:])
+    except (EOFError, ValueError, TypeError):
+      return None
+    try:
+      os.utime(path)		# mtime is the LRU stamp
+    except OSError:
+      pass
+    return res
+
+  def put(self, key, states):
+    data = PROC_CACHE_HEADER.pack(PROC_CACHE_MAGIC, PROC_CACHE_VERSION,
+                                  marshal.version) + marshal.dumps(states)
+    path = self.path(key)
+    try:
+      os.makedirs(self.dir, exist_ok=True)
+      tmp = '%s.%i.tmp' % (path, os.getpid())
+      with open(tmp, 'wb') as fd:
+        fd.write(data)
+      os.replace(tmp, path)
+    except OSError:
+      return
+    self.evict()
+
+  def evict(self):
+    """remove the least recently used entries down to 3/4 of the limit"""
+    entries = []
+    total = 0
+    for entry in os.scandir(self.dir):
+      if not entry.name.endswith('.bin'):
+        continue
+      st = entry.stat()
+      entries.append((st.st_mtime, st.st_size, entry.path))
+      total += st.st_size
+    if total <= self.limit:
+      return
+    entries.sort()
+    for mtime, size, path in entries:
+      if total <= self.limit * 3 // 4:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      total -= size
+
+  def codecs(self, key, texts, card):
+    """yield HDACodecProc for cached states or for the parsed texts"""
+    states = self.get(key)
+    if not states is None:
+      self.hits += 1
+      for state in states:
+        yield HDACodecProc(card, 0, None, state)
+        card += 1
+      return
+    self.misses += 1
+    states = []
+    for text in texts:
+      c = HDACodecProc(card, 0, text)
+      states.append(c.get_state())
+      yield c
+      card += 1
+    self.put(key, states)
+
+  def load(self, proc_file, card=1000):
+    """yield HDACodecProc for all codecs in the file"""
+    return self.codecs(proc_file_key(proc_file), IterProcFile(proc_file), card)
+
+  def load_text(self, text, card=1000):
+    """yield HDACodecProc for all codecs in the dump text"""
+    key = sha1(text.encode('utf-8', 'replace')).hexdigest()
+    return self.codecs(key, SplitProcFile(StringIO(text)), card)
+
+class LayoutCache:
+
+  """
+  Graph layouts (hda_layout.layout_state()) keyed by hda_layout.layout_key()
+  of the codec topology. The layouts are kept in memory and with dir also
+  on disk, so a graph of the same codec model is never laid out twice.
+  The entries are small (one per codec model), they are not evicted.
+  """
+
+  def __init__(self, dir=None):
+    self.dir = dir
+    self.layouts = {}
+    self.hits = 0
+    self.misses = 0
+
+  def path(self, key):
+    return os.path.join(self.dir, key + '.layout')
+
+  def load(self, key):
+    try:
+      with open(self.path(key), 'rb') as fd:
+        data = fd.read()
+    except OSError:
+      return None
+    if len(data) < PROC_CACHE_HEADER.size or \
+       PROC_CACHE_HEADER.unpack_from(data) != \
+          (LAYOUT_CACHE_MAGIC, LAYOUT_CACHE_VERSION, marshal.version):
+      return None
+    try:
+      return marshal.loads(data[PROC_CACHE_HEADER.size:])
+    except (EOFError, ValueError, TypeError):
+      return None
+
+  def get(self, key):
+    """return the layout state or None"""
+    res = self.layouts.get(key)
+    if res is None and self.dir:
+      res = self.load(key)
+      if not res is None:
+        self.layouts[key] = res
+    if res is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return res
+
+  def put(self, key, state):
+    self.layouts[key] = state
+    if not self.dir:
+      return
+    data = PROC_CACHE_HEADER.pack(LAYOUT_CACHE_MAGIC, LAYOUT_CACHE_VERSION,
+                                  marshal.version) + marshal.dumps(state)
+    path = self.path(key)
+    try:
+      os.makedirs(self.dir, exist_ok=True)
+      tmp = '%s.%i.tmp' % (path, os.getpid())
+      with open(tmp, 'wb') as fd:
+        fd.write(data)
+      os.replace(tmp, path)
+    except OSError:
+      pass
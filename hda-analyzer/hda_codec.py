@@ -14,7 +14,10 @@
 
 import os
 import struct
+from array import array
 from fcntl import ioctl
+from time import time
+from hashlib import sha1
 from hda_mixer import AlsaMixer, AlsaMixerElem, AlsaMixerElemId
 
 def __ioctl_val(val):
@@ -96,6 +99,14 @@ VERBS = {
   'SET_CODEC_RESET':		0x7ff
 }
 
+SET_VERBS = {
+  VERBS['SET_SDI_SELECT']: VERBS['GET_SDI_SELECT'],
+  VERBS['SET_PIN_WIDGET_CONTROL']: VERBS['GET_PIN_WIDGET_CONTROL'],
+  VERBS['SET_CONNECT_SEL']: VERBS['GET_CONNECT_SEL'],
+  VERBS['SET_EAPD_BTLENABLE']: VERBS['GET_EAPD_BTLENABLE'],
+  VERBS['SET_POWER_STATE']: VERBS['GET_POWER_STATE'],
+}
+
 PARAMS = {
   'VENDOR_ID':		0x00,
   'SUBSYSTEM_ID':	0x01,
@@ -205,6 +216,33 @@ GPIO_IDS = {
   'data': (VERBS['GET_GPIO_DATA'], VERBS['SET_GPIO_DATA'])
 }
 
+# responses which never change for the session
+CACHE_STATIC_VERBS = [VERBS['PARAMETERS'], VERBS['GET_CONNECT_LIST']]
+
+# cached GET verbs to invalidate when a SET verb is written
+CACHE_SET_VERBS = {
+  VERBS['SET_STREAM_FORMAT']: [VERBS['GET_STREAM_FORMAT']],
+  VERBS['SET_AMP_GAIN_MUTE']: [VERBS['GET_AMP_GAIN_MUTE']],
+  VERBS['SET_PROC_COEF']: [VERBS['GET_PROC_COEF']],
+  VERBS['SET_COEF_INDEX']: [VERBS['GET_COEF_INDEX'], VERBS['GET_PROC_COEF']],
+  VERBS['SET_PROC_STATE']: [VERBS['GET_PROC_STATE']],
+  VERBS['SET_CHANNEL_STREAMID']: [VERBS['GET_CONV']],
+  VERBS['SET_UNSOLICITED_ENABLE']: [VERBS['GET_UNSOLICITED_RESPONSE']],
+  VERBS['SET_PIN_SENSE']: [VERBS['GET_PIN_SENSE']],
+  VERBS['SET_BEEP_CONTROL']: [VERBS['GET_BEEP_CONTROL']],
+  VERBS['SET_DIGI_CONVERT_1']: [VERBS['GET_DIGI_CONVERT_1']],
+  VERBS['SET_DIGI_CONVERT_2']: [VERBS['GET_DIGI_CONVERT_1']],
+  VERBS['SET_VOLUME_KNOB_CONTROL']: [VERBS['GET_VOLUME_KNOB_CONTROL']],
+  VERBS['SET_CONFIG_DEFAULT_BYTES_0']: [VERBS['GET_CONFIG_DEFAULT']],
+  VERBS['SET_CONFIG_DEFAULT_BYTES_1']: [VERBS['GET_CONFIG_DEFAULT']],
+  VERBS['SET_CONFIG_DEFAULT_BYTES_2']: [VERBS['GET_CONFIG_DEFAULT']],
+  VERBS['SET_CONFIG_DEFAULT_BYTES_3']: [VERBS['GET_CONFIG_DEFAULT']],
+}
+for i in SET_VERBS:
+  CACHE_SET_VERBS[i] = [SET_VERBS[i]]
+for i in GPIO_IDS:
+  CACHE_SET_VERBS[GPIO_IDS[i][1]] = [GPIO_IDS[i][0]]
+
 EAPDBTL_BITS = {
   'BALANCED': 0,
   'EAPD': 1,
@@ -234,75 +272,216 @@ DIG1_BITS = {
 
 POWER_STATES = ["D0", "D1", "D2", "D3", "D3cold", "S3D3cold", "CLKSTOP", "EPSS"]
 
+WIDGET_CAP_BITS = [
+  ('STEREO', 0), ('IN_AMP', 1), ('OUT_AMP', 2), ('AMP_OVRD', 3),
+  ('FORMAT_OVRD', 4), ('STRIPE', 5), ('PROC_WID', 6), ('UNSOL_CAP', 7),
+  ('CONN_LIST', 8), ('DIGITAL', 9), ('POWER', 10), ('LR_SWAP', 11),
+  ('CP_CAPS', 12)
+]
+
+WIDGET_PINCAP_BITS = [
+  ('IMP_SENSE', 0), ('TRIG_REQ', 1), ('PRES_DETECT', 2), ('HP_DRV', 3),
+  ('OUT', 4), ('IN', 5), ('BALANCE', 6), ('HDMI', 7), ('EAPD', 16),
+  ('DP', 24), ('HBR', 27)
+]
+
+WIDGET_PINCAP_VREF_BITS = [
+  ('HIZ', 8), ('50', 9), ('GRD', 10), ('80', 12), ('100', 13)
+]
+
+JACK_CONNS = ["Jack", "N/A", "Fixed", "Both"]
+JACK_TYPES = ["Line Out", "Speaker", "HP Out", "CD", "SPDIF Out",
+              "Digital Out", "Modem Line", "Modem Hand",
+              "Line In", "Aux", "Mic", "Telephony", "SPDIF In",
+              "Digital In", "Reserved", "Other"]
+JACK_LOCATIONS = ["Ext", "Int", "Sep", "Oth"]
+
+def decode_bits(value, bits):
+  """return names of set bits, bits is a sequence of (name, bit) pairs"""
+  res = []
+  for name, bit in bits:
+    if value & (1 << bit):
+      res.append(name)
+  return res
+
+def get_jack_location(cfg):
+  bases = ["N/A", "Rear", "Front", "Left", "Right", "Top", "Bottom"]
+  specials = {0x07: "Rear Panel", 0x08: "Drive Bar",
+              0x17: "Riser", 0x18: "HDMI", 0x19: "ATAPI",
+              0x37: "Mobile-In", 0x38: "Mobile-Out"}
+  cfg = (cfg >> 24) & 0x3f
+  if cfg & 0x0f < 7:
+    return bases[cfg & 0x0f]
+  if cfg in specials:
+    return specials[cfg]
+  return "UNKNOWN"
+
+def get_jack_connector(cfg):
+  names = ["Unknown", "1/8", "1/4", "ATAPI", "RCA", "Optical",
+           "Digital", "Analog", "DIN", "XLR", "RJ11", "Comb",
+           None, None, None, "Other"]
+  cfg = (cfg >> 16) & 0x0f
+  return names[cfg] and names[cfg] or "UNKNOWN"
+
+def get_jack_color(cfg):
+  names = ["Unknown", "Black", "Grey", "Blue", "Green", "Red", "Orange",
+           "Yellow", "Purple", "Pink", None, None, None, None, "White",
+           "Other"]
+  cfg = (cfg >> 12) & 0x0f
+  return names[cfg] and names[cfg] or "UNKNOWN"
+
+class HDAAmpCapsInfo:
+
+  """
+  Decoded amplifier capabilities with precomputed value tables. The
+  instances are interned by the raw caps value (see HDA_amp_caps_info),
+  so all nodes and codecs with the same caps share one instance.
+  """
+
+  __slots__ = ('caps', 'ofs', 'nsteps', 'stepsize', 'mute', 'db', 'perc',
+               'strs')
+
+  def __init__(self, caps):
+    self.caps = caps
+    self.ofs = caps & 0x7f
+    self.nsteps = (caps >> 8) & 0x7f
+    self.stepsize = (caps >> 16) & 0x7f
+    self.mute = (caps >> 31) & 1 and True or False
+    step = (self.stepsize + 1) * 25
+    off = -self.ofs * step
+    self.db = []
+    self.perc = []
+    for val in range(256):
+      if val & 0x80:
+        self.db.append(-999999)
+      else:
+        self.db.append(off + min(val, self.nsteps) * step)
+      self.perc.append(self.nsteps and (val * 100) // self.nsteps or 0)
+    self.strs = None
+
+  def get_strs(self):
+    if self.strs is None:
+      self.strs = []
+      for val in range(256):
+        db = self.db[val & 0x7f]
+        res = val & 0x80 and "{mute-" or "{"
+        res += "0x%02x" % (val & 0x7f)
+        res += ":%02i.%idB" % (db // 100, db % 100)
+        res += ":%i%%}" % self.perc[val & 0x7f]
+        self.strs.append(res)
+    return self.strs
+
+AMP_CAPS_INFO = {}
+
+def HDA_amp_caps_info(caps):
+  """return interned HDAAmpCapsInfo for raw caps or None for empty caps"""
+  if caps == 0 or caps == ~0 or caps == 0xffffffff:
+    return None
+  info = AMP_CAPS_INFO.get(caps)
+  if info is None:
+    info = AMP_CAPS_INFO[caps] = HDAAmpCapsInfo(caps)
+  return info
+
+def HDA_amp_convert(infos, counts, vals):
+  """
+  convert raw amp values to dB (in 1/100) and percent lists in one pass,
+  infos[i] is HDAAmpCapsInfo (or None) for next counts[i] values
+  """
+  db = []
+  perc = []
+  pos = 0
+  for info, count in zip(infos, counts):
+    end = pos + count
+    if info is None:
+      db += [None] * count
+      perc += [None] * count
+    else:
+      dbt = info.db
+      perct = info.perc
+      for val in vals[pos:end]:
+        db.append(dbt[val & 0xff])
+        perc.append(perct[val & 0x7f])
+    pos = end
+  return db, perc
+
+def HDA_amp_levels(ampvals):
+  """update dB and percent levels of all given HDAAmpVal instances"""
+  infos = []
+  counts = []
+  vals = []
+  for ampval in ampvals:
+    infos.append(ampval.caps.info)
+    counts.append(len(ampval.vals))
+    vals += ampval.vals
+  db, perc = HDA_amp_convert(infos, counts, vals)
+  pos = 0
+  for ampval in ampvals:
+    end = pos + len(ampval.vals)
+    ampval.dbs = db[pos:end]
+    ampval.percs = perc[pos:end]
+    pos = end
+
 class HDAAmpCaps:
 
-  def __init__(self, codec, nid, dir):
+  __slots__ = ('codec', 'nid', 'dir', 'cloned', 'info')
+
+  def __init__(self, codec, nid, dir, caps=None):
     self.codec = codec
     self.nid = nid
     self.dir = dir
     self.cloned = False
-    self.reread()
+    self.reread(caps)
+
+  ofs = property(lambda self: self.info and self.info.ofs)
+  nsteps = property(lambda self: self.info and self.info.nsteps)
+  stepsize = property(lambda self: self.info and self.info.stepsize)
+  mute = property(lambda self: self.info and self.info.mute)
     
-  def reread(self):
-    caps = self.codec.param_read(self.nid,
-          PARAMS[self.dir == HDA_OUTPUT and 'AMP_OUT_CAP' or 'AMP_IN_CAP'])
-    if caps == ~0 or caps == 0:
+  def reread(self, value=None):
+    if value is None:
+      caps = self.codec.param_read(self.nid,
+            PARAMS[self.dir == HDA_OUTPUT and 'AMP_OUT_CAP' or 'AMP_IN_CAP'])
+    else:
+      caps = value
+    self.info = HDA_amp_caps_info(caps)
+    if self.info is None:
       if self.dir == HDA_INPUT:
         ccaps = self.codec.amp_caps_in
       else:
         ccaps = self.codec.amp_caps_out
       if ccaps:
         ccaps.clone(self)
-      else:
-        self.ofs = self.nsteps = self.stepsize = self.mute = None
-    else:
-      self.ofs = caps & 0x7f
-      self.nsteps = (caps >> 8) & 0x7f
-      self.stepsize = (caps >> 16) & 0x7f
-      self.mute = (caps >> 31) & 1 and True or False
 
   def clone(self, ampcaps):
-    ampcaps.ofs = self.ofs
-    ampcaps.nsteps = self.nsteps
-    ampcaps.stepsize = self.stepsize
-    ampcaps.mute = self.mute
+    ampcaps.info = self.info
     ampcaps.cloned = True
 
   def get_val_db(self, val):
-    if self.ofs is None:
+    info = self.info
+    if info is None:
       return None
-    if val & 0x80:
-      return -999999
-    range = (self.stepsize + 1) * 25
-    off = -self.ofs * range
-    if val > self.nsteps:
-      db = off + self.nsteps * range
-      if val != 0 or self.nsteps != 0:
-        print("val > nsteps? for nid 0x%02x" % self.nid, val, self.nsteps)
-    else:
-      db = off + val * range
-    return db
+    if val > info.nsteps and val < 0x80:
+      print("val > nsteps? for nid 0x%02x" % self.nid, val, info.nsteps)
+    return info.db[val & 0xff]
 
   def get_val_perc(self, val):
-    if self.ofs is None:
+    if self.info is None:
       return None
-    if self.nsteps == 0:
-      return 0
-    return (val * 100) // self.nsteps
+    return self.info.perc[val & 0xff]
 
   def get_val_str(self, val):
-    if self.ofs is None:
+    info = self.info
+    if info is None:
       return "0x%02x" % val
-    else:
-      db = self.get_val_db(val & 0x7f)
-      res = val & 0x80 and "{mute-" or "{"
-      res += "0x%02x" % (val & 0x7f)
-      res += ":%02i.%idB" % (db // 100, db % 100)
-      res += ":%i%%}" % (self.get_val_perc(val & 0x7f))
-      return res
+    if val & 0x7f > info.nsteps:
+      self.get_val_db(val & 0x7f)
+    return info.get_strs()[val & 0xff]
 
 class HDAAmpVal:
 
+  __slots__ = ('codec', 'node', 'dir', 'caps', 'nid', 'stereo', 'indices',
+               'origin_vals', 'vals', 'dbs', 'percs')
+
   def __init__(self, codec, node, dir, caps):
     self.codec = codec
     self.node = node
@@ -315,6 +494,7 @@ class HDAAmpVal:
     self.stereo = node.stereo
     self.indices = 1
     self.origin_vals = None
+    self.dbs = self.percs = None
     if dir == HDA_INPUT:
       if node.wtype_id == 'PIN':
         self.indices = 1
@@ -333,6 +513,7 @@ class HDAAmpVal:
     else:
       indice = idx
       dir |= (1 << 12) | (1 << 13)
+    self.dbs = self.percs = None
     self.codec.rw(self.nid, verb, dir | (indice << 8) | self.vals[idx])
 
   def set_mute(self, idx, mute):
@@ -353,16 +534,20 @@ class HDAAmpVal:
     self.__write_val(idx)
     return changed
     
-  def reread(self):
+  def state_verbs(self):
+    """return (nid, verb, param) list to read all amplifier values"""
     dir = self.dir == HDA_OUTPUT and (1<<15) or (0<<15)
-    self.vals = []
     verb = VERBS['GET_AMP_GAIN_MUTE']
+    res = []
     for i in range(self.indices):
       if self.stereo:
-        val = self.codec.rw(self.nid, verb, (1 << 13) | dir | i)
-        self.vals.append(val)
-      val = self.codec.rw(self.nid, verb, (0 << 13) | dir | i)
-      self.vals.append(val)
+        res.append((self.nid, verb, (1 << 13) | dir | i))
+      res.append((self.nid, verb, (0 << 13) | dir | i))
+    return res
+
+  def reread(self):
+    self.vals = list(self.codec.rw_batch(self.state_verbs()))
+    self.dbs = self.percs = None
     if self.origin_vals == None:
       self.origin_vals = self.vals[:]
 
@@ -385,14 +570,19 @@ class HDAAmpVal:
       return [self.vals[idx*2], self.vals[idx*2+1]]
     return self.vals[idx]
 
+  def levels(self):
+    """return dB and percent lists for all values"""
+    if self.dbs is None:
+      self.codec.amp_levels()
+      if self.dbs is None:	# not yet in codec.nodes
+        HDA_amp_levels([self])
+    return self.dbs, self.percs
+
   def get_val_db(self, idx):
-    vals = self.get_val(idx)
-    if type(vals) != type([]):
-      vals = [vals]
-    res = []
-    for val in vals:
-      res.append(self.caps.get_val_db(val))
-    return res
+    dbs = self.levels()[0]
+    if self.stereo:
+      return dbs[idx*2:idx*2+2]
+    return [dbs[idx]]
 
   def get_val_str(self, idx):
 
@@ -412,7 +602,31 @@ class HDARootNode:
   def name(self):
     return self._name
 
+# node fields (beside the amp values) which are not part of static_state()
+HDA_NODE_DYNAMIC = ['active_connection', 'pinctls', 'pincap_eapdbtls', 'pwr',
+                    'digi1', 'vol_knb', 'sdi_select', 'unsol']
+
 class HDANode:
+
+  """
+  Only the raw register values are stored, the capability and state
+  names are decoded on access (see the properties below).
+  """
+
+  __slots__ = (
+    'codec', 'nid', 'wcaps', 'stereo', 'in_amp', 'out_amp', 'amp_ovrd',
+    'format_ovrd', 'stripe', 'proc_wid', 'unsol_cap', 'conn_list', 'digital',
+    'power', 'lr_swap', 'cp_caps', 'chan_cnt_ext', 'wdelay', 'wtype',
+    'channels', 'wtype_id',
+    'origin_active_connection', 'origin_pwr', 'origin_digi1',
+    'origin_pincap_eapdbtls', 'origin_pinctls', 'origin_vol_knb',
+    'origin_sdi_select', 'disable_reread',
+    'connections', 'active_connection', 'amp_caps_in', 'amp_vals_in',
+    'amp_caps_out', 'amp_vals_out', 'pincaps', 'defcfg_pincaps', 'pinctls',
+    'pincap_eapdbtls', 'pin_sense', 'vol_knb_cap', 'vol_knb', 'conv',
+    'sdi_select', 'digi1', 'pcm_rate', 'pcm_bit', 'pcm_stream', 'proc_caps',
+    'unsol', 'pwr_state', 'pwr', 'realtek_coeff_proc', 'realtek_coeff_index'
+  )
   
   def __init__(self, codec, nid, cache=True):
     self.codec = codec
@@ -438,21 +652,6 @@ class HDANode:
     self.wtype_id = WIDGET_TYPE_IDS[self.wtype]
     if self.wtype_id == 'VOL_KNB': self.conn_list = True
 
-    self.wcaps_list = []
-    if self.stereo: self.wcaps_list.append('STEREO')
-    if self.in_amp: self.wcaps_list.append('IN_AMP')
-    if self.out_amp: self.wcaps_list.append('OUT_AMP')
-    if self.amp_ovrd: self.wcaps_list.append('AMP_OVRD')
-    if self.format_ovrd: self.wcaps_list.append('FORMAT_OVRD')
-    if self.stripe: self.wcaps_list.append('STRIPE')
-    if self.proc_wid: self.wcaps_list.append('PROC_WID')
-    if self.unsol_cap: self.wcaps_list.append('UNSOL_CAP')
-    if self.conn_list: self.wcaps_list.append('CONN_LIST')
-    if self.digital: self.wcaps_list.append('DIGITAL')
-    if self.power: self.wcaps_list.append('POWER')
-    if self.lr_swap: self.wcaps_list.append('LR_SWAP')
-    if self.cp_caps: self.wcaps_list.append('CP_CAPS')
-
     self.origin_active_connection = None
     self.origin_pwr = None
     self.origin_digi1 = None
@@ -464,7 +663,76 @@ class HDANode:
     self.disable_reread = False
 
     self.reread()
-    
+
+  wcaps_list = property(lambda self: decode_bits(self.wcaps | \
+                          (self.conn_list and (1 << 8) or 0), WIDGET_CAP_BITS))
+  pincap = property(lambda self: decode_bits(self.pincaps, WIDGET_PINCAP_BITS))
+  pincap_vref = property(lambda self: decode_bits(self.pincaps,
+                                                  WIDGET_PINCAP_VREF_BITS))
+  jack_conn_name = property(lambda self: JACK_CONNS[(self.defcfg_pincaps >> 30) & 0x03])
+  jack_type_name = property(lambda self: JACK_TYPES[(self.defcfg_pincaps >> 20) & 0x0f])
+  jack_location_name = property(lambda self: JACK_LOCATIONS[(self.defcfg_pincaps >> 28) & 0x03])
+  jack_location2_name = property(lambda self: get_jack_location(self.defcfg_pincaps))
+  jack_connector_name = property(lambda self: get_jack_connector(self.defcfg_pincaps))
+  jack_color_name = property(lambda self: get_jack_color(self.defcfg_pincaps))
+  defcfg_assoc = property(lambda self: (self.defcfg_pincaps >> 4) & 0x0f)
+  defcfg_sequence = property(lambda self: (self.defcfg_pincaps >> 0) & 0x0f)
+  defcfg_misc = property(lambda self: decode_bits(self.defcfg_pincaps,
+                                                  [('NO_PRESENCE', 8)]))
+  pinctl = property(lambda self: decode_bits(self.pinctls,
+                                    PIN_WIDGET_CONTROL_BITS.items()))
+  pincap_eapdbtl = property(lambda self: decode_bits(self.pincap_eapdbtls,
+                                            EAPDBTL_BITS.items()))
+  vol_knb_delta = property(lambda self: (self.vol_knb_cap >> 7) & 1)
+  vol_knb_steps = property(lambda self: self.vol_knb_cap & 0x7f)
+  vol_knb_direct = property(lambda self: (self.vol_knb >> 7) & 1)
+  vol_knb_val = property(lambda self: self.vol_knb & 0x7f)
+  aud_stream = property(lambda self: (self.conv >> 4) & 0x0f)
+  aud_channel = property(lambda self: (self.conv >> 0) & 0x0f)
+  pcm_rates = property(lambda self: self.codec.analyze_pcm_rates(self.pcm_rate))
+  pcm_bits = property(lambda self: self.codec.analyze_pcm_bits(self.pcm_bit))
+  pcm_streams = property(lambda self: self.codec.analyze_pcm_streams(self.pcm_stream))
+  proc_benign = property(lambda self: self.proc_caps & 1 and True or False)
+  proc_numcoef = property(lambda self: (self.proc_caps >> 8) & 0xff)
+  unsol_tag = property(lambda self: self.unsol & 0x3f)
+  unsol_enabled = property(lambda self: (self.unsol & (1 << 7)) and True or False)
+  pwr_states = property(lambda self: decode_bits(self.pwr_state,
+                                       zip(POWER_STATES, range(len(POWER_STATES)))))
+  pwr_setting = property(lambda self: self.pwr & 0x0f)
+  pwr_actual = property(lambda self: (self.pwr >> 4) & 0x0f)
+
+  @property
+  def pinctl_vref(self):
+    if not self.pincaps & 0x3700:	# no VREF bits (see pincap_vref)
+      return None
+    return PIN_WIDGET_CONTROL_VREF[self.pinctls & 0x07]
+
+  @property
+  def pin_presence(self):
+    if self.pin_sense is None:
+      return None
+    return (self.pin_sense >> 31) & 1 and True or False
+
+  @property
+  def dig1(self):
+    if not self.digital:
+      return []
+    return decode_bits(self.digi1, DIG1_BITS.items())
+
+  @property
+  def dig1_category(self):
+    if not self.digital:
+      return None
+    return (self.digi1 >> 8) & 0x7f
+
+  @property
+  def pwr_setting_name(self):
+    return self.pwr_setting < 4 and POWER_STATES[self.pwr_setting] or "UNKNOWN"
+
+  @property
+  def pwr_actual_name(self):
+    return self.pwr_actual < 4 and POWER_STATES[self.pwr_actual] or "UNKNOWN"
+
   def wtype_name(self):
     name = WIDGET_TYPE_NAMES[self.wtype]
     if not name:
@@ -499,140 +767,128 @@ class HDANode:
       self.pwr = pwr
       if self.origin_pwr is None:
         self.origin_pwr = pwr
-      self.pwr_setting = pwr & 0x0f
-      self.pwr_actual = (pwr >> 4) & 0x0f
-      self.pwr_setting_name = self.pwr_setting < 4 and POWER_STATES[self.pwr_setting] or "UNKNOWN"
-      self.pwr_actual_name = self.pwr_actual < 4 and POWER_STATES[self.pwr_actual] or "UNKNOWN"
     
   def reread(self):
-  
-    def get_jack_location(cfg):
-      bases = ["N/A", "Rear", "Front", "Left", "Right", "Top", "Bottom"]
-      specials = {0x07: "Rear Panel", 0x08: "Drive Bar",
-                  0x17: "Riser", 0x18: "HDMI", 0x19: "ATAPI",
-                  0x37: "Mobile-In", 0x38: "Mobile-Out"}
-      cfg = (cfg >> 24) & 0x3f
-      if cfg & 0x0f < 7:
-        return bases[cfg & 0x0f]
-      if cfg in specials:
-        return specials[cfg]
-      return "UNKNOWN"
-      
-    def get_jack_connector(cfg):
-      names = ["Unknown", "1/8", "1/4", "ATAPI", "RCA", "Optical",
-               "Digital", "Analog", "DIN", "XLR", "RJ11", "Comb",
-               None, None, None, "Other"]
-      cfg = (cfg >> 16) & 0x0f
-      return names[cfg] and names[cfg] or "UNKNOWN"
-      
-    def get_jack_color(cfg):
-      names = ["Unknown", "Black", "Grey", "Blue", "Green", "Red", "Orange",
-               "Yellow", "Purple", "Pink", None, None, None, None, "White",
-               "Other"]
-      cfg = (cfg >> 12) & 0x0f
-      return names[cfg] and names[cfg] or "UNKNOWN"
-  
+    # queue all reads which depend only on the widget capabilities
+    nid = self.nid
+    batch = self.codec.batch()
+    if self.conn_list:
+      connlen = batch.param(nid, PARAMS['CONNLIST_LEN'])
+      if not self.wtype_id in ['AUD_MIX', 'VOL_KNB', 'POWER']:
+        connsel = batch.add(nid, VERBS['GET_CONNECT_SEL'], 0)
+    if self.in_amp:
+      ampcapin = batch.param(nid, PARAMS['AMP_IN_CAP'])
+    if self.out_amp:
+      ampcapout = batch.param(nid, PARAMS['AMP_OUT_CAP'])
+    if self.wtype_id == 'PIN':
+      pincap = batch.param(nid, PARAMS['PIN_CAP'])
+      defcfg = batch.add(nid, VERBS['GET_CONFIG_DEFAULT'], 0)
+      pinctl = batch.add(nid, VERBS['GET_PIN_WIDGET_CONTROL'], 0)
+    elif self.wtype_id == 'VOL_KNB':
+      volknbcap = batch.param(nid, PARAMS['VOL_KNB_CAP'])
+      volknb = batch.add(nid, VERBS['GET_VOLUME_KNOB_CONTROL'], 0)
+    elif self.wtype_id in ['AUD_IN', 'AUD_OUT']:
+      conv = batch.add(nid, VERBS['GET_CONV'], 0)
+      if self.digital:
+        digi1 = batch.add(nid, VERBS['GET_DIGI_CONVERT_1'], 0)
+      if self.format_ovrd:
+        pcm = batch.param(nid, PARAMS['PCM'])
+        stream = batch.param(nid, PARAMS['STREAM'])
+    if self.proc_wid:
+      proccap = batch.param(nid, PARAMS['PROC_CAP'])
+    if self.unsol_cap:
+      unsol = batch.add(nid, VERBS['GET_UNSOLICITED_RESPONSE'], 0)
+    if self.power:
+      pwrcap = batch.param(nid, PARAMS['POWER_STATE'])
+      pwr = batch.add(nid, VERBS['GET_POWER_STATE'], 0)
+    # NID 0x20 == Realtek Define Registers
+    realtek = self.codec.vendor_id == 0x10ec and nid == 0x20
+    if realtek:
+      coefproc = batch.add(nid, VERBS['GET_PROC_COEF'], 0)
+      coefidx = batch.add(nid, VERBS['GET_COEF_INDEX'], 0)
+    res = batch.run()
+
     self.connections = None
     self.active_connection = None
     if self.conn_list:
-      self.connections = self.codec.get_connections(self.nid)
+      self.connections = self.codec.get_connections(nid, res[connlen])
       if not self.wtype_id in ['AUD_MIX', 'VOL_KNB', 'POWER']:
-        self.active_connection = self.codec.rw(self.nid, VERBS['GET_CONNECT_SEL'], 0)
+        self.active_connection = res[connsel]
         if self.origin_active_connection == None:
           self.origin_active_connection = self.active_connection
     if self.in_amp:
-      self.amp_caps_in = HDAAmpCaps(self.codec, self.nid, HDA_INPUT)
+      self.amp_caps_in = HDAAmpCaps(self.codec, nid, HDA_INPUT, res[ampcapin])
       self.amp_vals_in = HDAAmpVal(self.codec, self, HDA_INPUT, self.amp_caps_in)
     if self.out_amp:
-      self.amp_caps_out = HDAAmpCaps(self.codec, self.nid, HDA_OUTPUT)
+      self.amp_caps_out = HDAAmpCaps(self.codec, nid, HDA_OUTPUT, res[ampcapout])
       self.amp_vals_out = HDAAmpVal(self.codec, self, HDA_OUTPUT, self.amp_caps_out)
     if self.wtype_id == 'PIN':
-      jack_conns = ["Jack", "N/A", "Fixed", "Both"]
-      jack_types = ["Line Out", "Speaker", "HP Out", "CD", "SPDIF Out",
-                    "Digital Out", "Modem Line", "Modem Hand",
-                    "Line In", "Aux", "Mic", "Telephony", "SPDIF In",
-                    "Digital In", "Reserved", "Other"]
-      jack_locations = ["Ext", "Int", "Sep", "Oth"]
-
-      caps = self.codec.param_read(self.nid, PARAMS['PIN_CAP'])
-      self.pincaps = caps
-      self.pincap = []
-      if caps & (1 << 0): self.pincap.append('IMP_SENSE')
-      if caps & (1 << 1): self.pincap.append('TRIG_REQ')
-      if caps & (1 << 2): self.pincap.append('PRES_DETECT')
-      if caps & (1 << 3): self.pincap.append('HP_DRV')
-      if caps & (1 << 4): self.pincap.append('OUT')
-      if caps & (1 << 5): self.pincap.append('IN')
-      if caps & (1 << 6): self.pincap.append('BALANCE')
-      if caps & (1 << 7): self.pincap.append('HDMI')
-      if caps & (1 << 16): self.pincap.append('EAPD')
-      if caps & (1 << 24): self.pincap.append('DP')	# display port
-      if caps & (1 << 27): self.pincap.append('HBR')
-      self.pincap_vref = []
-      if caps & (1 << 8): self.pincap_vref.append('HIZ')
-      if caps & (1 << 9): self.pincap_vref.append('50')
-      if caps & (1 << 10): self.pincap_vref.append('GRD')
-      if caps & (1 << 12): self.pincap_vref.append('80')
-      if caps & (1 << 13): self.pincap_vref.append('100')
+      self.pincaps = res[pincap]
       self.reread_eapdbtl()
-      caps = self.codec.rw(self.nid, VERBS['GET_CONFIG_DEFAULT'], 0)
-      self.defcfg_pincaps = caps
-      self.jack_conn_name = jack_conns[(caps >> 30) & 0x03]
-      self.jack_type_name = jack_types[(caps >> 20) & 0x0f]
-      self.jack_location_name = jack_locations[(caps >> 28) & 0x03]
-      self.jack_location2_name = get_jack_location(caps)
-      self.jack_connector_name = get_jack_connector(caps)
-      self.jack_color_name = get_jack_color(caps)
-      self.defcfg_assoc = (caps >> 4) & 0x0f
-      self.defcfg_sequence = (caps >> 0) & 0x0f
-      self.defcfg_misc = []
-      if caps & (1 << 8): self.defcfg_misc.append('NO_PRESENCE')
-      self.reread_pin_widget_control()
+      self.reread_pin_sense()
+      self.defcfg_pincaps = res[defcfg]
+      self.reread_pin_widget_control(res[pinctl])
     elif self.wtype_id == 'VOL_KNB':
-      cap = self.codec.param_read(self.nid, PARAMS['VOL_KNB_CAP'])
-      self.vol_knb_delta = (cap >> 7) & 1
-      self.vol_knb_steps = cap & 0x7f
-      self.reread_vol_knb()
+      self.vol_knb_cap = res[volknbcap]
+      self.reread_vol_knb(res[volknb])
     elif self.wtype_id in ['AUD_IN', 'AUD_OUT']:
-      conv = self.codec.rw(self.nid, VERBS['GET_CONV'], 0)
-      self.aud_stream = (conv >> 4) & 0x0f
-      self.aud_channel = (conv >> 0) & 0x0f
+      self.conv = res[conv]
       self.reread_sdi_select()
-      self.reread_dig1()
+      if self.digital:
+        self.reread_dig1(res[digi1])
+      else:
+        self.reread_dig1()
       if self.format_ovrd:
-        pcm = self.codec.param_read(self.nid, PARAMS['PCM'])
-        stream = self.codec.param_read(self.nid, PARAMS['STREAM'])
-        self.pcm_rate = pcm & 0xffff
-        self.pcm_rates = self.codec.analyze_pcm_rates(self.pcm_rate)
-        self.pcm_bit = pcm >> 16
-        self.pcm_bits = self.codec.analyze_pcm_bits(self.pcm_bit)
-        self.pcm_stream = stream
-        self.pcm_streams = self.codec.analyze_pcm_streams(self.pcm_stream)
+        self.pcm_rate = res[pcm] & 0xffff
+        self.pcm_bit = res[pcm] >> 16
+        self.pcm_stream = res[stream]
     if self.proc_wid:
-      proc_caps = self.codec.param_read(self.nid, PARAMS['PROC_CAP'])
-      self.proc_benign = proc_caps & 1 and True or False
-      self.proc_numcoef = (proc_caps >> 8) & 0xff
+      self.proc_caps = res[proccap]
     if self.unsol_cap:
-      unsol = self.codec.rw(self.nid, VERBS['GET_UNSOLICITED_RESPONSE'], 0)
-      self.unsol_tag = unsol & 0x3f
-      self.unsol_enabled = (unsol & (1 << 7)) and True or False
+      self.unsol = res[unsol]
     if self.power:
-      pwr = self.codec.param_read(self.nid, PARAMS['POWER_STATE'])
-      self.pwr_state = pwr
-      self.pwr_states = []
-      for a in range(len(POWER_STATES)):
-        if pwr & (1 << a):
-          self.pwr_states.append(POWER_STATES[a])
-      self.reread_pwr()
-    # NID 0x20 == Realtek Define Registers
-    if self.codec.vendor_id == 0x10ec and self.nid == 0x20:
-      self.realtek_coeff_proc = self.codec.rw(self.nid, VERBS['GET_PROC_COEF'], 0)
-      self.realtek_coeff_index = self.codec.rw(self.nid, VERBS['GET_COEF_INDEX'], 0)
+      self.pwr_state = res[pwrcap]
+      self.reread_pwr(res[pwr])
+    if realtek:
+      self.realtek_coeff_proc = res[coefproc]
+      self.realtek_coeff_index = res[coefidx]
+
+  def state_verbs(self):
+    """return (nid, verb, param) list to read the volatile node state"""
+    nid = self.nid
+    res = []
+    if self.active_connection != None:
+      res.append((nid, VERBS['GET_CONNECT_SEL'], 0))
+    if self.in_amp:
+      res += self.amp_vals_in.state_verbs()
+    if self.out_amp:
+      res += self.amp_vals_out.state_verbs()
+    if self.wtype_id == 'PIN':
+      res.append((nid, VERBS['GET_PIN_WIDGET_CONTROL'], 0))
+      if self.pincaps & (1 << 16):	# EAPD
+        res.append((nid, VERBS['GET_EAPD_BTLENABLE'], 0))
+      if self.pincaps & (1 << 2):	# PRES_DETECT
+        res.append((nid, VERBS['GET_PIN_SENSE'], 0))
+    elif self.wtype_id == 'VOL_KNB':
+      res.append((nid, VERBS['GET_VOLUME_KNOB_CONTROL'], 0))
+    elif self.wtype_id in ['AUD_IN', 'AUD_OUT']:
+      res.append((nid, VERBS['GET_CONV'], 0))
+      if self.sdi_select != None:
+        res.append((nid, VERBS['GET_SDI_SELECT'], 0))
+      if self.digital:
+        res.append((nid, VERBS['GET_DIGI_CONVERT_1'], 0))
+    if self.unsol_cap:
+      res.append((nid, VERBS['GET_UNSOLICITED_RESPONSE'], 0))
+    if self.power:
+      res.append((nid, VERBS['GET_POWER_STATE'], 0))
+    if hasattr(self, 'realtek_coeff_proc'):
+      res.append((nid, VERBS['GET_PROC_COEF'], 0))
+      res.append((nid, VERBS['GET_COEF_INDEX'], 0))
+    return res
 
   def reread_eapdbtl(self, value=None):
-    self.pincap_eapdbtl = []
     self.pincap_eapdbtls = 0
-    if not 'EAPD' in self.pincap:
+    if not self.pincaps & (1 << 16):	# EAPD
       return
     if value is None:
       val = self.codec.rw(self.nid, VERBS['GET_EAPD_BTLENABLE'], 0)
@@ -641,9 +897,6 @@ class HDANode:
     self.pincap_eapdbtls = val
     if self.origin_pincap_eapdbtls is None:
       self.origin_pincap_eapdbtls = val
-    for name in EAPDBTL_BITS:
-      bit = EAPDBTL_BITS[name]
-      if val & (1 << bit): self.pincap_eapdbtl.append(name)
 
   def eapdbtl_set_value(self, name, value):
     mask = 1 << EAPDBTL_BITS[name]
@@ -657,6 +910,16 @@ class HDANode:
     self.reread_eapdbtl()
     return changed
 
+  def reread_pin_sense(self, value=None):
+    self.pin_sense = None
+    if not self.pincaps & (1 << 2):	# PRES_DETECT
+      return
+    if value is None:
+      val = self.codec.rw(self.nid, VERBS['GET_PIN_SENSE'], 0)
+    else:
+      val = value
+    self.pin_sense = val
+
   def reread_pin_widget_control(self, value=None):
     if value is None:
       pinctls = self.codec.rw(self.nid, VERBS['GET_PIN_WIDGET_CONTROL'], 0)
@@ -665,13 +928,6 @@ class HDANode:
     self.pinctls = pinctls
     if self.origin_pinctls is None:
       self.origin_pinctls = pinctls
-    self.pinctl = []
-    for name in PIN_WIDGET_CONTROL_BITS:
-      bit = PIN_WIDGET_CONTROL_BITS[name]
-      if pinctls & (1 << bit): self.pinctl.append(name)
-    self.pinctl_vref = None
-    if self.pincap_vref:
-      self.pinctl_vref = PIN_WIDGET_CONTROL_VREF[pinctls & 0x07]
 
   def pin_widget_control_set_value(self, name, value):
     if name in PIN_WIDGET_CONTROL_BITS:
@@ -699,8 +955,6 @@ class HDANode:
     self.vol_knb = cap
     if self.origin_vol_knb is None:
       self.origin_vol_knb = cap
-    self.vol_knb_direct = (cap >> 7) & 1
-    self.vol_knb_val = cap & 0x7f
     
   def vol_knb_set_value(self, name, value):
     if name == 'direct':
@@ -739,8 +993,6 @@ class HDANode:
     return changed
 
   def reread_dig1(self, value=None):
-    self.dig1 = []
-    self.dig1_category = None
     if not self.digital:
       return
     if value is None:
@@ -750,10 +1002,6 @@ class HDANode:
     self.digi1 = digi1
     if self.origin_digi1 is None:
       self.origin_digi1 = digi1
-    for name in DIG1_BITS:
-      bit = DIG1_BITS[name]
-      if digi1 & (1 << bit): self.dig1.append(name)
-    self.dig1_category = (digi1 >> 8) & 0x7f
 
   def dig1_set_value(self, name, value):
     if name == 'category':
@@ -846,6 +1094,40 @@ class HDANode:
       self.reread_dig1(digi1)    
     self.disable_reread = False
 
+  def static_state(self):
+    """
+    return the fields given by the hardware and the BIOS (capabilities,
+    connections, default config) as a tuple
+    """
+    res = [self.nid, self.wcaps, tuple(self.connections or [])]
+    for amp, caps in ((self.in_amp, 'amp_caps_in'),
+                      (self.out_amp, 'amp_caps_out')):
+      if amp:
+        caps = getattr(self, caps)
+        res.append((caps.ofs, caps.nsteps, caps.stepsize, caps.mute))
+    if self.wtype_id == 'PIN':
+      res += [self.pincaps, self.defcfg_pincaps]
+    elif self.wtype_id == 'VOL_KNB':
+      res.append(self.vol_knb_cap)
+    elif self.wtype_id in ['AUD_IN', 'AUD_OUT'] and self.format_ovrd:
+      res += [self.pcm_rate, self.pcm_bit, self.pcm_stream]
+    if self.proc_wid:
+      res.append(self.proc_caps)
+    if self.power:
+      res.append(self.pwr_state)
+    return tuple(res)
+
+  def dynamic_state(self):
+    """return the fields changed by the driver or the user as a tuple"""
+    res = [self.nid]
+    for amp, vals in ((self.in_amp, 'amp_vals_in'),
+                      (self.out_amp, 'amp_vals_out')):
+      if amp:
+        res.append(tuple(getattr(self, vals).vals))
+    for name in HDA_NODE_DYNAMIC:
+      res.append(getattr(self, name, None))
+    return tuple(res)
+
   def get_device(self):
     return self.codec.get_device(self.nid)
 
@@ -874,6 +1156,15 @@ class HDANode:
       res.append(e)
     return res
 
+  def conn_amp_index(self, dst_node):
+    # return input amp index of dst_node for connection from this node
+    if dst_node.connections and \
+       dst_node.amp_vals_in.indices == len(dst_node.connections):
+      if not self.nid in dst_node.connections:
+        raise ValueError("nid 0x%02x is not connected to nid 0x%02x (%s, %s)" % (dst_node.nid, self.nid, repr(self.connections), repr(dst_node.connections)))
+      return dst_node.connections.index(self.nid)
+    return 0
+
   def get_conn_amp_vals_str(self, dst_node):
     # return amp values for connection between this and dst_node
     res = []
@@ -882,11 +1173,7 @@ class HDANode:
     else:
       res.append(None)
     if dst_node.in_amp:
-      idx = 0
-      if dst_node.amp_vals_in.indices == dst_node.connections:
-        if not self.nid in dst_node.connections:
-          raise ValueError("nid 0x%02x is not connected to nid 0x%02x (%s, %s)" % (dst_node.nid, self.nid, repr(self.connections), repr(dst_node.connections)))
-        idx = dst_node.connections.index(self.nid)
+      idx = self.conn_amp_index(dst_node)
       res.append(dst_node.amp_vals_in.get_val_str(idx))
     else:
       res.append(None)
@@ -907,11 +1194,7 @@ class HDANode:
         else:
           res[idx] = vals[idx]
     if dst_node.in_amp:
-      idx = 0
-      if dst_node.amp_vals_in.indices == dst_node.connections:
-        if not self.nid in dst_node.connections:
-          raise ValueError("nid 0x%02x is not connected to nid 0x%02x (%s, %s)" % (dst_node.nid, self.nid, repr(self.connections), repr(dst_node.connections)))
-        idx = dst_node.connections.index(self.nid)
+      idx = self.conn_amp_index(dst_node)
       vals = dst_node.amp_vals_in.get_val_db(idx)
       for idx in range(len(vals)):
         if res[idx]:
@@ -922,10 +1205,72 @@ class HDANode:
       return True
     limit = self.wtype_id == 'AUD_OUT' and -3200 or -1200
     for r in res:
-      if r >= limit:
+      if r is not None and r >= limit:
         return True
     return False
 
+class HDALazyNodes(dict):
+
+  """
+  nid -> node mapping for a fixed set of nids, the nodes are created
+  by create() on the first access; keys(), len() and 'in' cover all nids
+  """
+
+  def __init__(self, nids):
+    dict.__init__(self)
+    self.nids = nids
+
+  def create(self, nid):
+    raise NotImplementedError
+
+  def __missing__(self, nid):
+    if not nid in self.nids:
+      raise KeyError(nid)
+    node = self.create(nid)
+    dict.__setitem__(self, nid, node)
+    return node
+
+  def __contains__(self, nid):
+    return nid in self.nids
+
+  def __iter__(self):
+    return iter(self.nids)
+
+  def __len__(self):
+    return len(self.nids)
+
+  def get(self, nid, default=None):
+    if nid in self.nids:
+      return self[nid]
+    return default
+
+  def keys(self):
+    return list(self.nids)
+
+  def values(self):
+    return [self[nid] for nid in self.nids]
+
+  def items(self):
+    return [(nid, self[nid]) for nid in self.nids]
+
+  def created(self):
+    """return the already created nodes"""
+    return list(dict.values(self))
+
+class HDANodes(HDALazyNodes):
+
+  """widget nodes of the codec, created on demand in the lazy mode"""
+
+  def __init__(self, codec, nids, lazy=False):
+    HDALazyNodes.__init__(self, nids)
+    self.codec = codec
+    if not lazy:
+      for nid in nids:
+        self[nid]
+
+  def create(self, nid):
+    return HDANode(self.codec, nid)
+
 class HDAGPIO:
 
   def __init__(self, codec, nid):
@@ -935,10 +1280,15 @@ class HDAGPIO:
     self.disable_reread = False
     self.reread()
 
-  def reread(self):
-    self.val = {}
+  def state_verbs(self):
+    """return (nid, verb, param) list to read all GPIO registers"""
+    res = []
     for i in GPIO_IDS:
-     self.val[i] = self.codec.rw(self.nid, GPIO_IDS[i][0], 0)
+      res.append((self.nid, GPIO_IDS[i][0], 0))
+    return res
+
+  def reread(self):
+    self.val = dict(zip(GPIO_IDS, self.codec.rw_batch(self.state_verbs())))
     if self.originval == None:
       self.originval = self.val.copy()
 
@@ -1001,29 +1351,39 @@ class HDACard:
     if not self.fd is None:
       os.close(self.fd)
 
-class HDACodec:
+class HDABackend:
 
-  afg = None
-  mfg = None
-  vendor_id = None
-  subsystem_id = None
-  revision_id = None
+  """
+  Verb transport under HDACodec. The verb() method executes one verb,
+  verbs() a list of (nid, verb, param) tuples and wcap() returns the
+  widget capabilities. The hwaccess flag tells that SET verbs are really
+  executed (not only emulated from a static dump).
+  """
+
+  hwaccess = False
+  proc_codec = None
+
+  def verb(self, nid, verb, param):
+    raise NotImplementedError
 
-  def __init__(self, card=0, device=0, clonefd=None):
+  def verbs(self, verbs):
+    res = array('I')
+    for nid, verb, param in verbs:
+      res.append(self.verb(nid, verb, param))
+    return res
+
+  def wcap(self, nid):
+    return self.verb(nid, VERBS['PARAMETERS'], PARAMS['AUDIO_WIDGET_CAP'])
+
+class HDAHwdepBackend(HDABackend):
+
+  """the kernel hwdep interface (/dev/snd/hwC*D*)"""
+
+  hwaccess = True
+
+  def __init__(self, card, device, clonefd=None):
     self.fd = None
-    self.hwaccess = True
-    ctl_fd = None
-    self.exporter = None
-    self.exporta = []
-    if type(1) == type(card):
-      self.device = device
-      self.card = card
-      self.mcard = HDACard(card)
-      ctl_fd = self.mcard.fd
-    else:
-      self.device = device
-      self.mcard = card
-      self.card = card.card
+    self.batch_buf = bytearray(64 * 8)
     if not clonefd:
       self.fd = os.open("/dev/snd/hwC%sD%s" % (card, device), os.O_RDWR)
     else:
@@ -1037,26 +1397,183 @@ class HDACodec:
     self.version = struct.unpack('I', res)
     if self.version[0] < 0x00010000:	# 1.0.0
       raise IOError("unknown HDA hwdep version")
-    self.mixer = AlsaMixer(self.card, ctl_fd=ctl_fd)
-    self.parse_proc()
 
   def __del__(self):
     if not self.fd is None:
       os.close(self.fd)
 
+  def verb(self, nid, verb, param):
+    res = ioctl(self.fd, IOCTL_VERB_WRITE,
+                struct.pack('II', (nid << 24) | (verb << 8) | param, 0))
+    return struct.unpack('II', res)[1]
+
+  def verbs(self, verbs):
+    # the hwdep interface executes only one verb per ioctl, so at least
+    # reuse one preallocated buffer for the whole batch
+    size = len(verbs) * 8
+    if len(self.batch_buf) < size:
+      self.batch_buf = bytearray(size)
+    buf = self.batch_buf
+    pack_into = struct.pack_into
+    pos = 0
+    for nid, verb, param in verbs:
+      pack_into('II', buf, pos, (nid << 24) | (verb << 8) | param, 0)
+      pos += 8
+    view = memoryview(buf)
+    fd = self.fd
+    for pos in range(0, size, 8):
+      ioctl(fd, IOCTL_VERB_WRITE, view[pos:pos+8], True)
+    vals = array('I')
+    vals.frombytes(view[:size])
+    view.release()
+    return vals[1::2]
+
+  def wcap(self, nid):
+    res = ioctl(self.fd, IOCTL_GET_WCAPS, struct.pack('II', nid << 24, 0))
+    return struct.unpack('II', res)[1]
+
+class VerbBatch:
+
+  def __init__(self, codec):
+    self.codec = codec
+    self.verbs = []
+
+  def __len__(self):
+    return len(self.verbs)
+
+  def add(self, nid, verb, param):
+    """queue verb, returns index to the result array"""
+    self.verbs.append((nid, verb, param))
+    return len(self.verbs) - 1
+
+  def param(self, nid, param):
+    """queue parameter read, returns index to the result array"""
+    return self.add(nid, VERBS['PARAMETERS'], param)
+
+  def run(self):
+    """execute all queued verbs and return array of results"""
+    verbs = self.verbs
+    self.verbs = []
+    return self.codec.rw_batch(verbs)
+
+class HDACodec:
+
+  afg = None
+  mfg = None
+  vendor_id = None
+  subsystem_id = None
+  revision_id = None
+  lazy_nodes = False
+  ioctls = 0
+  cache_hits = 0
+  cache_misses = 0
+
+  def __init__(self, card=0, device=0, clonefd=None, backend=None):
+    self.verb_cache = {}
+    self.exporter = None
+    self.exporta = []
+    self.device = device
+    if backend is None:
+      ctl_fd = None
+      if type(1) == type(card):
+        self.card = card
+        self.mcard = HDACard(card)
+        ctl_fd = self.mcard.fd
+      else:
+        self.mcard = card
+        self.card = card.card
+      self.backend = HDAHwdepBackend(self.card, device, clonefd)
+      self.version = self.backend.version
+      self.hwaccess = True
+      self.mixer = AlsaMixer(self.card, ctl_fd=ctl_fd)
+      self.parse_proc()
+    else:
+      from hda_proc import HDACardProc
+      self.card = card
+      self.mcard = HDACardProc(card)
+      self.backend = backend
+      self.hwaccess = backend.hwaccess
+      self.mixer = None
+      self.proc_codec = backend.proc_codec
+
   def rw(self, nid, verb, param):
     """do elementary read/write operation"""
     if not self.exporter:
-      verb = (nid << 24) | (verb << 8) | param
-      res = ioctl(self.fd, IOCTL_VERB_WRITE, struct.pack('II', verb, 0))
-      return struct.unpack('II', res)[1]
+      if verb & 0x0800:
+        cache = self.verb_cache.get((nid, verb))
+        if cache and param in cache:
+          self.cache_hits += 1
+          return cache[param]
+      res = self.backend.verb(nid, verb, param)
+      self.ioctls += 1
+      self.cache_update(nid, verb, param, res)
+      return res
     else:
       return self.exporter.rw(self.exporta and self.exporta[-1] or False, nid, verb, param)
+
+  def cache_update(self, nid, verb, param, res):
+    """remember GET verb response or invalidate responses for SET verb"""
+    if verb & 0x0800:
+      self.cache_misses += 1
+      key = (nid, verb)
+      if not key in self.verb_cache:
+        self.verb_cache[key] = {}
+      self.verb_cache[key][param] = res
+    elif verb == VERBS['SET_CODEC_RESET']:
+      self.cache_flush()
+    elif verb in CACHE_SET_VERBS:
+      for verb in CACHE_SET_VERBS[verb]:
+        if (nid, verb) in self.verb_cache:
+          del self.verb_cache[(nid, verb)]
+
+  def cache_flush(self, static=False):
+    """forget cached responses, static ones only when requested"""
+    for key in list(self.verb_cache.keys()):
+      if static or not key[1] in CACHE_STATIC_VERBS:
+        del self.verb_cache[key]
+
+  def batch(self):
+    """return new verb batch for this codec"""
+    return VerbBatch(self)
+
+  def rw_batch(self, verbs):
+    """do elementary read/write operations for (nid, verb, param) tuples"""
+    count = len(verbs)
+    if not self.hwaccess or self.exporter or count < 2:
+      res = []
+      for nid, verb, param in verbs:
+        if verb == VERBS['PARAMETERS']:
+          res.append(self.param_read(nid, param))
+        else:
+          res.append(self.rw(nid, verb, param))
+      return res
+    res = array('I', [0]) * count
+    todo = []
+    cache = self.verb_cache
+    for idx in range(count):
+      nid, verb, param = verbs[idx]
+      if verb & 0x0800:
+        vcache = cache.get((nid, verb))
+        if vcache and param in vcache:
+          res[idx] = vcache[param]
+          continue
+      todo.append(idx)
+    self.cache_hits += count - len(todo)
+    if not todo:
+      return res
+    vals = self.backend.verbs([verbs[idx] for idx in todo])
+    self.ioctls += len(todo)
+    for pos in range(len(todo)):
+      idx = todo[pos]
+      res[idx] = vals[pos]
+      nid, verb, param = verbs[idx]
+      self.cache_update(nid, verb, param, res[idx])
+    return res
     
   def get_wcap(self, nid):
     """get cached widget capabilities"""
-    res = ioctl(self.fd, IOCTL_GET_WCAPS, struct.pack('II', nid << 24, 0))
-    return struct.unpack('II', res)[1]
+    self.ioctls += 1
+    return self.backend.wcap(nid)
 
   def get_raw_wcap(self, nid):
     """get raw widget capabilities"""
@@ -1071,9 +1588,10 @@ class HDACodec:
     res = self.param_read(nid, PARAMS['NODE_COUNT'])
     return res & 0x7fff, (res >> 16) & 0x7fff
 
-  def get_connections(self, nid):
+  def get_connections(self, nid, parm=None):
     """parses connection list and returns the array of NIDs"""
-    parm = self.param_read(nid, PARAMS['CONNLIST_LEN'])
+    if parm is None:
+      parm = self.param_read(nid, PARAMS['CONNLIST_LEN'])
     if parm & (1 << 7):		# long
       shift = 16
       num_elems = 2
@@ -1087,11 +1605,15 @@ class HDACodec:
     if conn_len == 1:
       parm = self.rw(nid, VERBS['GET_CONNECT_LIST'], 0)
       return [parm & mask]
+    batch = self.batch()
+    for i in range(0, conn_len, num_elems):
+      batch.add(nid, VERBS['GET_CONNECT_LIST'], i)
+    parms = batch.run()
     res = []
     prev_nid = 0
     for i in range(conn_len):
       if i % num_elems == 0:
-        parm = self.rw(nid, VERBS['GET_CONNECT_LIST'], i)
+        parm = parms[i // num_elems]
       range_val = parm & (1 << (shift - 1))
       val = parm & mask
       parm >>= shift
@@ -1110,8 +1632,8 @@ class HDACodec:
   def revert(self):
     if not self.gpio is None:
       self.gpio.revert()
-    for nid in self.nodes:
-      self.nodes[nid].revert()
+    for node in self.nodes.created():
+      node.revert()
 
   def export_start(self, mode):
     self.exporta.append(mode)
@@ -1123,10 +1645,39 @@ class HDACodec:
     self.exporter = exporter
     if not self.gpio is None:
       self.gpio.export()
-    for nid in self.nodes:
-      self.nodes[nid].export()
+    for node in self.nodes.created():
+      node.export()
     self.exporter = None
 
+  def static_header(self):
+    """return the static part of the codec state without the nodes"""
+    res = [self.vendor_id, self.subsystem_id, self.revision_id,
+           self.afg_function_id, self.mfg_function_id]
+    if not self.afg is None:
+      res += [self.afg, self.pcm_rate, self.pcm_bit, self.pcm_stream,
+              self.amp_caps_in.ofs, self.amp_caps_in.nsteps,
+              self.amp_caps_in.stepsize, self.amp_caps_in.mute,
+              self.amp_caps_out.ofs, self.amp_caps_out.nsteps,
+              self.amp_caps_out.stepsize, self.amp_caps_out.mute,
+              self.gpio_cap]
+    return tuple(res)
+
+  def static_state(self):
+    """return the static part of the codec state, see HDANode"""
+    return self.static_header() + \
+           tuple([self.nodes[nid].static_state() for nid in self.nodes])
+
+  def dynamic_state(self):
+    """return the dynamic part of the codec state, see HDANode"""
+    res = []
+    if not self.gpio is None:
+      res.append((self.afg, ) + tuple([self.gpio.val[i] for i in GPIO_IDS]))
+    return tuple(res + [self.nodes[nid].dynamic_state() for nid in self.nodes])
+
+  def fingerprint(self):
+    """return SHA-1 hex digest of static_state()"""
+    return sha1(repr(self.static_state()).encode()).hexdigest()
+
   def get_node(self, nid):
     if nid == self.afg:
       return HDARootNode(self, "Audio Root Node")
@@ -1143,17 +1694,21 @@ class HDACodec:
       print("Unable to find proc file '%s'" % file)
 
   def analyze(self):
+    if self.hwaccess:
+      self.cache_flush()
     self.afg = None
     self.mfg = None
-    self.nodes = {}
+    self.nodes = HDANodes(self, range(0))
     self.gpio = None
     self.afg_function_id = 0			# invalid
     self.mfg_function_id = 0			# invalid
     self.afg_unsol = 0
     self.mfg_unsol = 0
-    self.vendor_id = self.param_read(AC_NODE_ROOT, PARAMS['VENDOR_ID'])
-    self.subsystem_id = self.param_read(AC_NODE_ROOT, PARAMS['SUBSYSTEM_ID'])
-    self.revision_id = self.param_read(AC_NODE_ROOT, PARAMS['REV_ID'])
+    batch = self.batch()
+    batch.param(AC_NODE_ROOT, PARAMS['VENDOR_ID'])
+    batch.param(AC_NODE_ROOT, PARAMS['SUBSYSTEM_ID'])
+    batch.param(AC_NODE_ROOT, PARAMS['REV_ID'])
+    self.vendor_id, self.subsystem_id, self.revision_id = batch.run()
     self.name = "0x%08x" % self.vendor_id	# FIXME
     self.pcm_rates = []
     self.pcm_bits = []
@@ -1189,19 +1744,21 @@ class HDACodec:
     if self.afg == None:
       return
 
-    pcm = self.param_read(self.afg, PARAMS['PCM'])
+    batch = self.batch()
+    for param in ['PCM', 'STREAM', 'AMP_IN_CAP', 'AMP_OUT_CAP', 'GPIO_CAP']:
+      batch.param(self.afg, PARAMS[param])
+    pcm, self.pcm_stream, ampcapin, ampcapout, self.gpio_cap = batch.run()
+
     self.pcm_rate = pcm & 0xffff
     self.pcm_rates = self.analyze_pcm_rates(self.pcm_rate)
     self.pcm_bit = pcm >> 16
     self.pcm_bits = self.analyze_pcm_bits(self.pcm_bit)
 
-    self.pcm_stream = self.param_read(self.afg, PARAMS['STREAM'])
     self.pcm_streams = self.analyze_pcm_streams(self.pcm_stream)
 
-    self.amp_caps_in = HDAAmpCaps(self, self.afg, HDA_INPUT)
-    self.amp_caps_out = HDAAmpCaps(self, self.afg, HDA_OUTPUT)
+    self.amp_caps_in = HDAAmpCaps(self, self.afg, HDA_INPUT, ampcapin)
+    self.amp_caps_out = HDAAmpCaps(self, self.afg, HDA_OUTPUT, ampcapout)
 
-    self.gpio_cap = self.param_read(self.afg, PARAMS['GPIO_CAP'])
     self.gpio_max = self.gpio_cap & 0xff
     self.gpio_o = (self.gpio_cap >> 8) & 0xff
     self.gpio_i = (self.gpio_cap >> 16) & 0xff
@@ -1211,15 +1768,27 @@ class HDACodec:
 
     nodes_count, nid = self.get_sub_nodes(self.afg)
     self.base_nid = nid
-    for i in range(nodes_count):
-      self.nodes[nid] = HDANode(self, nid)
-      nid += 1
+    self.nodes = HDANodes(self, range(nid, nid + nodes_count),
+                          self.lazy_nodes)
 
   def reread(self):
+    if self.hwaccess:
+      self.cache_flush()
     if not self.gpio is None:
       self.gpio.reread()
-    for node in self.nodes:
-      self.nodes[node].reread()
+    for node in self.nodes.created():
+      node.reread()
+
+  def amp_levels(self):
+    """update dB and percent levels of all outdated amp values at once"""
+    ampvals = []
+    for node in self.nodes.created():
+      if node.in_amp and node.amp_vals_in.dbs is None:
+        ampvals.append(node.amp_vals_in)
+      if node.out_amp and node.amp_vals_out.dbs is None:
+        ampvals.append(node.amp_vals_out)
+    if ampvals:
+      HDA_amp_levels(ampvals)
 
   def analyze_pcm_rates(self, pcm):
     rates = [8000, 11025, 16000, 22050, 32000, 44100, 48000, 88200,
@@ -1855,6 +2424,39 @@ def HDA_card_list():
       os.close(fd)
   return result
 
+def HDA_codec_probe(card, device, factory=HDACodec):
+  """open and analyze one codec, return (codec or OSError, seconds)"""
+  start = time()
+  try:
+    c = factory(card, device)
+  except OSError as error:
+    return error, time() - start
+  c.analyze()
+  return c, time() - start
+
+def HDA_codec_discover(cards, devices=4, factory=HDACodec, parallel=True):
+  """
+  probe codec addresses 0..devices-1 on all given card numbers, each
+  hwdep device in own thread (the ioctls do not hold the interpreter lock).
+  The result list is sorted by (card, device) regardless of completion
+  order: (card, device, codec or OSError, seconds)
+  """
+  jobs = []
+  for card in sorted(cards):
+    for device in range(devices):
+      jobs.append((card, device))
+  probe = lambda job: HDA_codec_probe(job[0], job[1], factory)
+  if parallel and len(jobs) > 1:
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(len(jobs)) as pool:
+      results = list(pool.map(probe, jobs))
+  else:
+    results = list(map(probe, jobs))
+  res = []
+  for job, result in zip(jobs, results):
+    res.append(job + result)
+  return res
+
 if __name__ == '__main__':
   v = HDACodec()
   v.analyze()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+import os
+import struct
+import marshal
+
+# bump when HDACodec.static_state() or dynamic_state() layout changes
+CODEC_STORE_VERSION = 1
+CODEC_STORE_MAGIC = b'HDAD'
+CODEC_STORE_HEADER = struct.Struct('<4sII')	# magic, version, marshal version
+
+def dynamic_delta(ref, state):
+  """return [(entry, field, value)] of the dynamic fields differing from ref"""
+  if len(ref) != len(state):
+    raise ValueError("dynamic states of different codecs")
+  res = []
+  for idx in range(len(ref)):
+    a = ref[idx]
+    b = state[idx]
+    if a == b:
+      continue
+    if len(a) != len(b):
+      raise ValueError("dynamic states of different codecs")
+    for field in range(len(a)):
+      if a[field] != b[field]:
+        res.append((idx, field, b[field]))
+  return res
+
+def dynamic_apply(ref, delta):
+  """return the dynamic state from ref and the delta"""
+  res = [list(entry) for entry in ref]
+  for idx, field, value in delta:
+    if isinstance(value, list):	# decoded from JSON
+      value = tuple(value)
+    res[idx][field] = value
+  return tuple([tuple(entry) for entry in res])
+
+class CodecStore:
+
+  """
+  Deduplicated store of analyzed codecs. The static state of each unique
+  codec (see HDACodec.fingerprint()) is stored once together with the
+  dynamic state of the first codec seen with it. Other codecs are kept
+  as the fingerprint and the dynamic delta to this reference.
+  """
+
+  def __init__(self, dir):
+    self.dir = dir
+    self.refs = {}
+    self.added = 0
+
+  def path(self, fingerprint):
+    return os.path.join(self.dir, fingerprint + '.codec')
+
+  def reference(self, fingerprint):
+    """return (static, dynamic) reference state or None"""
+    if fingerprint in self.refs:
+      return self.refs[fingerprint]
+    try:
+      with open(self.path(fingerprint), 'rb') as fd:
+        data = fd.read()
+    except OSError:
+      return None
+    if len(data) < CODEC_STORE_HEADER.size or \
+       CODEC_STORE_HEADER.unpack_from(data) != \
+          (CODEC_STORE_MAGIC, CODEC_STORE_VERSION, marshal.version):
+      return None
+    try:
+      res = marshal.loads(data[CODEC_STORE_HEADER.size:])
+    except (EOFError, ValueError, TypeError):
+      return None
+    self.refs[fingerprint] = res
+    return res
+
+  def put(self, fingerprint, static, dynamic):
+    """store the codec, return the dynamic delta to the reference"""
+    ref = self.reference(fingerprint)
+    if ref is None:
+      ref = (static, dynamic)
+      data = CODEC_STORE_HEADER.pack(CODEC_STORE_MAGIC, CODEC_STORE_VERSION,
+                                     marshal.version) + marshal.dumps(ref)
+      os.makedirs(self.dir, exist_ok=True)
+      path = self.path(fingerprint)
+      tmp = '%s.%i.tmp' % (path, os.getpid())
+      with open(tmp, 'wb') as fd:
+        fd.write(data)
+      os.replace(tmp, path)
+      self.refs[fingerprint] = ref
+      self.added += 1
+    return dynamic_delta(ref[1], dynamic)
+
+  def get(self, fingerprint, delta):
+    """return (static, dynamic) state of the stored codec"""
+    ref = self.reference(fingerprint)
+    if ref is None:
+      raise KeyError(fingerprint)
+    return ref[0], dynamic_apply(ref[1], delta)
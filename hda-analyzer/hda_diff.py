@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+from difflib import SequenceMatcher
+
+from hda_codec import GPIO_IDS
+
+def amp_fields(res, name, vals):
+  for idx in range(vals.indices):
+    raw = vals.get_val(idx)
+    decoded = []
+    for val in (type(raw) == type([]) and raw or [raw]):
+      db = vals.caps.get_val_db(val & 0x7f)
+      if not db is None:
+        db /= 100.0
+      decoded.append({'mute': val & 0x80 and True or False, 'db': db})
+    res['%s[%d]' % (name, idx)] = (raw, decoded)
+
+def node_fields(node):
+  """return field -> (raw value, decoded value) for the volatile node state"""
+  res = {}
+  if node.active_connection != None:
+    conn = None
+    if node.connections and 0 <= node.active_connection < len(node.connections):
+      conn = node.connections[node.active_connection]
+    res['connection'] = (node.active_connection, conn)
+  if node.in_amp:
+    amp_fields(res, 'amp_in', node.amp_vals_in)
+  if node.out_amp:
+    amp_fields(res, 'amp_out', node.amp_vals_out)
+  if node.wtype_id == 'PIN':
+    res['pinctl'] = (node.pinctls, {'bits': sorted(node.pinctl),
+                                    'vref': node.pinctl_vref})
+    if 'EAPD' in node.pincap:
+      res['eapd'] = (node.pincap_eapdbtls, sorted(node.pincap_eapdbtl))
+    if node.pin_sense != None:
+      res['pin_sense'] = (node.pin_sense, {'presence': node.pin_presence})
+  elif node.wtype_id == 'VOL_KNB':
+    res['vol_knb'] = (node.vol_knb, {'direct': node.vol_knb_direct,
+                                     'value': node.vol_knb_val})
+  elif node.wtype_id in ['AUD_IN', 'AUD_OUT']:
+    res['converter'] = ((node.aud_stream << 4) | node.aud_channel,
+                        {'stream': node.aud_stream, 'channel': node.aud_channel})
+    if node.sdi_select != None:
+      res['sdi_select'] = (node.sdi_select, node.sdi_select)
+    if node.digital:
+      res['digital'] = (node.digi1, {'bits': sorted(node.dig1),
+                                     'category': node.dig1_category})
+  if node.unsol_cap:
+    res['unsolicited'] = ((node.unsol_enabled and 0x80 or 0) | node.unsol_tag,
+                          {'tag': node.unsol_tag, 'enabled': node.unsol_enabled})
+  if node.power:
+    res['power'] = (node.pwr, {'setting': node.pwr_setting_name,
+                               'actual': node.pwr_actual_name})
+  if hasattr(node, 'realtek_coeff_proc'):
+    res['coef'] = (node.realtek_coeff_proc, node.realtek_coeff_proc)
+    res['coef_index'] = (node.realtek_coeff_index, node.realtek_coeff_index)
+  return res
+
+def gpio_fields(gpio):
+  """return field -> (raw value, decoded value) for the GPIO registers"""
+  res = {}
+  for name in GPIO_IDS:
+    val = gpio.val[name]
+    bits = []
+    for bit in range(32):
+      if val & (1 << bit):
+        bits.append(bit)
+    res['gpio_' + name] = (val, bits)
+  return res
+
+def section_order(key):
+  return key is None and -1 or key
+
+class CodecSnapshot:
+
+  """
+  Codec state split to sections, None is the codec header (including
+  GPIO), other keys are node ids. Each section keeps its dump lines and
+  the fields (field -> (raw value, decoded value)) including the static
+  node state, so two snapshots are compared section by section and field
+  by field without diffing the whole dump.
+  """
+
+  def __init__(self, codec=None):
+    self.codec = codec
+    self.keys = []
+    self.lines = {}
+    self.fields = {}
+    if codec:
+      self.update(None)
+      for nid in codec.nodes:
+        self.update(nid)
+
+  def copy(self):
+    """return a shallow copy, the sections are replaced by update()"""
+    res = self.__class__()
+    res.codec = self.codec
+    res.keys = self.keys[:]
+    res.lines = self.lines.copy()
+    res.fields = self.fields.copy()
+    return res
+
+  def node_text(self, node):
+    return self.codec.dump_node(node)
+
+  def update(self, key):
+    """take the section from the current codec state"""
+    codec = self.codec
+    if key is None:
+      text = codec.dump(skip_nodes=True)
+      fields = {}
+      if not codec.gpio is None:
+        fields = gpio_fields(codec.gpio)
+      fields['static'] = (codec.static_header(), None)
+    else:
+      node = codec.nodes[key]
+      text = self.node_text(node)
+      fields = node_fields(node)
+      fields['static'] = (node.static_state(), None)
+    if not key in self.lines:
+      self.keys.append(key)
+      if len(self.keys) > 1 and \
+         section_order(self.keys[-2]) > section_order(key):
+        self.keys.sort(key=section_order)
+    self.lines[key] = text.split('\n')[:-1]
+    self.fields[key] = fields
+
+  def text(self):
+    res = []
+    for key in self.keys:
+      res += self.lines[key]
+    return '\n'.join(res) + '\n'
+
+def diff_fields(key, old, new):
+  """return changes [(key, field, old, new)] between two field dicts"""
+  res = []
+  none = (None, None)
+  for field in new:
+    a = old.get(field, none)
+    if a[0] != new[field][0]:
+      res.append((key, field, a, new[field]))
+  for field in old:
+    if not field in new and old[field][0] != None:
+      res.append((key, field, old[field], none))
+  return res
+
+def diff_sections(old, new):
+  """yield (key, old lines or None, new lines or None) in the snapshot order"""
+  i = j = 0
+  while i < len(old.keys) or j < len(new.keys):
+    if j >= len(new.keys) or (i < len(old.keys) and \
+       section_order(old.keys[i]) < section_order(new.keys[j])):
+      key = old.keys[i]
+      yield key, old.lines[key], None
+      i += 1
+    elif i >= len(old.keys) or \
+         section_order(old.keys[i]) > section_order(new.keys[j]):
+      key = new.keys[j]
+      yield key, None, new.lines[key]
+      j += 1
+    else:
+      key = new.keys[j]
+      yield key, old.lines[key], new.lines[key]
+      i += 1
+      j += 1
+
+def diff_snapshots(old, new, keys=None):
+  """
+  Return the structured change list [(key, field, old, new)] between two
+  snapshots, old and new values are (raw, decoded) tuples. When keys is
+  given, only these sections are compared.
+  """
+  res = []
+  none = {}
+  for key, a, b in diff_sections(old, new):
+    if (not keys is None and not key in keys) or a is b:
+      continue
+    res += diff_fields(key, old.fields.get(key, none),
+                       new.fields.get(key, none))
+  return res
+
+def diff_opcodes(old, new, keys=None):
+  """return SequenceMatcher like opcodes for the whole dump lines"""
+  res = []
+  i = j = 0
+  for key, a, b in diff_sections(old, new):
+    a = a or []
+    b = b or []
+    if a is b or a == b or (not keys is None and not key in keys):
+      ops = [('equal', 0, len(a), 0, len(b))]
+    else:
+      ops = SequenceMatcher(None, a, b).get_opcodes()
+    for tag, i1, i2, j1, j2 in ops:
+      if i1 == i2 and j1 == j2:
+        continue
+      if tag == 'equal' and res and res[-1][0] == 'equal':
+        res[-1] = ('equal', res[-1][1], i + i2, res[-1][3], j + j2)
+      else:
+        res.append((tag, i + i1, i + i2, j + j1, j + j2))
+    i += len(a)
+    j += len(b)
+  return res
+
+def group_opcodes(codes, n):
+  """group opcodes to hunks with n lines of context (see difflib)"""
+  if not codes:
+    return
+  if codes[0][0] == 'equal':
+    tag, i1, i2, j1, j2 = codes[0]
+    codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+  if codes[-1][0] == 'equal':
+    tag, i1, i2, j1, j2 = codes[-1]
+    codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+  nn = n + n
+  group = []
+  for tag, i1, i2, j1, j2 in codes:
+    if tag == 'equal' and i2 - i1 > nn:
+      group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+      yield group
+      group = []
+      i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+    group.append((tag, i1, i2, j1, j2))
+  if group and not (len(group) == 1 and group[0][0] == 'equal'):
+    yield group
+
+def format_range(start, stop):
+  length = stop - start
+  start += 1
+  if length == 1:
+    return '%d' % start
+  if not length:
+    start -= 1
+  return '%d,%d' % (start, length)
+
+def render_diff(old, new, keys=None, n=8):
+  """return unified diff lines of the snapshot dumps"""
+  codes = diff_opcodes(old, new, keys)
+  if not codes or (len(codes) == 1 and codes[0][0] == 'equal'):
+    return []
+  a = []
+  b = []
+  for key, la, lb in diff_sections(old, new):
+    a += la or []
+    b += lb or []
+  res = ['--- ', '+++ ']
+  for group in group_opcodes(codes, n):
+    res.append('@@ -%s +%s @@' % (format_range(group[0][1], group[-1][2]),
+                                  format_range(group[0][3], group[-1][4])))
+    for tag, i1, i2, j1, j2 in group:
+      if tag == 'equal':
+        for line in a[i1:i2]:
+          res.append(' ' + line)
+        continue
+      for line in a[i1:i2]:
+        res.append('-' + line)
+      for line in b[j1:j2]:
+        res.append('+' + line)
+  return res
+
+def codec_diff(codec, old, new=None, keys=None):
+  """return the text diff for codec like the 'Diff' button shows it"""
+  diff = '\n'.join(render_diff(old, new or CodecSnapshot(codec), keys))
+  if len(diff) > 0:
+    diff = 'Diff for codec %i/%i (%s):\n' % (codec.card, codec.device, codec.name) + diff
+  return diff
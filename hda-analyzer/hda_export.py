@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+"""
+hda_export - draw codec graphs without GTK
+
+Usage: hda_export [-j jobs] [-f svg|dot|png] [--layout=layered|grid] [-c codec]
+                  -o dir path ...
+   or: hda_export [-f svg|dot] [--layout=layered|grid] [-c codec] -o - codec_proc
+
+    The codec graph (the same node and route layout as the graph window
+    of hda_analyzer) is drawn for each codec in the codec proc or
+    alsa-info.sh dumps in paths (directories, archives and single files
+    like for hda_batch). No display is required.
+
+    The svg format (default) is drawn like the graph window, the png
+    format too (requires pycairo). The dot format is a Graphviz graph
+    with the node positions fixed to the layout (draw it with 'neato -n').
+
+    Each codec is written to the output directory as file named by the
+    dump path and the codec index. The dumps are processed by a pool of
+    worker processes (default one per CPU), the output files are written
+    while the graph is drawn. With -c, only the codec with the given
+    index (from 0) in each dump is drawn. With '-o -' the graph of one
+    codec is written to stdout, a dump with more codecs requires -c.
+"""
+
+import os
+import re
+import sys
+import io
+from multiprocessing import Pool
+from contextlib import redirect_stdout
+from xml.sax.saxutils import escape
+try:
+  import cairo
+except ImportError:
+  cairo = None
+
+from hda_proc import SplitProcFile, HDACodecProc
+from hda_layout import layout_codec, GRAPH_LAYOUTS
+from hda_batch import iter_jobs, read_dump
+from hda_cache import LayoutCache
+
+# layouts are shared by the codecs of one model (per worker process)
+EXPORT_LAYOUT_CACHE = LayoutCache()
+
+def route_style(route):
+  """return (line width, rgb) of the route like the graph window draws it"""
+  inactive = route.src.node.is_conn_active(route.dst.node)
+  if inactive is None:
+    return 0.35, (0, 0, 0)
+  elif inactive is False:
+    return 0.35, (0, 0, 1)
+  return 1.5, (0, 0, 1)
+
+class SVGCanvas:
+
+  def __init__(self, fd, width, height):
+    self.fd = fd
+    fd.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    fd.write('<svg xmlns="http://www.w3.org/2000/svg" width="%i" height="%i" '
+             'viewBox="0 0 %i %i">\n' % (width, height, width, height))
+    fd.write('<rect width="100%" height="100%" fill="white"/>\n')
+    fd.write('<g fill="none" font-family="Misc Fixed, monospace">\n')
+
+  def color(self, rgb):
+    return '#%02x%02x%02x' % tuple([int(c * 255) for c in rgb])
+
+  def rect(self, x, y, w, h, width, rgb):
+    self.fd.write('<rect x="%g" y="%g" width="%g" height="%g" '
+                  'stroke="%s" stroke-width="%g"/>\n' % \
+                  (x, y, w, h, self.color(rgb), width))
+
+  def line(self, line, width, rgb):
+    self.fd.write('<line x1="%g" y1="%g" x2="%g" y2="%g" '
+                  'stroke="%s" stroke-width="%g"/>\n' % \
+                  (tuple(line) + (self.color(rgb), width)))
+
+  def text(self, x, y, size, text):
+    self.fd.write('<text x="%g" y="%g" font-size="%g" fill="black">%s</text>\n' % \
+                  (x, y, size, escape(text)))
+
+  def close(self):
+    self.fd.write('</g>\n</svg>\n')
+
+class CairoCanvas:
+
+  def __init__(self, fd, width, height):
+    self.fd = fd
+    self.surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+    self.cr = cairo.Context(self.surface)
+    self.cr.set_source_rgb(1, 1, 1)
+    self.cr.paint()
+    self.cr.select_font_face("Misc Fixed",
+                             cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+
+  def rect(self, x, y, w, h, width, rgb):
+    self.cr.set_line_width(width)
+    self.cr.set_source_rgb(*rgb)
+    self.cr.rectangle(x, y, w, h)
+    self.cr.stroke()
+
+  def line(self, line, width, rgb):
+    self.cr.set_line_width(width)
+    self.cr.set_source_rgb(*rgb)
+    self.cr.move_to(line[0], line[1])
+    self.cr.line_to(line[2], line[3])
+    self.cr.stroke()
+
+  def text(self, x, y, size, text):
+    self.cr.set_source_rgb(0, 0, 0)
+    self.cr.set_font_size(size)
+    self.cr.move_to(x, y)
+    self.cr.show_text(text)
+
+  def close(self):
+    self.surface.write_to_png(self.fd)
+    self.surface.finish()
+
+def draw_graph(layout, canvas):
+  """draw the nodes and routes like CodecGraphLayout does"""
+  for node in layout.nodes:
+    x, y, width, height = node.myarea
+    canvas.rect(x, y, width, height, 0.8, (0, 0, 0))
+    canvas.text(x + 5, y + 13, 14, "0x%02x: %s" % (node.node.nid, node.node.wtype_id))
+    canvas.rect(x, y + (height/4)*3, width/2, height/4, 0.2, (0, 0, 0))
+    canvas.rect(x + width/2, y + (height/4)*3, width/2, height/4, 0.2, (0, 0, 0))
+    canvas.text(x + 20, y + (height/4)*3 + 15, 11, 'IN')
+    canvas.text(x + width/2 + 20, y + (height/4)*3 + 15, 11, 'OUT')
+  for route in layout.routes:
+    width, rgb = route_style(route)
+    for line in route.lines:
+      canvas.line(line, width, rgb)
+    for line in route.wronglines:
+      canvas.line(line, 1.5, (1, 0, 0))
+  canvas.close()
+
+def write_svg(codec, layout, fd):
+  draw_graph(layout, SVGCanvas(fd, *layout.size))
+
+def write_png(codec, layout, fd):
+  draw_graph(layout, CairoCanvas(fd, *layout.size))
+
+def write_dot(codec, layout, fd):
+  """write Graphviz graph, positions are in points with y axis up"""
+  sy = layout.size[1]
+  fd.write('digraph "%s" {\n' % (codec.name or 'codec').replace('"', '\\"'))
+  fd.write('  graph [bb="0,0,%i,%i", splines=ortho];\n' % layout.size)
+  fd.write('  node [shape=box, fixedsize=true, fontname="Misc Fixed"];\n')
+  for node in layout.nodes:
+    x, y, width, height = node.myarea
+    fd.write('  n%02x [label="0x%02x: %s", pos="%g,%g!", width=%g, height=%g];\n' % \
+             (node.node.nid, node.node.nid, node.node.wtype_id,
+              x + width / 2.0, sy - y - height / 2.0,
+              width / 72.0, height / 72.0))
+  for route in layout.routes:
+    width, rgb = route_style(route)
+    fd.write('  n%02x -> n%02x [color="#%02x%02x%02x", penwidth=%g];\n' % \
+             ((route.src.node.nid, route.dst.node.nid) + \
+              tuple([int(c * 255) for c in rgb]) + (width * 2, )))
+  fd.write('}\n')
+
+# format -> (writer, binary output)
+EXPORT_FORMATS = {
+  'svg': (write_svg, False),
+  'dot': (write_dot, False),
+  'png': (write_png, True)
+}
+
+def export_codec(codec, fd, format='svg', layout='layered', cache=None):
+  """
+  Lay out the analyzed codec and write its graph to fd (binary for png),
+  return False when there is nothing to draw.
+  """
+  with redirect_stdout(io.StringIO()):	# drop the displaced route notes
+    res = layout_codec(codec, layout, cache=cache)
+  if res is None:
+    return False
+  EXPORT_FORMATS[format][0](codec, res, fd)
+  return True
+
+def export_name(path, idx, format):
+  """return the output file name for the codec in the dump"""
+  return '%s.%i.%s' % (re.sub(r'[^\w.-]+', '_', path.lstrip(os.sep)), idx, format)
+
+def export_dump(job):
+  """
+  Draw the codecs of one dump, job is (path, contents or None, output
+  directory or None for stdout, format, layout, codec index or None for
+  all codecs). Return (path, written files, errors).
+  """
+  path, data, outdir, format, layout, codec = job
+  files = []
+  errors = []
+  try:
+    text = read_dump(path, data)
+  except Exception as msg:
+    return path, files, [str(msg) or 'read error']
+  sections = list(SplitProcFile(io.StringIO(text)))
+  if not codec is None:
+    if codec < 0 or codec >= len(sections):
+      return path, files, ['no codec %i (%i codecs)' % (codec, len(sections))]
+    sections = [(codec, sections[codec])]
+  else:
+    if outdir is None and len(sections) > 1:
+      return path, files, ['%i codecs, select one with -c' % len(sections)]
+    sections = list(enumerate(sections))
+  for idx, section in sections:
+    try:
+      with redirect_stdout(io.StringIO()):	# drop the parser warnings
+        c = HDACodecProc(0, idx, section)
+        if not c.proc_codec_id:
+          raise ValueError("no codec found")
+        c.analyze()
+      binary = EXPORT_FORMATS[format][1]
+      if outdir is None:
+        fd = binary and sys.stdout.buffer or sys.stdout
+        export_codec(c, fd, format, layout, EXPORT_LAYOUT_CACHE)
+        fd.flush()
+        continue
+      name = os.path.join(outdir, export_name(path, idx, format))
+      tmp = '%s.%i.tmp' % (name, os.getpid())
+      with open(tmp, binary and 'wb' or 'w') as fd:
+        ok = export_codec(c, fd, format, layout, EXPORT_LAYOUT_CACHE)
+      if ok:
+        os.replace(tmp, name)
+        files.append(name)
+      else:
+        os.remove(tmp)
+        errors.append("codec %i: no graph" % idx)
+    except Exception as msg:
+      errors.append('codec %i: %s: %s' % (idx, msg.__class__.__name__, msg))
+  return path, files, errors
+
+def export_all(paths, outdir, format='svg', layout='layered', jobs=None,
+               codec=None):
+  """draw all codecs in paths to outdir, yield export_dump() results"""
+
+  def iter_all():
+    for path in paths:
+      for path1, data in iter_jobs(path, ()):
+        yield path1, data, outdir, format, layout, codec
+
+  os.makedirs(outdir, exist_ok=True)
+  with Pool(jobs) as pool:
+    for res in pool.imap_unordered(export_dump, iter_all(), chunksize=4):
+      yield res
+
+def main(argv):
+  jobs = None
+  format = 'svg'
+  layout = 'layered'
+  output = None
+  codec = None
+  while len(argv) > 1 and argv[1].startswith('-'):
+    if argv[1] == '-j' and len(argv) > 2:
+      jobs = int(argv[2])
+      del argv[1:3]
+    elif argv[1] == '-f' and len(argv) > 2:
+      format = argv[2]
+      del argv[1:3]
+    elif argv[1] == '-c' and len(argv) > 2:
+      codec = int(argv[2])
+      del argv[1:3]
+    elif argv[1] == '-o' and len(argv) > 2:
+      output = argv[2]
+      del argv[1:3]
+    elif argv[1].startswith('--layout='):
+      layout = argv[1][9:]
+      del argv[1]
+    else:
+      print("Unknown option '%s'" % argv[1])
+      return 0
+  if not output or len(argv) < 2:
+    print(__doc__)
+    return 0
+  if not format in EXPORT_FORMATS:
+    print("Unknown format '%s'" % format)
+    return 0
+  if not layout in GRAPH_LAYOUTS:
+    print("Unknown graph layout '%s'" % layout)
+    return 0
+  if format == 'png' and cairo is None:
+    print("The png format requires pycairo (python3-cairo package).")
+    return 0
+  if output == '-':
+    if len(argv) != 2 or format == 'png':
+      print("Only one dump in svg or dot format can be written to stdout.")
+      return 0
+    path, files, errors = export_dump((argv[1], None, None, format, layout,
+                                       codec))
+    for error in errors:
+      sys.stderr.write("%s: %s\n" % (path, error))
+    return not errors and 1 or 0
+  count = 0
+  for path, files, errors in export_all(argv[1:], output, format, layout,
+                                        jobs, codec):
+    count += len(files)
+    for error in errors:
+      print("%s: %s" % (path, error))
+  print("%i graphs written to %s" % (count, output))
+  return 1
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+"""
+hda_fleet - query codec fields over a corpus of codec dumps
+
+Usage: hda_fleet [-j jobs] -o index path ...
+   or: hda_fleet index [-w condition] ... [-g field[,field]...] [-l]
+
+    The first form reads all codec proc dumps, alsa-info.sh dumps and
+    binary codec snapshots in paths (directories, archives and single
+    files like for hda_batch) and stores the codec fields to the index
+    file. Only the fields are read from the dumps, no codec analysis
+    is done.
+
+    The second form loads the index and prints the number of codecs and
+    nodes matching all conditions. A condition is 'field op value' where
+    op is one of = != < <= > >= & (any bit of value set). With -g the
+    matches are counted per value of the fields, with -l the matching
+    codecs are listed.
+
+    Codec fields: path codec name vendor_id subsystem_id revision_id
+    Node fields:  nid wcaps pincap defcfg pinctl eapdbtl amp_in_caps
+                  amp_out_caps wtype jack_type jack_conn jack_location
+                  eapd pin_in pin_out pin_hp
+
+    Example: hda_fleet fleet.idx -w nid=0x1b -w 'jack_type=HP Out' -w eapd=0
+"""
+
+import os
+import re
+import sys
+import io
+import json
+import operator
+from multiprocessing import Pool
+from contextlib import redirect_stdout
+
+from hda_codec import VERBS, PARAMS, AC_NODE_ROOT, WIDGET_TYPE_IDS, \
+                      JACK_TYPES, JACK_CONNS, JACK_LOCATIONS
+from hda_proc import SplitProcFile, HDACodecProc, HDAProcBackend
+from hda_sim import HDASnapshotBackend, HDA_SNAPSHOT_MAGIC
+from hda_batch import BATCH_BLOCK, encode_block, decode_block, iter_jobs, \
+                      read_dump
+
+FLEET_CODEC_COLUMNS = [
+  ('path', 's'),
+  ('codec', 'i'),			# codec index in the dump
+  ('name', 's'),
+  ('vendor_id', 'I'),
+  ('subsystem_id', 'I'),
+  ('revision_id', 'I')
+]
+
+FLEET_NODE_COLUMNS = [
+  ('row', 'I'),				# codec row in the index
+  ('nid', 'I'),
+  ('wcaps', 'I'),
+  ('pincap', 'I'),
+  ('defcfg', 'I'),
+  ('pinctl', 'I'),
+  ('eapdbtl', 'i'),			# -1 when the pin has no EAPD
+  ('amp_in_caps', 'I'),
+  ('amp_out_caps', 'I')
+]
+
+# derived node field -> (node column, type, function)
+FLEET_DERIVED = {
+  'wtype': ('wcaps', 's',
+            lambda v: WIDGET_TYPE_IDS[(v >> 20) & 0x0f] or ''),
+  'jack_type': ('defcfg', 's', lambda v: JACK_TYPES[(v >> 20) & 0x0f]),
+  'jack_conn': ('defcfg', 's', lambda v: JACK_CONNS[(v >> 30) & 0x03]),
+  'jack_location': ('defcfg', 's',
+                    lambda v: JACK_LOCATIONS[(v >> 28) & 0x03]),
+  'eapd': ('eapdbtl', 'i', lambda v: v < 0 and -1 or (v >> 1) & 1),
+  'pin_in': ('pinctl', 'i', lambda v: (v >> 5) & 1),
+  'pin_out': ('pinctl', 'i', lambda v: (v >> 6) & 1),
+  'pin_hp': ('pinctl', 'i', lambda v: (v >> 7) & 1)
+}
+
+FLEET_OPS = {
+  '=': operator.eq,
+  '!=': operator.ne,
+  '<': operator.lt,
+  '<=': operator.le,
+  '>': operator.gt,
+  '>=': operator.ge,
+  '&': lambda a, b: a & b != 0
+}
+
+FLEET_CONDITION = re.compile(r'^\s*(\w+)\s*(!=|<=|>=|=|<|>|&)\s*(.*?)\s*$')
+FLEET_MAGIC = b'HDAFLEET 1\n'
+
+def fleet_fields(backend):
+  """return (codec fields, node rows) read through the backend verbs"""
+
+  def param(nid, param):
+    return backend.verb(nid, VERBS['PARAMETERS'], PARAMS[param])
+
+  def get(nid, verb):
+    return backend.verb(nid, VERBS[verb], 0) & 0xffffffff
+
+  vendor_id = param(AC_NODE_ROOT, 'VENDOR_ID')
+  subsystem_id = param(AC_NODE_ROOT, 'SUBSYSTEM_ID')
+  revision_id = param(AC_NODE_ROOT, 'REV_ID')
+  res = param(AC_NODE_ROOT, 'NODE_COUNT')
+  total, nid = res & 0x7fff, (res >> 16) & 0x7fff
+  afg = mfg = None
+  for i in range(total):
+    func = param(nid, 'FUNCTION_TYPE') & 0xff
+    if func == 0x01:
+      afg = nid
+    elif func == 0x02:
+      mfg = nid
+    else:
+      break
+    nid += 1
+  if subsystem_id == 0:
+    subsystem_id = get(afg and afg or mfg, 'GET_SUBSYSTEM_ID')
+  codec = (vendor_id & 0xffffffff, subsystem_id & 0xffffffff,
+           revision_id & 0xffffffff)
+  nodes = []
+  if afg is None:
+    return codec, nodes
+  afg_in = param(afg, 'AMP_IN_CAP')
+  afg_out = param(afg, 'AMP_OUT_CAP')
+  res = param(afg, 'NODE_COUNT')
+  count, nid = res & 0x7fff, (res >> 16) & 0x7fff
+  for nid in range(nid, nid + count):
+    wcaps = backend.wcap(nid)
+    ampin = ampout = pincap = defcfg = pinctl = 0
+    eapdbtl = -1
+    if wcaps & (1 << 1):		# IN_AMP
+      ampin = wcaps & (1 << 3) and param(nid, 'AMP_IN_CAP') or afg_in
+    if wcaps & (1 << 2):		# OUT_AMP
+      ampout = wcaps & (1 << 3) and param(nid, 'AMP_OUT_CAP') or afg_out
+    if WIDGET_TYPE_IDS[(wcaps >> 20) & 0x0f] == 'PIN':
+      pincap = param(nid, 'PIN_CAP')
+      defcfg = get(nid, 'GET_CONFIG_DEFAULT')
+      pinctl = get(nid, 'GET_PIN_WIDGET_CONTROL')
+      if pincap & (1 << 16):		# EAPD
+        eapdbtl = get(nid, 'GET_EAPD_BTLENABLE') & 0xff
+    nodes.append((nid, wcaps & 0xffffffff, pincap & 0xffffffff, defcfg,
+                  pinctl, eapdbtl, ampin & 0xffffffff, ampout & 0xffffffff))
+  return codec, nodes
+
+def fleet_dump(job):
+  """return (path, [(codec row, node rows)], errors) for one dump"""
+  path, data = job
+  res = []
+  errors = 0
+  try:
+    if data is None:
+      with open(path, 'rb') as fd:
+        snapshot = fd.read(len(HDA_SNAPSHOT_MAGIC)) == HDA_SNAPSHOT_MAGIC
+      if snapshot:
+        codec, nodes = fleet_fields(HDASnapshotBackend(path))
+        name = '0x%08x' % codec[0]
+        return path, [((path, 0, name) + codec, nodes)], 0
+    text = read_dump(path, data)
+  except Exception:
+    return path, res, 1
+  with redirect_stdout(io.StringIO()):	# drop the parser warnings
+    for idx, section in enumerate(SplitProcFile(io.StringIO(text))):
+      try:
+        c = HDACodecProc(0, idx, section)
+        if not c.proc_codec_id:
+          raise ValueError("no codec found")
+        codec, nodes = fleet_fields(HDAProcBackend(c))
+        res.append(((path, idx, c.proc_codec_id) + codec, nodes))
+      except Exception:
+        errors += 1
+  if not res and not errors:
+    errors = 1
+  return path, res, errors
+
+def build_index(paths, output, jobs=None):
+  """index all dumps in paths, return (dumps, codecs, nodes, errors)"""
+  codecs = []
+  nodes = []
+  dumps = errors = 0
+
+  def iter_all():
+    for path in paths:
+      for job in iter_jobs(path, ()):
+        yield job
+
+  with Pool(jobs) as pool:
+    for path, res, errs in pool.imap(fleet_dump, iter_all(), chunksize=16):
+      dumps += 1
+      errors += errs
+      for codec, rows in res:
+        row = len(codecs)
+        codecs.append(codec)
+        for node in rows:
+          nodes.append((row, ) + node)
+  header = {
+    'byteorder': sys.byteorder,
+    'codec_columns': FLEET_CODEC_COLUMNS,
+    'node_columns': FLEET_NODE_COLUMNS
+  }
+  tmp = '%s.%i.tmp' % (output, os.getpid())
+  with open(tmp, 'wb') as fd:
+    fd.write(FLEET_MAGIC + (json.dumps(header) + '\n').encode())
+    fd.write(encode_block(codecs, FLEET_CODEC_COLUMNS))
+    fd.write(encode_block(nodes, FLEET_NODE_COLUMNS))
+  os.replace(tmp, output)
+  return dumps, len(codecs), len(nodes), errors
+
+class FleetIndex:
+
+  """
+  In-memory columnar index of codec and node fields. Queries return the
+  selected node rows (or codec rows when only codec fields are used).
+  """
+
+  def __init__(self, filename):
+    self.derived = {}
+    with open(filename, 'rb') as fd:
+      if fd.readline() != FLEET_MAGIC:
+        raise ValueError("%s is not a hda_fleet index" % filename)
+      header = json.loads(fd.readline())
+      if [tuple(a) for a in header['codec_columns']] != FLEET_CODEC_COLUMNS or \
+         [tuple(a) for a in header['node_columns']] != FLEET_NODE_COLUMNS:
+        raise ValueError("%s: unknown columns" % filename)
+      swap = header['byteorder'] != sys.byteorder
+      self.codecs = self.read_block(fd, swap, FLEET_CODEC_COLUMNS)
+      self.nodes = self.read_block(fd, swap, FLEET_NODE_COLUMNS)
+    self.codec_count = len(self.codecs['path'])
+    self.node_count = len(self.nodes['row'])
+
+  def read_block(self, fd, swap, columns):
+    magic, count, size = BATCH_BLOCK.unpack(fd.read(BATCH_BLOCK.size))
+    payload = fd.read(size)
+    if magic != b'BLCK' or len(payload) < size:
+      raise ValueError("truncated hda_fleet index")
+    return decode_block(payload, count, swap, columns)
+
+  def is_codec_field(self, name):
+    return name in self.codecs
+
+  def field_type(self, name):
+    for columns in (FLEET_CODEC_COLUMNS, FLEET_NODE_COLUMNS):
+      for cname, type in columns:
+        if cname == name:
+          return type
+    if name in FLEET_DERIVED:
+      return FLEET_DERIVED[name][1]
+    raise ValueError("unknown field '%s'" % name)
+
+  def node_column(self, name):
+    """return values of the node field for all node rows"""
+    if name in self.nodes:
+      return self.nodes[name]
+    if not name in self.derived:
+      column, type, fcn = FLEET_DERIVED[name]
+      self.derived[name] = list(map(fcn, self.nodes[column]))
+    return self.derived[name]
+
+  def parse_condition(self, condition):
+    """return (field, function, value) for 'field op value'"""
+    m = FLEET_CONDITION.match(condition)
+    if not m:
+      raise ValueError("wrong condition '%s'" % condition)
+    name, op, value = m.groups()
+    if self.field_type(name) == 's':
+      if op == '&':
+        raise ValueError("'&' used for string field '%s'" % name)
+    else:
+      value = int(value, 0)
+    return name, FLEET_OPS[op], value
+
+  def select(self, conditions, fields=()):
+    """
+    Return (codec level, selected rows). The rows are codec rows when
+    all conditions and fields are codec fields, otherwise node rows.
+    """
+    conditions = [self.parse_condition(c) for c in conditions]
+    for name in fields:
+      self.field_type(name)
+    codec_level = True
+    for name in [c[0] for c in conditions] + list(fields):
+      if not self.is_codec_field(name):
+        codec_level = False
+    # the codec conditions are evaluated once per codec
+    codec_sel = None
+    for name, fcn, value in conditions:
+      if self.is_codec_field(name):
+        col = self.codecs[name]
+        if codec_sel is None:
+          codec_sel = range(self.codec_count)
+        codec_sel = [i for i in codec_sel if fcn(col[i], value)]
+    if codec_level:
+      if codec_sel is None:
+        return True, range(self.codec_count)
+      return True, codec_sel
+    row = self.nodes['row']
+    if codec_sel is None:
+      sel = range(self.node_count)
+    else:
+      codec_sel = set(codec_sel)
+      sel = [i for i in range(self.node_count) if row[i] in codec_sel]
+    for name, fcn, value in conditions:
+      if not self.is_codec_field(name):
+        col = self.node_column(name)
+        sel = [i for i in sel if fcn(col[i], value)]
+    return False, sel
+
+  def value(self, name, codec_level, idx):
+    if self.is_codec_field(name):
+      if not codec_level:
+        idx = self.nodes['row'][idx]
+      return self.codecs[name][idx]
+    return self.node_column(name)[idx]
+
+  def query(self, conditions, fields=()):
+    """
+    Return (codecs, nodes, groups) for the conditions, groups is a list
+    of (values, codecs, nodes) for the group by fields. The node counts
+    are None for the codec level queries.
+    """
+    codec_level, sel = self.select(conditions, fields)
+    row = self.nodes['row']
+    groups = {}
+    for idx in sel:
+      key = tuple([self.value(name, codec_level, idx) for name in fields])
+      if not key in groups:
+        groups[key] = [set(), 0]
+      if codec_level:
+        groups[key][0].add(idx)
+      else:
+        groups[key][0].add(row[idx])
+        groups[key][1] += 1
+    codecs = set()
+    for codec_rows, nodes in groups.values():
+      codecs |= codec_rows
+    if codec_level:
+      res = [(key, len(g[0]), None) for key, g in groups.items()]
+      return len(codecs), None, sorted(res, key=lambda g: (-g[1], g[0]))
+    res = [(key, len(g[0]), g[1]) for key, g in groups.items()]
+    return len(codecs), len(sel), sorted(res, key=lambda g: (-g[1], g[0]))
+
+  def matches(self, conditions):
+    """return (codec row, [nids]) for the matching codecs"""
+    codec_level, sel = self.select(conditions)
+    if codec_level:
+      return [(idx, []) for idx in sel]
+    res = {}
+    row = self.nodes['row']
+    nid = self.nodes['nid']
+    for idx in sel:
+      res.setdefault(row[idx], []).append(nid[idx])
+    return sorted(res.items())
+
+def format_value(name, value):
+  if name.endswith('_id') or name.endswith('caps') or name in \
+     ['pincap', 'defcfg', 'pinctl', 'nid']:
+    return '0x%02x' % value
+  return str(value)
+
+def main_query(argv):
+  conditions = []
+  fields = []
+  listing = False
+  filename = argv[1]
+  del argv[1]
+  while len(argv) > 1:
+    if argv[1] == '-w' and len(argv) > 2:
+      conditions.append(argv[2])
+      del argv[1:3]
+    elif argv[1] == '-g' and len(argv) > 2:
+      fields += [f for f in argv[2].split(',') if f]
+      del argv[1:3]
+    elif argv[1] == '-l':
+      listing = True
+      del argv[1]
+    else:
+      print("Unknown option '%s'" % argv[1])
+      return 0
+  index = FleetIndex(filename)
+  try:
+    if listing:
+      for row, nids in index.matches(conditions):
+        print('%s\t%i\t%s\t%s' % (index.codecs['path'][row],
+              index.codecs['codec'][row], index.codecs['name'][row],
+              ','.join(['0x%02x' % nid for nid in nids])))
+      return 1
+    codecs, nodes, groups = index.query(conditions, fields)
+  except ValueError as msg:
+    print(msg)
+    return 0
+  counts = nodes is None and ['codecs'] or ['codecs', 'nodes']
+  if fields:
+    print('\t'.join(counts + fields))
+    for key, gcodecs, gnodes in groups:
+      res = ['%i' % gcodecs]
+      if not gnodes is None:
+        res.append('%i' % gnodes)
+      print('\t'.join(res + [format_value(n, v) for n, v in zip(fields, key)]))
+  if nodes is None:
+    print("%i of %i codecs match" % (codecs, index.codec_count))
+  else:
+    print("%i of %i codecs, %i nodes match" % \
+          (codecs, index.codec_count, nodes))
+  return 1
+
+def main(argv):
+  jobs = None
+  output = None
+  while len(argv) > 1 and argv[1] in ('-j', '-o') and len(argv) > 2:
+    if argv[1] == '-j':
+      jobs = int(argv[2])
+    else:
+      output = argv[2]
+    del argv[1:3]
+  if len(argv) < 2:
+    print(__doc__)
+    return 0
+  if output is None:
+    return main_query(argv)
+  dumps, codecs, nodes, errors = build_index(argv[1:], output, jobs)
+  print("%i dumps, %i codecs, %i nodes indexed (%i errors)" % \
+        (dumps, codecs, nodes, errors))
+  return 1
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -21,25 +21,19 @@ from hda_guilib import *
 from hda_codec import EAPDBTL_BITS, PIN_WIDGET_CONTROL_BITS, \
                       PIN_WIDGET_CONTROL_VREF, DIG1_BITS, GPIO_IDS, \
                       HDA_INPUT, HDA_OUTPUT
+from hda_layout import GraphNode, GraphRoute, layout_codec
+from hda_cache import LayoutCache
 
 GRAPH_WINDOWS = {}
+GRAPH_LAYOUT = 'layered'	# see hda_layout.GRAPH_LAYOUTS
+GRAPH_LAYOUT_CACHE = LayoutCache()
 
 class DummyScrollEvent:
 
   def __init__(self, dir):
     self.direction = dir
 
-class Node:
-
-  def __init__(self, codec, node, x, y, nodesize, extra):
-    self.codec = codec
-    self.node = node
-    self.extra = extra
-    sx = sy = nodesize
-    self.myarea = [extra+x*(sx+extra), extra+y*(sy+extra), sx, sy]
-    self.src_routes = []
-    self.dst_routes = []
-    self.win = None
+class Node(GraphNode):
 
   def longdesc(self):
     return "0x%02x" % self.node.nid
@@ -82,39 +76,6 @@ class Node:
     cr.text_path('OUT')
     cr.stroke()
 
-  def has_x(self, x):
-    x1 = self.myarea[0]
-    x2 = x1 + self.myarea[2]
-    return x >= x1 and x <= x2
-    
-  def compressx(self, first, size):
-    if self.myarea[0] > first:
-      self.myarea[0] -= size
-
-  def has_y(self, y):
-    y1 = self.myarea[1]
-    y2 = y1 + self.myarea[3]
-    return y >= y1 and y <= y2
-    
-  def compressy(self, first, size):
-    if self.myarea[1] > first:
-      self.myarea[1] -= size
-
-  def in_area(self, x, y):
-    if x >= self.myarea[0] and \
-       y >= self.myarea[1] and \
-       x < self.myarea[0] + self.myarea[2] and \
-       y < self.myarea[1] + self.myarea[3]:
-      wherex = x - self.myarea[0]
-      wherey = y - self.myarea[1]
-      if wherey >= (self.myarea[3]/4) * 3:
-        if wherex >= self.myarea[2]/2:
-          return "dst"
-        else:
-          return "src"
-      else:
-        return "body"
-
   def mouse_move(self, x, y, graph):
     what = self.in_area(x, y)
     if not what is None:
@@ -128,19 +89,7 @@ class Node:
         graph.popup = self.codec.dump_node(self.node)
       return True
 
-class Route:
-
-  def __init__(self, codec, src_node, dst_node, routes, nodes):
-    self.codec = codec
-    self.src = src_node
-    self.dst = dst_node
-    self.lines = []
-    self.wronglines = []
-    self.analyze_routes(routes, nodes)
-    src_node.dst_routes.append(self)
-    dst_node.src_routes.append(self)
-    self.highlight = False
-    self.marked = False
+class Route(GraphRoute):
 
   def shortdesc(self):
     return "0x%02x->0x%02x" % (self.src.node.nid, self.dst.node.nid)
@@ -178,24 +127,24 @@ class Route:
       cr.line_to(self.dst.myarea[0]+width/4, self.dst.myarea[1]+height)
       cr.stroke()
 
-    for line in self.lines:
-      if self.marked:
-        cr.set_line_width(1.8)
-        cr.set_source_rgb(1, 0, 1)
-      elif self.highlight:
-        cr.set_line_width(1.5)
-        cr.set_source_rgb(1, 0, 0)
+    if self.marked:
+      cr.set_line_width(1.8)
+      cr.set_source_rgb(1, 0, 1)
+    elif self.highlight:
+      cr.set_line_width(1.5)
+      cr.set_source_rgb(1, 0, 0)
+    else:
+      inactive = self.src.node.is_conn_active(self.dst.node)
+      if inactive is None:
+        cr.set_line_width(0.35)
+        cr.set_source_rgb(0, 0, 0)
+      elif inactive is False:
+        cr.set_line_width(0.35)
+        cr.set_source_rgb(0, 0, 1)
       else:
-        inactive = self.src.node.is_conn_active(self.dst.node)
-        if inactive is None:
-          cr.set_line_width(0.35)
-          cr.set_source_rgb(0, 0, 0)
-        elif inactive is False:
-          cr.set_line_width(0.35)
-          cr.set_source_rgb(0, 0, 1)
-        else:
-          cr.set_line_width(1.5)
-          cr.set_source_rgb(0, 0, 1)
+        cr.set_line_width(1.5)
+        cr.set_source_rgb(0, 0, 1)
+    for line in self.lines:
       cr.move_to(line[0], line[1])
       cr.line_to(line[2], line[3])
       cr.stroke()
@@ -207,233 +156,6 @@ class Route:
       cr.line_to(line[2], line[3])
       cr.stroke()
 
-  def select_line(self, routes, nodes, possible):
-
-    def check_dot(posx, posy, line):
-      if posx == line[0] and posx == line[2]:
-        if line[1] < line[3]:
-          if posy >= line[1] and posy <= line[3]:
-            #print "Clash1", posx, posy, line
-            return True
-        else:
-          if posy >= line[3] and posy <= line[1]:
-            #print "Clash2", posx, posy, line
-            return True
-      if posy == line[1] and posy == line[3]:
-        if line[0] < line[2]:
-          if posx >= line[0] and posx <= line[2]:
-            #print "Clash3", posx, posy, line
-            return True
-        else:
-          if posx >= line[2] and posx <= line[0]:
-            #print "Clash4", posx, posy, line
-            return True
-      if posx == line[0] and posy == line[1]:
-        #print "Clash5", posx, posy, line
-        return True
-      if posx == line[2] and posy == line[3]:
-        #print "Clash6", posx, posy, line
-        return True
-      return False 
-
-    for p in possible:
-      found = False
-      for route in routes:
-        if found:
-          break
-        for line in route.lines:
-          if check_dot(line[0], line[1], p) or \
-             check_dot(line[2], line[3], p) or \
-             check_dot(p[0], p[1], line) or \
-             check_dot(p[2], p[3], line):
-            #print "Found1", p
-            found = True
-            break
-      if nodes and not found:
-        x1, y1, x2, y2 = p
-        if x1 > x2 or y1 > y2:
-          x2, y2, x1, y1 = p
-        for node in nodes:
-          xx1, yy1, xx2, yy2 = node.myarea
-          xx2 += xx1
-          yy2 += yy1
-          if x1 < xx2 and x2 >= xx1 and y1 < yy2 and y2 >= yy1:
-            #print "Found2", x1, y1, x2, y2, xx1, yy1, xx2, yy2
-            found = True
-            break
-      if not found:
-        #print "OK x1=%s,y1=%s,x2=%s,y2=%s" % (p[0], p[1], p[2], p[3])
-        return p
-
-  def analyze_routes(self, routes, nodes):
-    posx, posy, width, height = self.src.myarea
-    dposx, dposy, dwidth, dheight = self.dst.myarea
-    extra = self.src.extra
-    
-    possible = []
-    startx = posx >= dposx and posx - extra or posx + width
-    xrange = list(range(5, extra-1, 5))
-    if posx >= dposx:
-      xrange.reverse()
-      a = list(range(width+extra+5, width+extra*2-1, 5))
-      a.reverse()
-      xrange = xrange + a
-      for i in range(2, 10):
-        a = list(range(width*i+extra*i+5, width*i+extra*(i+1)-1, 5))
-        a.reverse()
-        xrange = xrange + a
-    else:
-      xrange += list(range(width+extra+5, width+extra*2-1, 5))
-      for i in range(2, 10):
-        xrange += list(range(width*i+extra*i+5, width*i+extra*(i+1)-1, 5))
-    for j in xrange:
-      possible.append([startx + j, posy + height + 5,
-                       startx + j, dposy + height + 5])
-    sel = self.select_line(routes, None, possible)
-    if not sel:
-      raise ValueError("unable to route")
-
-    self.lines.append(sel)
-
-  def finish(self, routes, nodes):
-
-    if not self.lines:
-      return
-
-    posx, posy, width, height = self.src.myarea
-    dposx, dposy, dwidth, dheight = self.dst.myarea
-    extra = self.src.extra
-    sel = self.lines[0]
-    res = True
-
-    x = posx+(width/2)
-    y = posy+height
-    for tryit in range(3):
-      possible = []
-      fixup = sel[0] > posx and -1 or 1
-      r = list(range(tryit*extra, (tryit+1)*extra-5-1, 5))
-      if tryit == 2:
-        r = list(range(-height-extra+5, -height-5, 5))
-        r.reverse()
-      x1 = x + 5 + fixup
-      x2 = sel[0] - fixup
-      if x1 > x2:
-        sub = width/2
-        x1 = x + sub + fixup
-        sub -= 5
-      else:
-        sub = 0
-      for i in range(tryit*extra, (tryit+1)*extra-5-1, 5):
-        possible.append([x1, sel[1]+i, x2, sel[1]+i])
-      sel1 = self.select_line(routes, nodes, possible)
-      if sel1:
-        sel1[0] -= fixup + sub
-        sel1[2] += fixup
-        possible = []
-        for j in range(0, (width // 2)-10, 5):
-          possible.append([sel1[0]+j, y, sel1[0]+j, sel1[1]])
-        sel2 = self.select_line(routes, nodes, possible)
-        if sel2:
-          sel1[0] = sel2[0]
-          self.lines[0][1] = sel1[1]
-          self.lines.append(sel1)
-          self.lines.append(sel2)
-          tryit = -1
-          break
-    if tryit >= 0:
-      self.wronglines.append([x+5, y, sel[0], sel[1]])
-      print("[1] displaced route 0x%x->0x%x %s %s" % (self.src.node.nid, self.dst.node.nid, repr(self.lines[-1]), repr(sel)))
-      res = False
-
-    x = dposx
-    y = dposy+height
-    for tryit in range(3):
-      possible = []
-      fixup = sel[2] > posx and -1 or 1
-      r = list(range(tryit * extra, (tryit+1)*extra-5-1, 5))
-      if tryit == 2:
-        r = list(range(-height-extra+5, -height-5, 5))
-        r.reverse()
-      sub = width/2
-      x1 = x + sub + fixup
-      x2 = sel[2] - fixup
-      if x1 < x2:
-        x1 = x + 5 + fixup
-        sub = 0
-      else:
-        sub -= 5
-      for i in r:
-        possible.append([x1, sel[3]+i, x2, sel[3]+i])
-      sel1 = self.select_line(routes, nodes, possible)
-      if sel1:
-        sel1[0] -= fixup + sub
-        sel1[2] += fixup
-        possible = []
-        for j in range(0, (width // 2)-10, 5):
-          possible.append([sel1[0]+j, y, sel1[0]+j, sel1[1]])
-        sel2 = self.select_line(routes, nodes, possible)
-        if sel2:
-          sel1[0] = sel2[0]
-          self.lines[0][3] = sel1[3]
-          self.lines.append(sel1)
-          self.lines.append(sel2)
-          tryit = -1
-          break
-    if tryit >= 0:
-      self.wronglines.append([x+5, y, sel[2], sel[3]])
-      print("[2] displaced route 0x%x->0x%x %s %s" % (self.src.node.nid, self.dst.node.nid, repr(self.lines[-1]), repr(sel)))
-      res = False
-      
-    return res
-
-  def has_x(self, x):
-    for line in self.lines:
-      if line[0] == x or line[2] == x:
-        return True
-    return False
-    
-  def compressx(self, first, size):
-    idx = 0
-    while idx < len(self.lines):
-      line = self.lines[idx]
-      if line[0] > first:
-        line[0] -= size
-        self.lines[idx] = line
-      if line[2] > first:
-        line[2] -= size
-        self.lines[idx] = line
-      idx += 1
-
-  def has_y(self, y):
-    for line in self.lines:
-      if line[1] == y or line[3] == y:
-        return True
-    return False
-    
-  def compressy(self, first, size):
-    idx = 0
-    while idx < len(self.lines):
-      line = self.lines[idx]
-      if line[1] > first:
-        line[1] -= size
-        self.lines[idx] = line
-      if line[3] > first:
-        line[3] -= size
-        self.lines[idx] = line
-      idx += 1
-
-  def in_area(self, x, y):
-    for line in self.lines:
-      x1, y1, x2, y2 = line
-      if x1 > x2 or y1 > y2:
-        x2, y2, x1, y1 = line
-      if x1 == x2 and abs(x1 - x) < 3:
-        if y1 <= y and y2 >= y:
-          return True
-      elif y1 == y2 and abs(y1 - y) < 3:
-        if x1 <= x and x2 >= x:
-          return True
-
   def mouse_move(self, x, y, graph):
     if self.in_area(x, y):
       self.highlight = True
@@ -460,101 +182,33 @@ class CodecGraphLayout(gtk.Layout):
 
     self.codec = codec
     self.mytitle = mytitle
-    self.graph = codec.graph(dump=False)
     self.startnode = None
     self.endnode = None
 
     self.changed_handler = HDA_SIGNAL.connect("hda-node-changed", self.hda_node_changed)
 
-    ok = False
-    for extra in [150, 200, 300]:
-      if self.build(extra):
-        ok = True
-        break
-    if not ok:
+    if not self.build():
       print("Not all routes are placed correctly!!!")
 
   def __destroy(self, widget):
     if self.popup_win:
       self.popup_win.destroy()
 
-  def __build(self, extra=50):
-    self.nodes = []
-    self.routes = []
-    maxconns = 0
-    for nid in self.codec.nodes:
-      node = self.codec.nodes[nid]
-      conns = max(self.codec.connections(nid, 0),
-                  self.codec.connections(nid, 1))
-      if conns > maxconns:
-        maxconns = conns
-    nodesize = max((maxconns * 5 + 10) * 2, 100)
-    if self.graph:
-      for y in range(len(self.graph)):
-        for x in range(len(self.graph[0])):
-          nid = self.graph[y][x]
-          if not nid is None:
-            node = self.codec.nodes[nid]
-            w = Node(self.codec, node, x, y, nodesize, extra)
-            self.nodes.append(w)
-    sx = len(self.graph[0])*(nodesize+extra)+extra
-    sy = len(self.graph)*(nodesize+extra)+extra
-    self.set_size(sx, sy)
-    total = 0
-    for node in self.nodes:
-      if not node.node.connections:
-        continue
-      for conn in node.node.connections:
-        for node1 in self.nodes:
-          if node1.node.nid == conn:
-            total += 1
-            break
-    total *= 2
-    total += 1
-    position = 0
-    for node in self.nodes:
-      if not node.node.connections:
-        continue
-      for conn in node.node.connections:
-        for node1 in self.nodes:
-          if node1.node.nid == conn:
-            r = Route(self.codec, node1, node, self.routes, self.nodes)
-            self.routes.append(r)
-            position += 1
-            self.pdialog.set_fraction(float(position) / total)
-            break
-    res = True
-    for route in self.routes:
-      if not route.finish(self.routes, self.nodes):
-        res = False
-        break
-      position += 1
-      self.pdialog.set_fraction(float(position) / total)
-    if not res:
-      return
-    # final step - optimize drawings
-    while 1:
-      size = self.compressx(sx)
-      if not size:
-        break
-      sx -= size
-    position += 1
-    self.pdialog.set_fraction(float(position) / total)
-    while 1:
-      size = self.compressy(sy)
-      if not size:
-        break
-      sy -= size
-    self.set_size(sx, sy)
-    return res
-
-  def build(self, extra=50):
+  def build(self):
     self.pdialog = SimpleProgressDialog("Rendering routes")
     self.pdialog.show_all()
-    res = self.__build(extra)
+    layout = layout_codec(self.codec, GRAPH_LAYOUT, node_class=Node,
+                          route_class=Route, cache=GRAPH_LAYOUT_CACHE,
+                          progress=self.pdialog.set_fraction)
+    self.nodes = []
+    self.routes = []
+    if layout:
+      self.nodes = layout.nodes
+      self.routes = layout.routes
+      self.set_size(*layout.size)
     self.pdialog.destroy()
     self.pdialog = None
-    return res
+    return not layout or layout.complete
 
   def expose(self, area, context):
     if not self.get_realized():
@@ -576,59 +230,8 @@ class CodecGraphLayout(gtk.Layout):
     for route in self.routes:
       route.expose(cr)
 
-  def compressx(self, sx):
-    first = None
-    for a in range(15, sx, 5):
-      found = False
-      for node in self.nodes:
-        if node.has_x(a):
-          found = True
-          break
-      if not found:
-        for route in self.routes:
-          if route.has_x(a):
-            found = True
-            break
-      if not found:
-        if first is None:
-          first = a
-        last = a
-      elif first is not None:
-        size = (last - first) + 5
-        for node in self.nodes:
-          node.compressx(first, size)
-        for route in self.routes:
-          route.compressx(first, size)
-        return size
-    return None
-
-  def compressy(self, sy):
-    first = None
-    for a in range(15, sy, 5):
-      found = False
-      for node in self.nodes:
-        if node.has_y(a):
-          found = True
-          break
-      if not found:
-        for route in self.routes:
-          if route.has_y(a):
-            found = True
-            break
-      if not found:
-        if first is None:
-          first = a
-        last = a
-      elif first is not None:
-        size = (last - first) + 5
-        for node in self.nodes:
-          node.compressy(first, size)
-        for route in self.routes:
-          route.compressy(first, size)
-        return size
-    return None
-
   def hda_node_changed(self, obj, widget, node):
+    # the topology is not changed, only restyle the routes
     if widget != self:
       self.queue_draw()
 
@@ -20,6 +20,7 @@ from hda_codec import HDACodec, HDA_card_list, \
                       EAPDBTL_BITS, PIN_WIDGET_CONTROL_BITS, \
                       PIN_WIDGET_CONTROL_VREF, DIG1_BITS, GPIO_IDS, \
                       HDA_INPUT, HDA_OUTPUT
+from hda_diff import codec_diff
 
 DIFF_FILE = "/tmp/hda-analyze.diff"
 
@@ -46,12 +47,8 @@ gobject.signal_new("hda-node-changed", HDASignal,
 HDA_SIGNAL = HDASignal()
 
 def do_diff1(codec, diff1):
-  from difflib import unified_diff
-  diff = unified_diff(diff1.split('\n'), codec.dump().split('\n'), n=8, lineterm='')
-  diff = '\n'.join(list(diff))
-  if len(diff) > 0:
-    diff = 'Diff for codec %i/%i (%s):\n' % (codec.card, codec.device, codec.name) + diff
-  return diff
+  """diff1 is the CodecSnapshot taken when the codec was read"""
+  return codec_diff(codec, diff1)
 
 def do_diff():
   diff = ''
@@ -0,0 +1,1047 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+"""
+Codec graph layout without GTK. GraphLayout places the node boxes to the
+HDACodec.graph() grid, searches the orthogonal routes between them and
+removes the whitespace. LayeredLayout ranks the widgets by the signal
+flow and places nodes and routes in one pass. The GTK widgets in
+hda_graph add the drawing and the mouse handling on top.
+
+The layout depends only on the codec topology (see layout_key()), so
+the placed nodes and routes are cached as plain data (layout_state())
+and restored by CachedLayout for other codecs of the same model.
+"""
+
+from bisect import bisect_left
+from hashlib import sha1
+
+LAYOUT_STATE_VERSION = 2		# bump when the layout output changes
+ROUTE_GRID_CELL = 128
+GRAPH_EXTRA = [150, 200, 300]	# node spacing tried by the layout
+
+def check_dot(posx, posy, line):
+  """return True when the point lies on the line (or on its end points)"""
+  if posx == line[0] and posx == line[2]:
+    if line[1] < line[3]:
+      if posy >= line[1] and posy <= line[3]:
+        return True
+    else:
+      if posy >= line[3] and posy <= line[1]:
+        return True
+  if posy == line[1] and posy == line[3]:
+    if line[0] < line[2]:
+      if posx >= line[0] and posx <= line[2]:
+        return True
+    else:
+      if posx >= line[2] and posx <= line[0]:
+        return True
+  if posx == line[0] and posy == line[1]:
+    return True
+  if posx == line[2] and posy == line[3]:
+    return True
+  return False
+
+def check_line(p, line):
+  """return True when the lines touch (an end point lies on the other line)"""
+  return check_dot(line[0], line[1], p) or \
+         check_dot(line[2], line[3], p) or \
+         check_dot(p[0], p[1], line) or \
+         check_dot(p[2], p[3], line)
+
+def check_area(p, area):
+  """return True when the line goes through the node area"""
+  x1, y1, x2, y2 = p
+  if x1 > x2 or y1 > y2:
+    x2, y2, x1, y1 = p
+  xx1, yy1, xx2, yy2 = area
+  xx2 += xx1
+  yy2 += yy1
+  return x1 < xx2 and x2 >= xx1 and y1 < yy2 and y2 >= yy1
+
+class RouteIndex:
+
+  """
+  Placed route lines and node areas for the route collision checks.
+  This one checks all of them, see RouteGrid.
+  """
+
+  def __init__(self):
+    self.lines = []
+    self.areas = []
+
+  def add_node(self, node):
+    self.areas.append(node.myarea)
+
+  def add_line(self, line):
+    self.lines.append(line)
+
+  def remove_line(self, line):
+    for idx in range(len(self.lines)):
+      if self.lines[idx] is line:
+        del self.lines[idx]
+        return
+
+  def line_clash(self, p):
+    for line in self.lines:
+      if check_line(p, line):
+        return True
+    return False
+
+  def node_clash(self, p):
+    for area in self.areas:
+      if check_area(p, area):
+        return True
+    return False
+
+  def select_line(self, possible, nodes=True):
+    """return the first line from possible which does not clash"""
+    for p in possible:
+      if self.line_clash(p):
+        continue
+      if nodes and self.node_clash(p):
+        continue
+      return p
+
+class RouteGrid(RouteIndex):
+
+  """
+  Uniform grid of cells, each placed line and node area is registered in
+  all cells it crosses. Touching lines (and a line crossing an area) share
+  a point, so only the items from the cells under the checked line are
+  tested.
+  """
+
+  def __init__(self, cell=ROUTE_GRID_CELL):
+    self.cell = cell
+    self.line_cells = {}
+    self.area_cells = {}
+
+  def cells(self, x1, y1, x2, y2):
+    cell = self.cell
+    if x1 > x2:
+      x1, x2 = x2, x1
+    if y1 > y2:
+      y1, y2 = y2, y1
+    res = []
+    for cx in range(int(x1 // cell), int(x2 // cell) + 1):
+      for cy in range(int(y1 // cell), int(y2 // cell) + 1):
+        res.append((cx, cy))
+    return res
+
+  def add_node(self, node):
+    x, y, w, h = node.myarea
+    for key in self.cells(x, y, x + w, y + h):
+      self.area_cells.setdefault(key, []).append(node.myarea)
+
+  def add_line(self, line):
+    for key in self.cells(*line):
+      self.line_cells.setdefault(key, []).append(line)
+
+  def remove_line(self, line):
+    for key in self.cells(*line):
+      items = self.line_cells[key]
+      for idx in range(len(items)):
+        if items[idx] is line:
+          del items[idx]
+          break
+
+  def line_clash(self, p):
+    seen = set()
+    for key in self.cells(*p):
+      for line in self.line_cells.get(key, ()):
+        if id(line) in seen:
+          continue
+        seen.add(id(line))
+        if check_line(p, line):
+          return True
+    return False
+
+  def node_clash(self, p):
+    for key in self.cells(*p):
+      for area in self.area_cells.get(key, ()):
+        if check_area(p, area):
+          return True
+    return False
+
+class GraphNode:
+
+  def __init__(self, codec, node, x, y, nodesize, extra):
+    self.codec = codec
+    self.node = node
+    self.extra = extra
+    sx = sy = nodesize
+    self.myarea = [extra+x*(sx+extra), extra+y*(sy+extra), sx, sy]
+    self.src_routes = []
+    self.dst_routes = []
+    self.win = None
+
+  def has_x(self, x):
+    x1 = self.myarea[0]
+    x2 = x1 + self.myarea[2]
+    return x >= x1 and x <= x2
+
+  def compressx(self, first, size):
+    if self.myarea[0] > first:
+      self.myarea[0] -= size
+
+  def has_y(self, y):
+    y1 = self.myarea[1]
+    y2 = y1 + self.myarea[3]
+    return y >= y1 and y <= y2
+
+  def compressy(self, first, size):
+    if self.myarea[1] > first:
+      self.myarea[1] -= size
+
+  def in_area(self, x, y):
+    if x >= self.myarea[0] and \
+       y >= self.myarea[1] and \
+       x < self.myarea[0] + self.myarea[2] and \
+       y < self.myarea[1] + self.myarea[3]:
+      wherex = x - self.myarea[0]
+      wherey = y - self.myarea[1]
+      if wherey >= (self.myarea[3]/4) * 3:
+        if wherex >= self.myarea[2]/2:
+          return "dst"
+        else:
+          return "src"
+      else:
+        return "body"
+
+class GraphRoute:
+
+  def __init__(self, codec, src_node, dst_node, index):
+    self.codec = codec
+    self.src = src_node
+    self.dst = dst_node
+    self.lines = []
+    self.wronglines = []
+    if not index is None:		# the lines are set by the layout
+      self.analyze_routes(index)
+    src_node.dst_routes.append(self)
+    dst_node.src_routes.append(self)
+    self.highlight = False
+    self.marked = False
+
+  def analyze_routes(self, index):
+    posx, posy, width, height = self.src.myarea
+    dposx, dposy, dwidth, dheight = self.dst.myarea
+    extra = self.src.extra
+
+    possible = []
+    startx = posx >= dposx and posx - extra or posx + width
+    xrange = list(range(5, extra-1, 5))
+    if posx >= dposx:
+      xrange.reverse()
+      a = list(range(width+extra+5, width+extra*2-1, 5))
+      a.reverse()
+      xrange = xrange + a
+      for i in range(2, 10):
+        a = list(range(width*i+extra*i+5, width*i+extra*(i+1)-1, 5))
+        a.reverse()
+        xrange = xrange + a
+    else:
+      xrange += list(range(width+extra+5, width+extra*2-1, 5))
+      for i in range(2, 10):
+        xrange += list(range(width*i+extra*i+5, width*i+extra*(i+1)-1, 5))
+    for j in xrange:
+      possible.append([startx + j, posy + height + 5,
+                       startx + j, dposy + height + 5])
+    sel = index.select_line(possible, False)
+    if not sel:
+      raise ValueError("unable to route")
+
+    self.lines.append(sel)
+    index.add_line(sel)
+
+  def finish(self, index):
+
+    if not self.lines:
+      return
+
+    posx, posy, width, height = self.src.myarea
+    dposx, dposy, dwidth, dheight = self.dst.myarea
+    extra = self.src.extra
+    sel = self.lines[0]
+    res = True
+
+    x = posx+(width/2)
+    y = posy+height
+    for tryit in range(3):
+      possible = []
+      fixup = sel[0] > posx and -1 or 1
+      r = list(range(tryit*extra, (tryit+1)*extra-5-1, 5))
+      if tryit == 2:
+        r = list(range(-height-extra+5, -height-5, 5))
+        r.reverse()
+      x1 = x + 5 + fixup
+      x2 = sel[0] - fixup
+      if x1 > x2:
+        sub = width/2
+        x1 = x + sub + fixup
+        sub -= 5
+      else:
+        sub = 0
+      for i in range(tryit*extra, (tryit+1)*extra-5-1, 5):
+        possible.append([x1, sel[1]+i, x2, sel[1]+i])
+      sel1 = index.select_line(possible)
+      if sel1:
+        sel1[0] -= fixup + sub
+        sel1[2] += fixup
+        possible = []
+        for j in range(0, (width // 2)-10, 5):
+          possible.append([sel1[0]+j, y, sel1[0]+j, sel1[1]])
+        sel2 = index.select_line(possible)
+        if sel2:
+          sel1[0] = sel2[0]
+          index.remove_line(self.lines[0])
+          self.lines[0][1] = sel1[1]
+          index.add_line(self.lines[0])
+          self.lines.append(sel1)
+          self.lines.append(sel2)
+          index.add_line(sel1)
+          index.add_line(sel2)
+          tryit = -1
+          break
+    if tryit >= 0:
+      self.wronglines.append([x+5, y, sel[0], sel[1]])
+      print("[1] displaced route 0x%x->0x%x %s %s" % (self.src.node.nid, self.dst.node.nid, repr(self.lines[-1]), repr(sel)))
+      res = False
+
+    x = dposx
+    y = dposy+height
+    for tryit in range(3):
+      possible = []
+      fixup = sel[2] > posx and -1 or 1
+      r = list(range(tryit * extra, (tryit+1)*extra-5-1, 5))
+      if tryit == 2:
+        r = list(range(-height-extra+5, -height-5, 5))
+        r.reverse()
+      sub = width/2
+      x1 = x + sub + fixup
+      x2 = sel[2] - fixup
+      if x1 < x2:
+        x1 = x + 5 + fixup
+        sub = 0
+      else:
+        sub -= 5
+      for i in r:
+        possible.append([x1, sel[3]+i, x2, sel[3]+i])
+      sel1 = index.select_line(possible)
+      if sel1:
+        sel1[0] -= fixup + sub
+        sel1[2] += fixup
+        possible = []
+        for j in range(0, (width // 2)-10, 5):
+          possible.append([sel1[0]+j, y, sel1[0]+j, sel1[1]])
+        sel2 = index.select_line(possible)
+        if sel2:
+          sel1[0] = sel2[0]
+          index.remove_line(self.lines[0])
+          self.lines[0][3] = sel1[3]
+          index.add_line(self.lines[0])
+          self.lines.append(sel1)
+          self.lines.append(sel2)
+          index.add_line(sel1)
+          index.add_line(sel2)
+          tryit = -1
+          break
+    if tryit >= 0:
+      self.wronglines.append([x+5, y, sel[2], sel[3]])
+      print("[2] displaced route 0x%x->0x%x %s %s" % (self.src.node.nid, self.dst.node.nid, repr(self.lines[-1]), repr(sel)))
+      res = False
+
+    return res
+
+  def has_x(self, x):
+    for line in self.lines:
+      if line[0] == x or line[2] == x:
+        return True
+    return False
+
+  def compressx(self, first, size):
+    idx = 0
+    while idx < len(self.lines):
+      line = self.lines[idx]
+      if line[0] > first:
+        line[0] -= size
+        self.lines[idx] = line
+      if line[2] > first:
+        line[2] -= size
+        self.lines[idx] = line
+      idx += 1
+
+  def has_y(self, y):
+    for line in self.lines:
+      if line[1] == y or line[3] == y:
+        return True
+    return False
+
+  def compressy(self, first, size):
+    idx = 0
+    while idx < len(self.lines):
+      line = self.lines[idx]
+      if line[1] > first:
+        line[1] -= size
+        self.lines[idx] = line
+      if line[3] > first:
+        line[3] -= size
+        self.lines[idx] = line
+      idx += 1
+
+  def in_area(self, x, y):
+    for line in self.lines:
+      x1, y1, x2, y2 = line
+      if x1 > x2 or y1 > y2:
+        x2, y2, x1, y1 = line
+      if x1 == x2 and abs(x1 - x) < 3:
+        if y1 <= y and y2 >= y:
+          return True
+      elif y1 == y2 and abs(y1 - y) < 3:
+        if x1 <= x and x2 >= x:
+          return True
+
+class GraphLayout:
+
+  """
+  Node and route placement for the codec graph. The node and route
+  classes can be replaced (the GTK graph uses its own subclasses with
+  the drawing code), index_class is the collision index for routing.
+  """
+
+  def __init__(self, codec, graph=None, node_class=GraphNode,
+               route_class=GraphRoute, index_class=RouteGrid):
+    if graph is None:
+      graph = codec.graph(dump=False)
+    self.codec = codec
+    self.graph = graph
+    self.node_class = node_class
+    self.route_class = route_class
+    self.index_class = index_class
+    self.nodes = []
+    self.routes = []
+    self.size = (0, 0)
+    self.complete = False
+
+  def build(self, extra=50, progress=None):
+    """place nodes and routes, return True when all routes were placed"""
+    index = self.place_nodes(extra)
+    if not self.place_routes(index, progress):
+      return
+    self.compress(progress)
+    self.complete = True
+    return True
+
+  def place_nodes(self, extra):
+    """create nodes at the graph positions, return the route index"""
+    self.nodes = []
+    self.routes = []
+    maxconns = 0
+    for nid in self.codec.nodes:
+      node = self.codec.nodes[nid]
+      conns = max(self.codec.connections(nid, 0),
+                  self.codec.connections(nid, 1))
+      if conns > maxconns:
+        maxconns = conns
+    nodesize = max((maxconns * 5 + 10) * 2, 100)
+    index = self.index_class()
+    if self.graph:
+      for y in range(len(self.graph)):
+        for x in range(len(self.graph[0])):
+          nid = self.graph[y][x]
+          if not nid is None:
+            node = self.codec.nodes[nid]
+            w = self.node_class(self.codec, node, x, y, nodesize, extra)
+            self.nodes.append(w)
+            index.add_node(w)
+    sx = len(self.graph[0])*(nodesize+extra)+extra
+    sy = len(self.graph)*(nodesize+extra)+extra
+    self.size = (sx, sy)
+    return index
+
+  def place_routes(self, index, progress=None):
+    """route all connections, return True when all routes were placed"""
+    bynid = {}
+    for node in self.nodes:
+      bynid[node.node.nid] = node
+    total = 0
+    for node in self.nodes:
+      if not node.node.connections:
+        continue
+      for conn in node.node.connections:
+        if conn in bynid:
+          total += 1
+    total *= 2
+    total += 1
+    position = 0
+    for node in self.nodes:
+      if not node.node.connections:
+        continue
+      for conn in node.node.connections:
+        if conn in bynid:
+          r = self.route_class(self.codec, bynid[conn], node, index)
+          self.routes.append(r)
+          position += 1
+          if progress:
+            progress(float(position) / total)
+    for route in self.routes:
+      if not route.finish(index):
+        return False
+      position += 1
+      if progress:
+        progress(float(position) / total)
+    return True
+
+  def compress(self, progress=None):
+    """remove the empty columns and rows"""
+    sx, sy = self.size
+    sx -= self.compressx(sx)
+    if progress:
+      progress(1.0)
+    sy -= self.compressy(sy)
+    self.size = (sx, sy)
+
+  def compressx(self, sx):
+    """remove all empty columns, return the removed width"""
+    spans = []
+    for node in self.nodes:
+      spans.append((node.myarea[0], node.myarea[0] + node.myarea[2]))
+    for route in self.routes:
+      for line in route.lines:
+        spans.append((line[0], line[0]))
+        spans.append((line[2], line[2]))
+    shift, size = raster_shift(raster_gaps(spans, sx))
+    for node in self.nodes:
+      node.myarea[0] = shift(node.myarea[0])
+    for route in self.routes:
+      for line in route.lines:
+        line[0] = shift(line[0])
+        line[2] = shift(line[2])
+    return size
+
+  def compressy(self, sy):
+    """remove all empty rows, return the removed height"""
+    spans = []
+    for node in self.nodes:
+      spans.append((node.myarea[1], node.myarea[1] + node.myarea[3]))
+    for route in self.routes:
+      for line in route.lines:
+        spans.append((line[1], line[1]))
+        spans.append((line[3], line[3]))
+    shift, size = raster_shift(raster_gaps(spans, sy))
+    for node in self.nodes:
+      node.myarea[1] = shift(node.myarea[1])
+    for route in self.routes:
+      for line in route.lines:
+        line[1] = shift(line[1])
+        line[3] = shift(line[3])
+    return size
+
+def raster_gaps(spans, size, first=15, step=5):
+  """
+  Return the sorted [(start, width)] runs of the raster points first,
+  first + step, ... below size which are not covered by any (start, end)
+  span and which are followed by a covered point. Only the node areas
+  and the route end points cover the raster, the lines between them
+  are shortened.
+  """
+  count = len(range(first, size, step))
+  covered = []
+  for a, b in spans:
+    lo = max(0, -((first - a) // step))
+    hi = min(count - 1, (b - first) // step)
+    if lo <= hi:
+      covered.append((lo, hi))
+  covered.sort()
+  res = []
+  pos = 0				# the first raster point not covered yet
+  for lo, hi in covered:
+    if lo > pos:
+      res.append((first + pos * step, (lo - pos) * step))
+    pos = max(pos, hi + 1)
+  return res
+
+def raster_shift(gaps):
+  """
+  Return (function mapping a coordinate with the gaps removed, removed
+  size), coordinates behind the gap start are moved by the gap width.
+  """
+  starts = []
+  sums = [0]
+  for start, width in gaps:
+    starts.append(start)
+    sums.append(sums[-1] + width)
+  return lambda v: v - sums[bisect_left(starts, v)], sums[-1]
+
+def count_crossings(pairs):
+  """return the number of crossing (upper, lower) position pairs"""
+  pairs = sorted(pairs)
+  tree = [0] * (max([b for a, b in pairs] or [0]) + 2)
+  res = 0
+  for idx in range(len(pairs)):
+    pos = pairs[idx][1] + 1
+    below = 0				# already added pairs ending at <= pos
+    i = pos
+    while i > 0:
+      below += tree[i]
+      i -= i & -i
+    res += idx - below
+    while pos < len(tree):
+      tree[pos] += 1
+      pos += pos & -pos
+  return res
+
+class LayeredLayout:
+
+  """
+  Layered (Sugiyama style) codec graph layout. Converters are in the
+  first column, pins in the last one and the other widgets are ranked
+  by their distance from converters, so the signal flows from column to
+  column. The widgets without any connection follow in extra columns. Edges over more columns go through dummy points, the order in
+  columns is improved by barycenter sweeps and each edge gets its own
+  vertical track in the channel between columns, so the orthogonal routes
+  are placed in one pass without the collision search of GraphLayout.
+  """
+
+  sweeps = 12
+  channel = 40				# minimal channel width
+  gap = 20				# vertical space between nodes
+
+  def __init__(self, codec, graph=None, node_class=GraphNode,
+               route_class=GraphRoute):
+    self.codec = codec
+    self.node_class = node_class
+    self.route_class = route_class
+    self.nodes = []
+    self.routes = []
+    self.size = (0, 0)
+    self.complete = True
+    self.crossings = 0
+
+  def widgets(self):
+    """return (nids, unique (src, dst) edges)"""
+    codec = self.codec
+    edges = []
+    used = set()
+    for nid in codec.nodes:
+      node = codec.nodes[nid]
+      for conn in node.connections or []:
+        if conn in codec.nodes and conn != nid and not (conn, nid) in used:
+          edges.append((conn, nid))
+          used.add((conn, nid))
+    return list(codec.nodes), edges
+
+  def rank(self, nids, edges):
+    """return nid -> column"""
+    codec = self.codec
+    adj = {}
+    for nid in nids:
+      adj[nid] = []
+    for a, b in edges:
+      adj[a].append(b)
+      adj[b].append(a)
+    dist = {}
+    queue = []
+    for nid in nids:
+      if codec.nodes[nid].wtype_id in ['AUD_IN', 'AUD_OUT']:
+        dist[nid] = 0
+        queue.append(nid)
+    for nid in queue:
+      for nid1 in sorted(adj[nid]):
+        if not nid1 in dist:
+          dist[nid1] = dist[nid] + 1
+          queue.append(nid1)
+    # (distance, nid) is a topological order of the edges oriented by it
+    key = {}
+    for nid in nids:
+      key[nid] = (dist.get(nid, len(nids)), nid)
+    order = sorted(nids, key=lambda nid: key[nid])
+    rank = {}
+    for nid in order:
+      rank[nid] = 0
+      for nid1 in adj[nid]:
+        if key[nid1] < key[nid]:
+          rank[nid] = max(rank[nid], rank[nid1] + 1)
+    last = max(list(rank.values()) + [0])
+    pins = False
+    for nid in nids:
+      if codec.nodes[nid].wtype_id == 'PIN':
+        pins = True
+    if pins:
+      last += 1
+      for nid in nids:
+        if codec.nodes[nid].wtype_id == 'PIN':
+          rank[nid] = last
+    # the unconnected widgets (like vendor widgets) follow in the last
+    # columns, not higher than the other columns
+    lone = []
+    count = {}
+    for nid in nids:
+      if not adj[nid] and \
+         not codec.nodes[nid].wtype_id in ['AUD_IN', 'AUD_OUT', 'PIN']:
+        lone.append(nid)
+      else:
+        count[rank[nid]] = count.get(rank[nid], 0) + 1
+    per = max(list(count.values()) + [1])
+    for idx in range(len(lone)):
+      rank[lone[idx]] = last + 1 + idx // per
+    return rank
+
+  def chains(self, edges, rank):
+    """
+    Split edges to column steps, return (layers, chains). A chain is the
+    list of items (nids and dummy tuples) of one edge in column order.
+    """
+    layers = [[] for r in range(max(list(rank.values()) + [0]) + 1)]
+    for nid in sorted(rank, key=lambda nid: (rank[nid], nid)):
+      layers[rank[nid]].append(nid)
+    chains = []
+    for a, b in edges:
+      if rank[a] > rank[b]:
+        a, b = b, a
+      chain = [a]
+      for r in range(rank[a] + 1, rank[b]):
+        dummy = ('dummy', a, b, r, len(chains))
+        layers[r].append(dummy)
+        chain.append(dummy)
+      chain.append(b)
+      chains.append(chain)
+    return layers, chains
+
+  def neighbors(self, layers, chains):
+    """return (up, down) item -> items in the previous or next column"""
+    column = {}
+    up = {}
+    down = {}
+    for r in range(len(layers)):
+      for item in layers[r]:
+        column[item] = r
+        up[item] = []
+        down[item] = []
+    for chain in chains:
+      for idx in range(len(chain) - 1):
+        a, b = chain[idx], chain[idx + 1]
+        if column[a] != column[b]:	# edges inside a column are skipped
+          down[a].append(b)
+          up[b].append(a)
+    return up, down
+
+  def order(self, layers, chains):
+    """reorder the items in layers to reduce edge crossings"""
+    up, down = self.neighbors(layers, chains)
+
+    def crossings():
+      pos = {}
+      for layer in layers:
+        for idx in range(len(layer)):
+          pos[layer[idx]] = idx
+      res = 0
+      for r in range(len(layers) - 1):
+        pairs = []
+        for item in layers[r]:
+          for item1 in down[item]:
+            if item1 in layers[r + 1]:
+              pairs.append((pos[item], pos[item1]))
+        res += count_crossings(pairs)
+      return res
+
+    def sweep(r, neighbors, ref):
+      pos = {}
+      for idx in range(len(ref)):
+        pos[ref[idx]] = idx
+      layer = layers[r]
+      bary = {}
+      for idx in range(len(layer)):
+        item = layer[idx]
+        vals = [pos[item1] for item1 in neighbors[item] if item1 in pos]
+        if vals:
+          bary[item] = float(sum(vals)) / len(vals)
+        else:
+          bary[item] = float(idx) * max(len(ref), 1) / max(len(layer), 1)
+      layer.sort(key=lambda item: bary[item])
+
+    best = crossings()
+    saved = [layer[:] for layer in layers]
+    for i in range(self.sweeps):
+      if not best:
+        break
+      for r in range(1, len(layers)):
+        sweep(r, up, layers[r - 1])
+      for r in range(len(layers) - 2, -1, -1):
+        sweep(r, down, layers[r + 1])
+      res = crossings()
+      if res < best:
+        best = res
+        saved = [layer[:] for layer in layers]
+      elif res >= best and i > 2:
+        break
+    layers[:] = saved
+    self.crossings = best
+
+  def tracks(self, segs):
+    """
+    Return the channel segments (y1, y2, ax, ay, bx, by, ...) in the track
+    order from left to right. A segment crosses the segments on its right
+    side where its end (by) lies in their span and the segments on its left
+    side where their start (ay) lies in its span. The downward segments are
+    ordered by the start from bottom to top and the upward ones from top to
+    bottom, which is crossing free within each group, the cheaper of the
+    two group orders is used.
+    """
+    down = sorted([seg for seg in segs if seg[3] <= seg[5]], key=lambda seg: (-seg[3], seg[5]))
+    upward = sorted([seg for seg in segs if seg[3] > seg[5]], key=lambda seg: (seg[3], -seg[5]))
+
+    def cost(a, b):
+      res = 0
+      for s in a:
+        for t in b:
+          if t[0] < s[5] < t[1]:	# s end crosses t track
+            res += 1
+          if s[0] < t[3] < s[1]:	# t start crosses s track
+            res += 1
+      return res
+    if cost(upward, down) < cost(down, upward):
+      return upward + down
+    return down + upward
+
+  def build(self, extra=None, progress=None):
+    """place nodes and routes, extra (the grid node spacing) is not used"""
+    codec = self.codec
+    nids, edges = self.widgets()
+    self.nodes = []
+    self.routes = []
+    if not nids:
+      return True
+    rank = self.rank(nids, edges)
+    layers, chains = self.chains(edges, rank)
+    self.order(layers, chains)
+    if progress:
+      progress(0.5)
+
+    maxconns = 0
+    for nid in nids:
+      conns = max(codec.connections(nid, 0), codec.connections(nid, 1))
+      maxconns = max(maxconns, conns)
+    nodesize = max((maxconns * 5 + 10) * 2, 100)
+
+    # ports: the edge end points on node sides, right side for the edges
+    # to the next columns and for the edges inside the column
+    ports = {}
+    for c in range(len(chains)):
+      chain = chains[c]
+      for idx in range(len(chain) - 1):
+        a, b = chain[idx], chain[idx + 1]
+        flat = rank.get(a, 0) == rank.get(b, 0) and \
+               not isinstance(a, tuple) and not isinstance(b, tuple)
+        ports.setdefault((a, 'right'), []).append((c, idx))
+        ports.setdefault((b, flat and 'right' or 'left'), []).append((c, idx))
+
+    # vertical placement, 10 pixel raster: right ports are at y = 0 mod 10,
+    # left ports at y = 5 mod 10 and dummies are 10 pixels high, so the
+    # horizontal lines from both channel sides never overlap
+    height = {}
+    for layer in layers:
+      for item in layer:
+        if isinstance(item, tuple):
+          height[item] = 10
+        else:
+          n = max(len(ports.get((item, 'left'), [])),
+                  len(ports.get((item, 'right'), [])))
+          height[item] = max(nodesize, (n + 2) * 10)
+    up, down = self.neighbors(layers, chains)
+    top = {}
+    center = {}
+    for iteration in range(3):
+      for layer in layers:
+        y = self.gap
+        for item in layer:
+          want = y
+          if iteration:
+            vals = [center[item1] for item1 in up[item] + down[item]]
+            if vals:
+              want = int(sum(vals) / len(vals) - height[item] / 2)
+          y = max(y, want // 10 * 10)
+          top[item] = y
+          center[item] = y + height[item] / 2
+          y += height[item] + (isinstance(item, tuple) and 10 or self.gap)
+
+    # channels: one vertical track per edge step leaving the column
+    steps = [[] for r in range(len(layers))]
+    for c in range(len(chains)):
+      for idx in range(len(chains[c]) - 1):
+        a = chains[c][idx]
+        r = isinstance(a, tuple) and a[3] or rank[a]
+        steps[r].append((c, idx))
+    left = []
+    x = self.gap
+    for r in range(len(layers)):
+      left.append(x)
+      x += nodesize + max(self.channel, (len(steps[r]) + 2) * 5)
+
+    def port(item, side, step):
+      if isinstance(item, tuple):
+        r = item[3]
+        y = top[item] + (side == 'right' and 10 or 5)
+        return (side == 'right' and left[r] + nodesize or left[r]), y
+      r = rank[item]
+      k = ports[(item, side)].index(step)
+      y = top[item] + (side == 'right' and 10 or 15) + k * 10
+      return (side == 'right' and left[r] + nodesize or left[r]), y
+
+    # sort the ports on each side by the other end to avoid crossings
+    for key in ports:
+      item, side = key
+
+      def other(step):
+        chain, idx = chains[step[0]], step[1]
+        item1 = chain[idx] == item and chain[idx + 1] or chain[idx]
+        return (top.get(item1, 0), repr(item1))
+      ports[key].sort(key=other)
+
+    lines = [[] for chain in chains]
+    for r in range(len(layers)):
+      segs = []
+      for c, idx in steps[r]:
+        a, b = chains[c][idx], chains[c][idx + 1]
+        flat = not isinstance(b, tuple) and rank[b] == r
+        x1, y1 = port(a, 'right', (c, idx))
+        x2, y2 = port(b, flat and 'right' or 'left', (c, idx))
+        segs.append((min(y1, y2), max(y1, y2), x1, y1, x2, y2, c, idx))
+      segs = self.tracks(segs)
+      track = left[r] + nodesize + 10
+      for y1, y2, ax, ay, bx, by, c, idx in segs:
+        res = lines[c]
+        res.append([ax, ay, track, ay])
+        res.append([track, ay, track, by])
+        res.append([track, by, bx, by])
+        if isinstance(chains[c][idx + 1], tuple):	# pass through the dummy
+          xm = bx + nodesize // 2
+          res.append([bx, by, xm, by])
+          res.append([xm, by, xm, by + 5])
+          res.append([xm, by + 5, bx + nodesize, by + 5])
+        track += 5
+
+    widgets = {}
+    for r in range(len(layers)):
+      for item in layers[r]:
+        if isinstance(item, tuple):
+          continue
+        w = self.node_class(codec, codec.nodes[item], 0, 0, nodesize, 0)
+        w.myarea = [left[r], top[item], nodesize, height[item]]
+        w.extra = self.channel
+        widgets[item] = w
+        self.nodes.append(w)
+    for c in range(len(chains)):
+      src, dst = edges[c]			# chains[c] is edges[c] by column
+      route = self.route_class(codec, widgets[src], widgets[dst], None)
+      route.lines = lines[c]
+      self.routes.append(route)
+    sy = 0
+    for item in top:
+      sy = max(sy, top[item] + height[item])
+    self.size = (x + self.gap, sy + self.gap)
+    if progress:
+      progress(1.0)
+    return True
+
+GRAPH_LAYOUTS = {
+  'grid': GraphLayout,
+  'layered': LayeredLayout
+}
+
+def layout_key(codec, layout='layered'):
+  """
+  Return SHA-1 hex digest of the codec topology used by the layout: the
+  widget types and connections, the grid layout places pins also by the
+  direction set in the pin control.
+  """
+  res = [LAYOUT_STATE_VERSION, layout]
+  for nid in codec.nodes:
+    node = codec.nodes[nid]
+    item = (nid, node.wtype_id, tuple(node.connections or []))
+    if layout == 'grid' and node.wtype_id == 'PIN':
+      item += ('IN' in node.pinctl, )
+    res.append(item)
+  return sha1(repr(res).encode()).hexdigest()
+
+def layout_state(layout):
+  """return the node positions and route lines as marshallable data"""
+  nodes = []
+  for node in layout.nodes:
+    nodes.append((node.node.nid, node.myarea[:], node.extra))
+  routes = []
+  for route in layout.routes:
+    routes.append((route.src.node.nid, route.dst.node.nid,
+                   [line[:] for line in route.lines],
+                   [line[:] for line in route.wronglines]))
+  return (tuple(layout.size), nodes, routes, layout.complete)
+
+class CachedLayout:
+
+  """
+  Graph layout restored from layout_state() of a codec with the same
+  layout_key(), the nodes and routes are created without any placement.
+  """
+
+  def __init__(self, codec, state, node_class=GraphNode,
+               route_class=GraphRoute):
+    size, nodes, routes, complete = state
+    self.codec = codec
+    self.size = tuple(size)
+    self.complete = complete
+    self.nodes = []
+    self.routes = []
+    bynid = {}
+    for nid, area, extra in nodes:
+      w = node_class(codec, codec.nodes[nid], 0, 0, 0, extra)
+      w.myarea = list(area)
+      bynid[nid] = w
+      self.nodes.append(w)
+    for src, dst, lines, wronglines in routes:
+      route = route_class(codec, bynid[src], bynid[dst], None)
+      route.lines = [list(line) for line in lines]
+      route.wronglines = [list(line) for line in wronglines]
+      self.routes.append(route)
+
+def layout_codec(codec, layout='layered', index_class=RouteGrid,
+                 node_class=GraphNode, route_class=GraphRoute,
+                 cache=None, progress=None):
+  """
+  Return the graph layout for the codec or None when there is nothing to
+  draw. The grid layout increases the node spacing until all routes are
+  placed. With the cache (see hda_cache.LayoutCache), the layout of the
+  codec topology is restored when it was already done.
+  """
+  if cache:
+    key = layout_key(codec, layout)
+    state = cache.get(key)
+    if not state is None:
+      return CachedLayout(codec, state, node_class, route_class)
+  res = None
+  if layout == 'layered':
+    res = LayeredLayout(codec, None, node_class, route_class)
+    res.build(progress=progress)
+  else:
+    graph = codec.graph(dump=False)
+    if graph:
+      for extra in GRAPH_EXTRA:
+        res = GraphLayout(codec, graph, node_class, route_class, index_class)
+        if res.build(extra, progress):
+          break
+  if not res or not res.nodes:
+    return None
+  if cache:
+    cache.put(key, layout_state(res))
+  return res
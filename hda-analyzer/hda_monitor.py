@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+import os
+import json
+from heapq import heappush, heappop
+from time import time, sleep
+from select import select, PIPE_BUF
+
+from hda_codec import VERBS
+from hda_diff import CodecSnapshot, diff_snapshots, codec_diff
+
+# default polling intervals in seconds
+POLL_FAST = 0.02
+POLL_SLOW = 1.0
+
+# state verbs polled at the fast rate, the rest is polled at the slow rate
+# (static parameters are never polled)
+FAST_VERBS = [
+  VERBS['GET_PIN_SENSE'],
+  VERBS['GET_GPIO_DATA'],
+  VERBS['GET_POWER_STATE']
+]
+
+class PollGroup:
+
+  def __init__(self, interval):
+    self.interval = interval
+    self.verbs = []
+    self.ranges = []
+    self.values = []
+
+  def add_range(self, nid, verbs):
+    if not verbs:
+      return
+    start = len(self.verbs)
+    self.verbs += verbs
+    self.ranges.append((nid, start, len(self.verbs)))
+
+class MonitorSnapshot(CodecSnapshot):
+
+  def node_text(self, node):
+    text = self.codec.dump_node(node)
+    if getattr(node, 'pin_sense', None) != None:
+      text += "  Pin Sense: 0x%08x: presence=%d\n" % \
+                (node.pin_sense, node.pin_presence and 1 or 0)
+    return text
+
+class CodecMonitor:
+
+  """
+  Watch the volatile codec state. The raw responses of all state verbs
+  are kept in one array per polling group, only nodes with changed
+  responses are reread and dumped again.
+  """
+
+  def __init__(self, codec, fast=POLL_FAST, slow=POLL_SLOW):
+    self.codec = codec
+    self.intervals = {'fast': fast, 'slow': slow}
+    self.build()
+
+  def build(self):
+    codec = self.codec
+    self.groups = {}
+    for name in self.intervals:
+      self.groups[name] = PollGroup(self.intervals[name])
+    if not codec.gpio is None:
+      self.add_verbs(None, codec.gpio.state_verbs())
+    for nid in codec.nodes:
+      self.add_verbs(nid, codec.nodes[nid].state_verbs())
+    self.snapshot = MonitorSnapshot(codec)
+    for group in self.groups.values():
+      group.values = self.read(group.verbs)
+
+  def add_verbs(self, nid, verbs):
+    fast = []
+    slow = []
+    for verb in verbs:
+      if verb[1] in FAST_VERBS:
+        fast.append(verb)
+      else:
+        slow.append(verb)
+    self.groups['fast'].add_range(nid, fast)
+    self.groups['slow'].add_range(nid, slow)
+
+  def read(self, verbs):
+    if self.codec.hwaccess:
+      self.codec.cache_flush()
+    return self.codec.rw_batch(verbs)
+
+  def poll(self, name):
+    """return list of changed nids (None means the codec itself)"""
+    group = self.groups[name]
+    values = self.read(group.verbs)
+    old = group.values
+    res = []
+    for nid, start, end in group.ranges:
+      if values[start:end] != old[start:end]:
+        res.append(nid)
+    group.values = values
+    return res
+
+  def update(self, names=None):
+    """reread changed nodes, return (old snapshot, new snapshot, changed nids)"""
+    codec = self.codec
+    changed = []
+    for name in names or self.groups:
+      for nid in self.poll(name):
+        if not nid in changed:
+          changed.append(nid)
+    old = self.snapshot
+    if not changed:
+      return old, old, changed
+    new = old.copy()
+    rebuild = False
+    for nid in changed:
+      if nid is None:
+        codec.gpio.reread()
+      else:
+        node = codec.nodes[nid]
+        verbs = node.state_verbs()
+        node.reread()
+        rebuild |= verbs != node.state_verbs()
+      new.update(nid)
+    self.snapshot = new
+    if rebuild:
+      self.build()
+    return old, new, changed
+
+  def diff(self, names=None):
+    """return text diff for changed nodes in given polling groups"""
+    old, new, changed = self.update(names)
+    if not changed:
+      return ''
+    return codec_diff(self.codec, old, new, changed)
+
+  def events(self, names=None):
+    """return change events (one per changed field) in given polling groups"""
+    codec = self.codec
+    now = round(time(), 6)
+    res = []
+    old, new, changed = self.update(names)
+    for nid, field, a, b in diff_snapshots(old, new, changed):
+      res.append({
+        'ts': now,
+        'card': codec.card,
+        'codec': codec.device,
+        'nid': nid is None and codec.afg or nid,
+        'field': field,
+        'old': a[0],
+        'new': b[0],
+        'old_decoded': a[1],
+        'new_decoded': b[1]
+      })
+    return res
+
+class PollScheduler:
+
+  """
+  Deadline heap of (monitor, group name) items, each tick touches only
+  the due items.
+  """
+
+  def __init__(self, monitors):
+    self.heap = []
+    self.seq = 0
+    now = time()
+    for monitor in monitors:
+      for name in monitor.groups:
+        if monitor.groups[name].verbs:
+          self.add(now + monitor.intervals[name], monitor, name)
+
+  def add(self, when, monitor, name):
+    heappush(self.heap, (when, self.seq, monitor, name))
+    self.seq += 1
+
+  def wait(self):
+    """sleep until the next deadline, return due (monitor, name) items"""
+    if not self.heap:
+      return []
+    delay = self.heap[0][0] - time()
+    if delay > 0:
+      sleep(delay)
+    now = time()
+    res = []
+    while self.heap and self.heap[0][0] <= now:
+      when, seq, monitor, name = heappop(self.heap)
+      res.append((monitor, name))
+      when += monitor.intervals[name]
+      if when < now:		# overloaded, do not try to catch up
+        when = now + monitor.intervals[name]
+      self.add(when, monitor, name)
+    return res
+
+class EventWriter:
+
+  """
+  Buffered JSON lines writer for a file descriptor. The descriptor stays
+  blocking (stdout is shared with the terminal and print()), only chunks
+  which select() reports to fit are written. Events which do not fit
+  into the buffer are dropped and counted, so a slow reader never stalls
+  the polling loop.
+  """
+
+  def __init__(self, fd, limit=1024*1024):
+    self.fd = fd
+    self.limit = limit
+    self.buf = bytearray()
+    self.dropped = 0
+
+  def write(self, event):
+    if self.dropped and len(self.buf) < self.limit // 2:
+      dropped = {'ts': event['ts'], 'dropped': self.dropped}
+      self.buf += (json.dumps(dropped, separators=(',', ':')) + '\n').encode()
+      self.dropped = 0
+    line = (json.dumps(event, separators=(',', ':')) + '\n').encode()
+    if len(self.buf) + len(line) > self.limit:
+      self.dropped += 1
+      return
+    self.buf += line
+
+  def flush(self):
+    while self.buf:
+      if not select([], [self.fd], [], 0)[1]:
+        break
+      # a writable pipe takes PIPE_BUF bytes without blocking
+      count = os.write(self.fd, self.buf[:PIPE_BUF])
+      del self.buf[:count]
@@ -12,65 +12,158 @@
 #   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 #   GNU General Public License for more details.
 
+import re
+import gzip
+import bz2
+import lzma
+from copy import copy
+from io import StringIO, TextIOWrapper
+try:
+  from compression import zstd		# python 3.14+
+except ImportError:
+  try:
+    import zstandard as zstd
+  except ImportError:
+    zstd = None
 from hda_codec import *
 
-SET_VERBS = {
-  VERBS['SET_SDI_SELECT']: VERBS['GET_SDI_SELECT'],
-  VERBS['SET_PIN_WIDGET_CONTROL']: VERBS['GET_PIN_WIDGET_CONTROL'],
-  VERBS['SET_CONNECT_SEL']: VERBS['GET_CONNECT_SEL'],
-  VERBS['SET_EAPD_BTLENABLE']: VERBS['GET_EAPD_BTLENABLE'],
-  VERBS['SET_POWER_STATE']: VERBS['GET_POWER_STATE'],
+# conversions for the printf-like proc line formats (see proc_scanf())
+PROC_SCANF = {
+  '%i': r'(0x[0-9a-fA-F]+|-?[0-9]+)',	# decimal or 0x prefixed hex
+  '%x': r'(?:0x)?([0-9a-fA-F]+)',	# hex without prefix
+  '%s': r'"([^"]*)"',			# quoted string
+  '%w': r'([^ "\[\],:*]*)'		# word
 }
 
+def proc_scanf(format):
+  """compile the proc line format (a regex with % conversions)"""
+  return re.compile(r'\s*' + re.sub('%[ixsw]',
+                                     lambda m: PROC_SCANF[m.group()], format))
+
+def proc_int(str):
+  if str.startswith('0x'):
+    return int(str[2:], 16)
+  return int(str)
+
+PROC_INT = proc_scanf('%i')
+PROC_NODE = proc_scanf(r'Node %i .*?wcaps %i')
+PROC_NODE_HEADER = re.compile(r'^Node ' + PROC_SCANF['%i'], re.M)
+PROC_DEVICE = proc_scanf('name=%s, type=%s, device=%i')
+PROC_CONTROL = proc_scanf('(?:iface=%s, )?name=%s, index=%i, device=%i')
+PROC_CONTROL_AMP = proc_scanf('chs=%i, dir=%w, idx=%i, ofs=%i')
+PROC_CONVERTER = proc_scanf('stream=%i, channel=%i')
+PROC_PCM_RATES = proc_scanf(r'rates \[%i\]')
+PROC_PCM_BITS = proc_scanf(r'bits \[%i\]')
+PROC_PCM_FORMATS = proc_scanf(r'formats \[%i\]')
+PROC_AMP_CAPS = proc_scanf('ofs=%i, nsteps=%i, stepsize=%i, mute=%i')
+PROC_AMP_VALS = re.compile(r'\[([^\]]*)\]')
+PROC_CONNECTION = re.compile(r'(?:0x)?([0-9a-fA-F]+)(\*?)')
+PROC_UNSOLICITED = proc_scanf('tag=%x, enabled=%i')
+PROC_FUNCTION_ID = proc_scanf(r'%i(?: \(unsol %i\))?')
+PROC_POWER = proc_scanf('setting=%w, actual=%w')
+PROC_PROCESS_CAPS = proc_scanf('benign=%i, ncoeff=%i')
+PROC_VOLUME_KNOB = proc_scanf('delta=%i, steps=%i, direct=%i, val=%i')
+PROC_GPIO_CAP = proc_scanf('io=%i, o=%i, i=%i, unsolicited=%i, wake=%i')
+PROC_GPIO_IO = proc_scanf(r'IO\[%i\]: enable=%i, dir=%i, wake=%i, ' \
+                          r'sticky=%i, data=%i(?:, unsol=%i)?')
+GPIO_PROC_VARS = ['enable', 'dir', 'wake', 'sticky', 'data', 'unsol']
+
+# magic bytes -> compression of codec proc and alsa-info.sh dumps
+PROC_COMPRESSION = [
+  (b'\x1f\x8b', 'gzip'),
+  (b'BZh', 'bz2'),
+  (b'\xfd7zXZ\x00', 'xz'),
+  (b'\x28\xb5\x2f\xfd', 'zstd')
+]
+
+# compression -> open(file, mode, errors=...) of the decompressor
+PROC_OPEN = {
+  'gzip': gzip.open,
+  'bz2': bz2.open,
+  'xz': lzma.open
+}
+if zstd:
+  PROC_OPEN['zstd'] = zstd.open
+
+def ProcCompression(head):
+  """return the compression name for the first bytes of a dump or None"""
+  for magic, name in PROC_COMPRESSION:
+    if head.startswith(magic):
+      return name
+  return None
+
+def OpenProcFile(proc_file):
+  """
+  Open the dump (a file name or a seekable binary file) as a text file.
+  Compressed dumps are recognized by the magic bytes and decompressed on
+  the fly while reading.
+  """
+  if isinstance(proc_file, str):
+    with open(proc_file, 'rb') as fd:
+      head = fd.read(8)
+  else:
+    head = proc_file.read(8)
+    proc_file.seek(-len(head), 1)
+  name = ProcCompression(head)
+  if name is None:
+    if isinstance(proc_file, str):
+      return open(proc_file, errors='replace')
+    return TextIOWrapper(proc_file, errors='replace')
+  if not name in PROC_OPEN:
+    raise ValueError("%s compressed dump, but no %s module is available" % \
+                     (name, name))
+  return PROC_OPEN[name](proc_file, 'rt', errors='replace')
+
 def DecodeProcFile(proc_file):
-  if len(proc_file) < 256:
-    fd = open(proc_file)
-  proc_file = fd.read(1024*1024)
-  fd.close()
-  if proc_file.find('Subsystem Id:') < 0:
-      p = None
-      try:
-        from gzip import GzipFile
-        from io import StringIO
-        s = StringIO(proc_file)
-        gz = GzipFile(mode='r', fileobj=s)
-        p = gz.read(1024*1024)
-        gz.close()
-      except:
-        pass
-      if p is None:
-        try:
-          from bz2 import decompress
-          p = decompress(proc_file)
-        except:
-          pass
-      if not p is None:
-        proc_file = p
-  return proc_file
+  with OpenProcFile(proc_file) as fd:
+    return fd.read()
 
 def DecodeAlsaInfoFile(proc_file):
-  if proc_file.find("ALSA Information Script") < 0:
-    return [proc_file]
-  pos = proc_file.find('HDA-Intel Codec information')
-  if pos < 0:
-    return [proc_file]
-  proc_file = proc_file[pos:]
-  pos = proc_file.find('--startcollapse--')
-  proc_file = proc_file[pos+18:]
-  pos = proc_file.find('--endcollapse--')
-  proc_file = proc_file[:pos]
-  res = []
-  while 1:
-    pos = proc_file.find('\nCodec: ')
-    if pos < 0:
+  return list(SplitProcFile(StringIO(proc_file)))
+
+def SplitProcFile(fd):
+  """
+  Yield the codec proc texts from an open text file. A plain codec proc
+  file gives one text, an alsa-info.sh dump gives one text per codec from
+  the HDA-Intel section. The file is read line by line and only the
+  current codec section is kept in memory.
+  """
+  head = []
+  for line in fd:
+    if line.find('ALSA Information Script') >= 0:
+      break
+    head.append(line)
+    if line.startswith('Codec: '):
+      yield ''.join(head) + fd.read()
+      return
+  else:
+    if head:
+      yield ''.join(head)
+    return
+  for line in fd:
+    if line.find('HDA-Intel Codec information') >= 0:
       break
-    proc_file = proc_file[pos:]
-    pos = proc_file[1:].find('\nCodec: ')
-    if pos < 0:
-      pos = len(proc_file)-2
-    res.append(proc_file[:pos+2])
-    proc_file = proc_file[pos:]
-  return res
+  for line in fd:
+    if line.find('--startcollapse--') >= 0:
+      break
+  section = None
+  for line in fd:
+    if line.startswith('--endcollapse--'):
+      break
+    if line.startswith('Codec: '):
+      if section:
+        yield ''.join(section)
+      section = []
+    if not section is None:
+      section.append(line)
+  if section:
+    yield ''.join(section)
+
+def IterProcFile(proc_file):
+  """yield the codec proc texts from the file, see SplitProcFile()"""
+  with OpenProcFile(proc_file) as fd:
+    for text in SplitProcFile(fd):
+      yield text
 
 class HDACardProc:
 
@@ -84,60 +177,22 @@ class HDACardProc:
 
 class HDABaseProc:
 
-  delim = ' "[],:*'
-
-  def decodestrw(self, str, prefix):
-    if str.startswith(prefix):
-      res = str[len(prefix):].strip()
-      delim = self.delim
-      if res[0] == '"':
-        res = res[1:]
-        delim = '"'
-      rem = res
-      for a in delim:
-        pos = res.find(a)
-        if pos >= 0:
-          if rem == res:
-            rem = rem[pos:]
-          res = res[:pos]
-      if rem == res:
-        rem = ''
-      ok = True
-      while ok:
-        ok = False
-        for a in self.delim:
-          if rem and rem[0] == a:
-            rem = rem[1:]
-            ok = True
-      return rem.strip(), res.strip()
-    self.wrongfile('string decode %s' % repr(str))
-
-  def decodeintw(self, str, prefix='', forcehex=False):
-    if str.startswith(prefix):
-      res = str[len(prefix):].strip()
-      rem = res
-      for a in self.delim:
-        pos = res.find(a)
-        if pos >= 0:
-          if rem == res:
-            rem = rem[pos:]
-          res = res[:pos]
-      if rem == res:
-        rem = ''
-      ok = True
-      while ok:
-        ok = False
-        for a in self.delim:
-          if rem and rem[0] == a:
-            rem = rem[1:]
-            ok = True
-      if res and forcehex:
-        if not res.startswith('0x'):
-          res = '0x' + res
-      if res.startswith('0x'):
-        return rem.strip(), int(res[2:], 16)
-      return rem.strip(), int(res)
-    self.wrongfile('integer decode %s (%s)' % (repr(str), repr(prefix)))
+  def scanf(self, regex, str):
+    """return fields matched by the compiled proc line format"""
+    m = regex.match(str)
+    if m is None:
+      self.wrongfile('%s expected in %s' % (repr(regex.pattern), repr(str)))
+    return m.groups()
+
+  def decodeint(self, str):
+    return proc_int(self.scanf(PROC_INT, str)[0])
+
+  def decodeampcaps(self, str):
+    if str.strip() == 'N/A':
+      return 0
+    ofs, nsteps, stepsize, mute = map(proc_int, self.scanf(PROC_AMP_CAPS, str))
+    return (ofs & 0x7f) | ((nsteps & 0x7f) << 8) | \
+           ((stepsize & 0x7f) << 16) | ((mute & 1) << 31)
 
   def wrongfile(self, msg=''):
     raise ValueError("wrong proc file format (%s)" % msg)
@@ -167,6 +222,12 @@ class HDApcmControl:
       str += '    ControlAmp: chs=%s, dir=%s, idx=%s, ofs=%s\n' % (self.amp_chs, self.amp_dir, self.amp_idx, self.amp_ofs)
     return str
 
+  def get_state(self):
+    if self.amp_chs is None:
+      return (self.iface, self.name, self.index, self.device)
+    return (self.iface, self.name, self.index, self.device,
+            self.amp_chs, self.amp_dir, self.amp_idx, self.amp_ofs)
+
   def amp_index_match(self, idx):
     if not self.amp_chs is None:
       count = (self.amp_chs & 1) + ((self.amp_chs >> 1) & 1)
@@ -186,6 +247,7 @@ class ProcNode(HDABaseProc):
     self.device = None
     self.amp_vals = [[], []]
     self.connections = []
+    self.conn_count = 0
     self.params = {}
     self.verbs = {}
     self.controls = []
@@ -258,21 +320,18 @@ class ProcNode(HDABaseProc):
     self.params[param] = value
 
   def add_device(self, line):
-    line, name = self.decodestrw(line, 'name=')
-    line, type = self.decodestrw(line, 'type=')
-    line, device = self.decodeintw(line, 'device=')
+    name, type, device = self.scanf(PROC_DEVICE, line)
     if self.device:
       self.wrongfile('more than one PCM device?')
-    self.device = HDApcmDevice(name, type, device)
+    self.device = HDApcmDevice(name.strip(), type.strip(), proc_int(device))
 
   def get_device(self):
     return self.device
 
   def add_converter(self, line):
-    line, stream = self.decodeintw(line, 'stream=')
-    line, channel = self.decodeintw(line, 'channel=')
+    stream, channel = self.scanf(PROC_CONVERTER, line)
     self.add_verb(VERBS['GET_CONV'],
-                    ((stream & 0x0f) << 4) | (channel & 0x0f))
+                    ((proc_int(stream) & 0x0f) << 4) | (proc_int(channel) & 0x0f))
 
   def add_digital(self, line):
     bits = {
@@ -287,12 +346,11 @@ class ProcNode(HDABaseProc):
       'GenLevel': DIG1_BITS['LEVEL'],
       'KAE' : -1 # ignore, so far
     }
+    a = line.split()
+    if not a:
+      return
     xbits = 0
-    a = line.split(' ')
     for b in a:
-      b = b.strip()
-      if not b:
-        return
       if not b in bits:
         self.wrongfile('unknown dig1 bit %s' % repr(b))
       if bits[b] >= 0:
@@ -300,100 +358,78 @@ class ProcNode(HDABaseProc):
     self.add_verb(VERBS['GET_DIGI_CONVERT_1'], xbits)
 
   def add_digitalcategory(self, line):
-    line, res = self.decodeintw(line)
+    res = self.decodeint(line)
     self.add_verb(VERBS['GET_DIGI_CONVERT_1'], (res & 0x7f) << 8, do_or=True)
 
   def add_sdiselect(self, line):
-    line, res = self.decodeintw(line)
-    self.add_verb(VERBS['GET_SDI_SELECT'], res)
+    self.add_verb(VERBS['GET_SDI_SELECT'], self.decodeint(line))
+
+  def add_pcmrates(self, line):
+    rates = self.decodeint(line)
+    old = self.params.get(PARAMS['PCM'], 0)
+    self.add_param(PARAMS['PCM'], (old & ~0xffff) | (rates & 0xffff))
 
-  def add_pcm(self, line1, line2, line3):
-    line1, tmp1 = self.decodeintw(line1, '    rates [')
-    line2, tmp2 = self.decodeintw(line2, '    bits [')
-    self.add_param(PARAMS['PCM'],
-              (tmp1 & 0xffff) | ((tmp2 & 0xffff) << 16))
-    line3, tmp1 = self.decodeintw(line3, '    formats [')
-    self.add_param(PARAMS['STREAM'], tmp1)
+  def add_pcmbits(self, line):
+    bits = self.decodeint(line)
+    old = self.params.get(PARAMS['PCM'], 0)
+    self.add_param(PARAMS['PCM'], (old & 0xffff) | ((bits & 0xffff) << 16))
+
+  def add_pcmformats(self, line):
+    formats = self.decodeint(line)
+    self.add_param(PARAMS['STREAM'], formats)
 
   def add_control(self, line):
-    iface = None
-    if line.find('iface=') > 0:
-      line, iface = self.decodestrw(line, 'iface=')
-    line, name = self.decodestrw(line, 'name=')
-    line, index = self.decodeintw(line, 'index=')
-    line, device = self.decodeintw(line, 'device=')
-    self.controls.append(HDApcmControl(iface, name, index, device))
+    iface, name, index, device = self.scanf(PROC_CONTROL, line)
+    self.controls.append(HDApcmControl(iface, name.strip(),
+                                       proc_int(index), proc_int(device)))
 
   def add_controlamp(self, line):
     ctl = self.controls[-1]
-    line, ctl.amp_chs = self.decodeintw(line, 'chs=')
-    line, ctl.amp_dir = self.decodestrw(line, 'dir=')
-    line, ctl.amp_idx = self.decodeintw(line, 'idx=')
-    line, ctl.amp_ofs = self.decodeintw(line, 'ofs=')
-    ctl.amp_dir = ctl.amp_dir == 'In' and HDA_INPUT or HDA_OUTPUT
+    chs, dir, idx, ofs = self.scanf(PROC_CONTROL_AMP, line)
+    ctl.amp_chs = proc_int(chs)
+    ctl.amp_dir = dir == 'In' and HDA_INPUT or HDA_OUTPUT
+    ctl.amp_idx = proc_int(idx)
+    ctl.amp_ofs = proc_int(ofs)
 
   def get_controls(self):
     return self.controls
 
   def add_ampcaps(self, line, dir):
-    line = line.strip()
     par = PARAMS[dir == HDA_INPUT and 'AMP_IN_CAP' or 'AMP_OUT_CAP']
-    if line == 'N/A':
-      self.add_param(par, 0)
-      return
-    line, ofs = self.decodeintw(line, 'ofs=')
-    line, nsteps = self.decodeintw(line, 'nsteps=')
-    line, stepsize = self.decodeintw(line, 'stepsize=')
-    line, mute = self.decodeintw(line, 'mute=')
-    self.add_param(par,
-               (ofs & 0x7f) | ((nsteps & 0x7f) << 8) | \
-               ((stepsize & 0x7f) << 16) | ((mute & 1) << 31))
+    self.add_param(par, self.decodeampcaps(line))
 
   def add_ampvals(self, line, dir):
-    line = line.strip()
     self.amp_vals[dir] = []
-    while len(line):
-      if not line[0] == '[':
-        self.wrongfile('amp vals [')
-      pos = line.find(']')
-      if pos <= 0:
-        self.wrongfile('amp vals ]')
-      str = line[1:pos]
-      line = line[len(str)+2:].strip()
+    for str in PROC_AMP_VALS.findall(line):
       val = []
-      while str.startswith('0x'):
-        str, val1 = self.decodeintw(str)
-        val.append(val1)
+      for a in str.split():
+        val.append(int(a, 16))
       self.amp_vals[dir].append(val)
 
-  def add_connection(self, line, conn):
-    line, count = self.decodeintw(line)
+  def add_connection(self, line):
+    count = self.decodeint(line)
     if count == -22:	# driver was not able to read connections
       count = 0
-    res = 0
-    if conn.startswith('    '):
-      conn = conn.strip()
-      res = 1
-    else:
-      conn = ''
+    self.conn_count = count
+    self.connections = []
+    self.add_verb(VERBS['GET_CONNECT_SEL'], -1)
+
+  def add_connlist(self, line):
     conns = []
     sel = -1
-    while len(conn):
-      if len(conn) > 4 and conn[4] == '*':
+    for nid, active in PROC_CONNECTION.findall(line):
+      if active:
         sel = len(conns)
-      conn, val = self.decodeintw(conn)
-      conns.append(val)
-    if count != len(conns):
-      self.wrongfile('connections %s != %s' % (count, len(conns)))
+      conns.append(int(nid, 16))
+    if self.conn_count != len(conns):
+      self.wrongfile('connections %s != %s' % (self.conn_count, len(conns)))
     self.connections = conns
     self.add_verb(VERBS['GET_CONNECT_SEL'], sel)
-    return res
-    
+
   def add_unsolicited(self, line):
-    line, tag = self.decodeintw(line, 'tag=', forcehex=True)
-    line, enabled = self.decodeintw(line, 'enabled=')
+    tag, enabled = self.scanf(PROC_UNSOLICITED, line)
     self.add_verb(VERBS['GET_UNSOLICITED_RESPONSE'],
-                    (tag & 0x3f) | ((enabled & 1) << 7))
+                    (int(tag, 16) & 0x3f) | ((proc_int(enabled) & 1) << 7))
 
   def add_pincap(self, line):
     line = line.strip()
@@ -401,24 +437,22 @@ class ProcNode(HDABaseProc):
     a = line.split(':')
     if line.startswith('0x08') and len(a[0]) != 10:
       line = "0x" + line[4:]
-    line, tmp1 = self.decodeintw(line, '')
+    tmp1 = self.decodeint(line)
     self.add_param(PARAMS['PIN_CAP'], tmp1)
+    if tmp1 & (1 << 2):		# presence detect, no state in proc file
+      self.add_verb(VERBS['GET_PIN_SENSE'], 0)
 
   def add_pindefault(self, line):
-    line, tmp1 = self.decodeintw(line, '')
-    self.add_verb(VERBS['GET_CONFIG_DEFAULT'], tmp1)
+    self.add_verb(VERBS['GET_CONFIG_DEFAULT'], self.decodeint(line))
 
   def add_pinctls(self, line):
-    line, tmp1 = self.decodeintw(line, '')
-    self.add_verb(VERBS['GET_PIN_WIDGET_CONTROL'], tmp1)
+    self.add_verb(VERBS['GET_PIN_WIDGET_CONTROL'], self.decodeint(line))
 
   def add_eapd(self, line):
-    line, tmp1 = self.decodeintw(line, '')
-    self.add_verb(VERBS['GET_EAPD_BTLENABLE'], tmp1)
+    self.add_verb(VERBS['GET_EAPD_BTLENABLE'], self.decodeint(line))
 
   def add_power(self, line):
-    line, setting = self.decodestrw(line, 'setting=')
-    line, actual = self.decodestrw(line, 'actual=')
+    setting, actual = self.scanf(PROC_POWER, line)
     if setting in POWER_STATES:
       setting = POWER_STATES.index(setting)
     else:
@@ -438,26 +472,49 @@ class ProcNode(HDABaseProc):
     self.add_param(PARAMS['POWER_STATE'], tmp1)
 
   def add_processcaps(self, line):
-    line, benign = self.decodeintw(line, 'benign=')
-    line, ncoeff = self.decodeintw(line, 'ncoeff=')
+    benign, ncoeff = self.scanf(PROC_PROCESS_CAPS, line)
     self.add_param(PARAMS['PROC_CAP'],
-                    (benign & 1) | ((ncoeff & 0xff) << 8))
+                    (proc_int(benign) & 1) | ((proc_int(ncoeff) & 0xff) << 8))
   
   def add_processcoef(self, line):
-    line, coef = self.decodeintw(line, '')
-    self.add_verb(VERBS['GET_PROC_COEF'], coef)
+    self.add_verb(VERBS['GET_PROC_COEF'], self.decodeint(line))
 
   def add_processindex(self, line):
-    line, idx = self.decodeintw(line, '')
-    self.add_verb(VERBS['GET_COEF_INDEX'], idx)
+    self.add_verb(VERBS['GET_COEF_INDEX'], self.decodeint(line))
 
   def add_volknob(self, line):
-    line, delta = self.decodeintw(line, 'delta=')
-    line, steps = self.decodeintw(line, 'steps=')
-    line, direct = self.decodeintw(line, 'direct=')
-    line, val = self.decodeintw(line, 'val=')
-    self.add_param(PARAMS['VOL_KNB_CAP'], ((delta & 1) << 7) | (steps & 0x7f))
-    self.add_verb(VERBS['GET_VOLUME_KNOB_CONTROL'], ((direct & 1) << 7) | (val & 0x7f))
+    delta, steps, direct, val = self.scanf(PROC_VOLUME_KNOB, line)
+    self.add_param(PARAMS['VOL_KNB_CAP'],
+                   ((proc_int(delta) & 1) << 7) | (proc_int(steps) & 0x7f))
+    self.add_verb(VERBS['GET_VOLUME_KNOB_CONTROL'],
+                  ((proc_int(direct) & 1) << 7) | (proc_int(val) & 0x7f))
+
+  def get_state(self):
+    """return the parsed node state as a tuple of basic types"""
+    device = None
+    if self.device:
+      device = (self.device.name, self.device.type, self.device.device)
+    amp_vals = [[list(v) for v in vals] for vals in self.amp_vals]
+    return (self.nid, self.wcaps, dict(self.params), dict(self.verbs),
+            list(self.connections), amp_vals, device,
+            [c.get_state() for c in self.controls])
+
+  def set_state(self, state):
+    nid, wcaps, self.params, self.verbs, self.connections, \
+      self.amp_vals, device, controls = state
+    self.conn_count = len(self.connections)
+    if device:
+      self.device = HDApcmDevice(*device)
+    for ctl in controls:
+      c = HDApcmControl(*ctl[:4])
+      if len(ctl) > 4:
+        c.amp_chs, c.amp_dir, c.amp_idx, c.amp_ofs = ctl[4:]
+      self.controls.append(c)
+
+  def finish(self):
+    """check the node state after the last node line"""
+    if self.conn_count != len(self.connections):
+      self.wrongfile('connections %s != %s' % (self.conn_count, len(self.connections)))
 
   def dump_extra(self):
     str = ''
@@ -467,21 +524,117 @@ class ProcNode(HDABaseProc):
       str += c.dump_extra()
     return str
 
+# node line prefix -> (ProcNode method, argument), the lines without
+# method are ignored together with the given count of following lines
+PROC_NODE_LINES = {
+  '  Device: ': (ProcNode.add_device, None),
+  '  Control: ': (ProcNode.add_control, None),
+  '    ControlAmp: ': (ProcNode.add_controlamp, None),
+  '  Converter: ': (ProcNode.add_converter, None),
+  '  SDI-Select: ': (ProcNode.add_sdiselect, None),
+  '  Digital:': (ProcNode.add_digital, None),
+  '  Digital category:': (ProcNode.add_digitalcategory, None),
+  '  IEC Coding Type: ': (None, 0),
+  '  Unsolicited:': (ProcNode.add_unsolicited, None),
+  '  Amp-In caps: ': (ProcNode.add_ampcaps, HDA_INPUT),
+  '  Amp-Out caps: ': (ProcNode.add_ampcaps, HDA_OUTPUT),
+  '  Amp-In vals: ': (ProcNode.add_ampvals, HDA_INPUT),
+  '  Amp-Out vals: ': (ProcNode.add_ampvals, HDA_OUTPUT),
+  '  Connection: ': (ProcNode.add_connection, None),
+  '     0x': (ProcNode.add_connlist, None),
+  '  In-driver Connection: ': (None, 1),
+  '  PCM:': (None, 0),
+  '    rates [': (ProcNode.add_pcmrates, None),
+  '    bits [': (ProcNode.add_pcmbits, None),
+  '    formats [': (ProcNode.add_pcmformats, None),
+  '  Pincap ': (ProcNode.add_pincap, None),
+  '    Vref caps: ': (None, 0),
+  '  Pin Default ': (ProcNode.add_pindefault, None),
+  '    Conn = ': (None, 0),
+  '    DefAssociation = ': (None, 0),
+  '    Misc = ': (None, 0),
+  '  Delay: ': (None, 0),
+  '  Pin-ctls: ': (ProcNode.add_pinctls, None),
+  '  EAPD ': (ProcNode.add_eapd, None),
+  '  Power states: ': (ProcNode.add_powerstates, None),
+  '  Power: ': (ProcNode.add_power, None),
+  '  Processing caps: ': (ProcNode.add_processcaps, None),
+  '  Processing Coefficient: ': (ProcNode.add_processcoef, None),
+  '  Coefficient Index: ': (ProcNode.add_processindex, None),
+  '  Volume-Knob: ': (ProcNode.add_volknob, None),
+  '  Devices: ': (None, 0),
+  '     Dev ': (None, 0),
+  '    *Dev ': (None, 0)
+}
+
+# one regex for all prefixes, longer prefixes first
+PROC_NODE_PREFIX = re.compile('|'.join(map(re.escape,
+                      sorted(PROC_NODE_LINES, key=len, reverse=True))))
+
+class ProcNodes(HDALazyNodes):
+
+  """
+  nid -> ProcNode mapping for the lazy mode, only the offsets of the node
+  sections are indexed and a section is parsed on the first access
+  """
+
+  def __init__(self, codec, text, pos=0):
+    self.codec = codec
+    self.text = text
+    self.sections = {}
+    start = nid = None
+    for m in PROC_NODE_HEADER.finditer(text, pos):
+      if not nid is None:
+        self.sections[nid] = (start, m.start())
+      start = m.start()
+      nid = proc_int(m.group(1))
+    if not nid is None:
+      self.sections[nid] = (start, len(text))
+    HDALazyNodes.__init__(self, self.sections)
+
+  def create(self, nid):
+    start, end = self.sections[nid]
+    self.codec.parse_nodes(self.text[start:end].splitlines())
+    return dict.__getitem__(self, nid)
+
 class HDACodecProc(HDACodec, HDABaseProc):
 
-  def __init__(self, card, device, proc_file):
+  def __init__(self, card, device, proc_file, state=None, lazy=False):
     self.hwaccess = False
-    self.fd = None
+    self.lazy_nodes = lazy
     self.proc_codec = None
     self.card = card
     self.device = device
     self.mcard = HDACardProc(card)
     self.proc_codec_id = None
     self.mixer = None
-    self.parse(proc_file)
+    if state is None:
+      self.parse(proc_file)
+    else:
+      self.set_state(state)
     if self.proc_codec_id:
       self.mcard.name = self.proc_codec_id
 
+  def get_state(self):
+    """return the parsed codec state as a tuple of basic types"""
+    fields = {}
+    for name in vars(self):
+      if name.startswith('proc_') and not name in ['proc_nids', 'proc_codec']:
+        fields[name] = copy(getattr(self, name))
+    nodes = []
+    for node in self.proc_nids.values():
+      nodes.append(node.get_state())
+    return (self.device, fields, nodes)
+
+  def set_state(self, state):
+    """restore the state returned by get_state() instead of parsing"""
+    self.device, fields, nodes = state
+    for name in fields:
+      setattr(self, name, fields[name])
+    self.proc_nids = {}
+    for node in nodes:
+      ProcNode(self, node[0], node[1]).set_state(node)
+
   def parse(self, str):
 
     def lookfor(idx, prefix):
@@ -499,66 +652,23 @@ class HDACodecProc(HDACodec, HDABaseProc):
           return idx, int(res[2:], 16)
         return idx, int(res)
 
-    def decodeint(idx, prefix):
-      str, res = self.decodeintw(lines[idx], prefix)
-      return idx+1, res
-
     def decodefcnid(idx, prefix):
       if lines[idx].startswith(prefix):
-        str, res = self.decodeintw(lines[idx][len(prefix):])
-        if str.startswith('(unsol '):
-          str, res1 = self.decodeintw(str[:-1], '(unsol ')
-        else:
-          res1 = 0
-        return idx + 1, ((res1 & 1) << 8) | (res & 0xff)
+        res, res1 = self.scanf(PROC_FUNCTION_ID, lines[idx][len(prefix):])
+        res1 = res1 and proc_int(res1) or 0
+        return idx + 1, ((res1 & 1) << 8) | (proc_int(res) & 0xff)
       return idx, 0        
 
-    def decodeampcap(idx, prefix):
-      if lines[idx].startswith(prefix):
-        res = lines[idx][len(prefix):].strip()
-        if res == 'N/A':
-          return idx+1, 0
-        res, ofs = self.decodeintw(res, 'ofs=')
-        res, nsteps = self.decodeintw(res, 'nsteps=')
-        res, stepsize = self.decodeintw(res, 'stepsize=')
-        res, mute = self.decodeintw(res, 'mute=')
-        return idx+1, \
-               (ofs & 0x7f) | ((nsteps & 0x7f) << 8) | \
-               ((stepsize & 0x7f) << 16) | ((mute & 1) << 31)
-      self.wrongfile('amp caps expected')
-
-    def decodegpiocap(idx, prefix):
-      if lines[idx].startswith(prefix):
-        res = lines[idx][len(prefix):].strip()
-        res, io = self.decodeintw(res, 'io=')
-        res, o = self.decodeintw(res, 'o=')
-        res, i = self.decodeintw(res, 'i=')
-        res, unsol = self.decodeintw(res, 'unsolicited=')
-        res, wake = self.decodeintw(res, 'wake=')
-        return idx+1, \
-               (io & 0xff) | ((o & 0xff) << 8) | \
-               ((i & 0xff) << 16) | ((unsol & 1) << 30) | ((wake & 1) << 31)
-      self.wrongfile('gpio caps expected')
-
-    def decodegpio(idx, prefix):
-    
-      def writeval(str, idx, var):
-        res, val = self.decodeintw(str, var + '=')
-        if val:
-          self.proc_gpio[var] |= 1 << idx
+    def decodegpio(line):
+      fields = self.scanf(PROC_GPIO_IO, line)
+      bit = 1 << proc_int(fields[0])
+      for var, val in zip(GPIO_PROC_VARS, fields[1:]):
+        if val is None:
+          continue
+        if proc_int(val):
+          self.proc_gpio[var] |= bit
         else:
-          self.proc_gpio[var] &= ~(1 << idx)
-        return res
-    
-      res = lines[idx]
-      res, idx1 = self.decodeintw(res, prefix)
-      if res.startswith(': '):
-        res = res[2:]
-      for a in ['enable', 'dir', 'wake', 'sticky', 'data']:
-        res = writeval(res, idx1, a)
-      if res.find('unsol=') >= 0:
-        res = writeval(res, idx1, 'unsol')
-      return idx + 1
+          self.proc_gpio[var] &= ~bit
 
     self.proc_afg = -1
     self.proc_mfg = -1
@@ -569,6 +679,13 @@ class HDACodecProc(HDACodec, HDABaseProc):
     self.proc_subsystem_id = 0
     self.proc_revision_id =0
     function_id = 0
+    if self.lazy_nodes:
+      # parse the codec header up to the first node line, the node
+      # sections are parsed on demand through proc_nids
+      m = PROC_NODE_HEADER.search(str)
+      if m:
+        self.proc_nids = ProcNodes(self, str, m.start())
+        str = str[:str.find('\n', m.start()) + 1 or len(str)]
     lines = str.splitlines()
     idx = 0
     idx, self.proc_codec_id = lookfor(idx, 'Codec: ')
@@ -617,12 +734,18 @@ class HDACodecProc(HDACodec, HDABaseProc):
       self.proc_pcm_bits = 0
       self.proc_pcm_stream = 0
     else:
-      idx, tmp1 = decodeint(idx+1, '    rates [')
-      idx, tmp2 = decodeint(idx, '    bits [')
+      tmp1 = proc_int(self.scanf(PROC_PCM_RATES, lines[idx+1])[0])
+      tmp2 = proc_int(self.scanf(PROC_PCM_BITS, lines[idx+2])[0])
       self.proc_pcm_bits = (tmp1 & 0xffff) | ((tmp2 & 0xffff) << 16)
-      idx, self.proc_pcm_stream = decodeint(idx, '    formats [')
-    idx, self.proc_amp_caps_in = decodeampcap(idx, 'Default Amp-In caps: ')
-    idx, self.proc_amp_caps_out = decodeampcap(idx, 'Default Amp-Out caps: ')
+      self.proc_pcm_stream = proc_int(self.scanf(PROC_PCM_FORMATS, lines[idx+3])[0])
+      idx += 4
+    if not lines[idx].startswith('Default Amp-In caps: '):
+      self.wrongfile('amp caps expected')
+    self.proc_amp_caps_in = self.decodeampcaps(lines[idx][21:])
+    if not lines[idx+1].startswith('Default Amp-Out caps: '):
+      self.wrongfile('amp caps expected')
+    self.proc_amp_caps_out = self.decodeampcaps(lines[idx+1][22:])
+    idx += 2
     self.proc_gpio = {
       'enable': 0,
       'dir': 0,
@@ -637,9 +760,13 @@ class HDACodecProc(HDACodec, HDABaseProc):
         idx += 1
     self.proc_gpio_cap = 0
     if lines[idx].startswith('GPIO: '):
-      idx, self.proc_gpio_cap = decodegpiocap(idx, 'GPIO: ')
+      io, o, i, unsol, wake = map(proc_int, self.scanf(PROC_GPIO_CAP, lines[idx][6:]))
+      self.proc_gpio_cap = (io & 0xff) | ((o & 0xff) << 8) | \
+               ((i & 0xff) << 16) | ((unsol & 1) << 30) | ((wake & 1) << 31)
+      idx += 1
       while idx < len(lines) and lines[idx].startswith('  IO['):
-        idx = decodegpio(idx, '  IO[')
+        decodegpio(lines[idx])
+        idx += 1
     if idx >= len(lines):
       return
     line = lines[idx].strip()
@@ -651,100 +778,37 @@ class HDACodecProc(HDACodec, HDABaseProc):
       print('Sigmatel specific "%s" verb ignored for the moment' % line)
       idx += 1
       line = lines[idx].strip()
+    if self.lazy_nodes:
+      return
+    self.parse_nodes(lines, idx)
+
+  def parse_nodes(self, lines, idx=0):
     node = None
-    while idx < len(lines):
+    count = len(lines)
+    match = PROC_NODE_PREFIX.match
+    while idx < count:
       line = lines[idx]
       idx += 1
-      line, nid = self.decodeintw(line, 'Node ')
-      pos = line.find('wcaps ')
-      if pos < 0:
-        self.wrongfile('node wcaps expected')
-      line, wcaps = self.decodeintw(line[pos:], 'wcaps ')
-      node = ProcNode(self, nid, wcaps)
-      if idx >= len(lines):
-        break
-      line = lines[idx]
-      while not line.startswith('Node '):
-        if line.startswith('  Device: '):
-          node.add_device(line[10:])
-        elif line.startswith('  Control: '):
-          node.add_control(line[11:])
-        elif line.startswith('    ControlAmp: '):
-          node.add_controlamp(line[16:])
-        elif line.startswith('  Converter: '):
-          node.add_converter(line[13:]) 
-        elif line.startswith('  SDI-Select: '):
-          node.add_sdiselect(line[14:]) 
-        elif line.startswith('  Digital:'):
-          node.add_digital(line[11:]) 
-        elif line.startswith('  Unsolicited:'):
-          node.add_unsolicited(line[15:]) 
-        elif line.startswith('  Digital category:'):
-          node.add_digitalcategory(line[20:]) 
-        elif line.startswith('  IEC Coding Type: '):
-          pass
-        elif line.startswith('  Amp-In caps: '):
-          node.add_ampcaps(line[15:], HDA_INPUT) 
-        elif line.startswith('  Amp-Out caps: '):
-          node.add_ampcaps(line[16:], HDA_OUTPUT) 
-        elif line.startswith('  Amp-In vals: '):
-          node.add_ampvals(line[15:], HDA_INPUT) 
-        elif line.startswith('  Amp-Out vals: '):
-          node.add_ampvals(line[17:], HDA_OUTPUT) 
-        elif line.startswith('  Connection: '):
-          if idx + 1 < len(lines):
-            idx += node.add_connection(line[13:], lines[idx+1])
-          else:
-            idx += node.add_connection(line[13:], '')
-        elif line == '  PCM:':
-          node.add_pcm(lines[idx+1], lines[idx+2], lines[idx+3])
-          idx += 3
-        elif line.startswith('  Pincap '):
-          node.add_pincap(line[9:])
-        elif line.startswith('    Vref caps: '):
-          pass
-        elif line.startswith('  Pin Default '):
-          node.add_pindefault(line[14:])
-        elif line.startswith('    Conn = '):
-          pass
-        elif line.startswith('    DefAssociation = '):
-          pass
-        elif line.startswith('    Misc = '):
-          pass
-        elif line.startswith('  Delay: '):
-          pass
-        elif line.startswith('  Pin-ctls: '):
-          node.add_pinctls(line[12:])
-        elif line.startswith('  EAPD '):
-          node.add_eapd(line[7:])
-        elif line.startswith('  Power states: '):
-          node.add_powerstates(line[16:])
-        elif line.startswith('  Power: '):
-          node.add_power(line[9:])
-        elif line.startswith('  Processing caps: '):
-          node.add_processcaps(line[19:])
-        elif line.startswith('  Processing Coefficient: '):
-          node.add_processcoef(line[26:])
-        elif line.startswith('  Coefficient Index: '):
-          node.add_processindex(line[21:])
-        elif line.startswith('  Volume-Knob: '):
-          node.add_volknob(line[15:])
-        elif line.startswith('  In-driver Connection: '):
-          idx += 1
-          pass
-        elif line.startswith('  Devices: '):
-          pass
-        elif line.startswith('     Dev '):
-          pass
-        elif line.startswith('    *Dev '):
-          pass
+      m = match(line)
+      if m:
+        method, arg = PROC_NODE_LINES[m.group()]
+        if method is None:
+          idx += arg
+        elif node is None:
+          self.wrongfile('node expected')
+        elif arg is None:
+          method(node, line[m.end():])
         else:
-          self.wrongfile(line)
-        idx += 1
-        if idx < len(lines):
-          line = lines[idx]
-        else:
-          break
+          method(node, line[m.end():], arg)
+      elif line.startswith('Node '):
+        if node:
+          node.finish()
+        nid, wcaps = self.scanf(PROC_NODE, line)
+        node = ProcNode(self, proc_int(nid), proc_int(wcaps))
+      else:
+        self.wrongfile(line)
+    if node:
+      node.finish()
 
   def param_read(self, nid, param):
     if nid == AC_NODE_ROOT:
@@ -833,31 +897,21 @@ class HDACodecProc(HDACodec, HDABaseProc):
     node = self.proc_nids[nid]
     return node.get_controls()
 
-#
-# test section
-#
+class HDAProcBackend(HDABackend):
 
-def dotest1(base):
-  l = listdir(base)
-  for f in l:
-    file = base + '/' + f
-    if os.path.isdir(file):
-      dotest1(file)
-    else:
-      print(file)
-      file = DecodeProcFile(file)
-      file = DecodeAlsaInfoFile(file)
-      for a in file:
-        c = HDACodecProc(0, 0, a)
-        c.analyze()
-
-def dotest():
-  import sys
-  if len(sys.argv) < 2:
-    raise ValueError("Specify directory with codec dumps")
-  dotest1(sys.argv[1])
-
-if __name__ == '__main__':
-  import os
-  from dircache import listdir
-  dotest()
+  """proc file emulation as a backend for HDACodec"""
+
+  def __init__(self, proc_codec):
+    self.proc_codec = proc_codec
+
+  def verb(self, nid, verb, param):
+    proc = self.proc_codec
+    if verb == VERBS['PARAMETERS']:
+      if param == PARAMS['NODE_COUNT']:
+        count, start = proc.get_sub_nodes(nid)
+        return (start << 16) | count
+      return proc.param_read(nid, param)
+    return proc.rw(nid, verb, param)
+
+  def wcap(self, nid):
+    return self.proc_codec.get_wcap(nid)
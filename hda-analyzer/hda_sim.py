@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2008-2012 by Jaroslav Kysela <perex@perex.cz>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+import os
+import mmap
+import struct
+from array import array
+from time import sleep
+
+from hda_codec import HDACodec, HDABackend, VERBS
+
+class HDASimBackend(HDABackend):
+
+  """
+  In-memory codec simulator. The verb word is split to the 12-bit verb
+  and the 8-bit payload (the 4-bit verbs carry the upper payload bits in
+  the verb part), each used (nid, verb) pair owns a block of 256 responses
+  in one flat array. SET verbs update the responses of the matching GET
+  verbs, the codec reset restores the initial state.
+  """
+
+  hwaccess = True
+
+  def __init__(self, latency=0.0):
+    self.latency = latency
+    self.nids = 0
+    self.index = array('i')	# (nid << 12) | verb -> offset to values
+    self.values = array('I')
+    self.wcaps = array('I')
+    self.coefs = {}
+    self.initial = None
+
+  def cell(self, nid, verb, param, alloc=False):
+    """return index to values for the GET verb or -1"""
+    word = (verb << 8) | param
+    if nid >= self.nids:
+      if not alloc:
+        return -1
+      self.index.extend(array('i', [-1]) * ((nid + 1 - self.nids) << 12))
+      self.wcaps.extend(array('I', [0]) * (nid + 1 - self.nids))
+      self.nids = nid + 1
+    key = (nid << 12) | ((word >> 8) & 0xfff)
+    pos = self.index[key]
+    if pos < 0:
+      if not alloc:
+        return -1
+      pos = len(self.values)
+      self.values.extend(array('I', [0]) * 256)
+      self.index[key] = pos
+    return pos + (word & 0xff)
+
+  def get(self, nid, verb, param):
+    if verb == VERBS['GET_PROC_COEF']:
+      idx = self.get(nid, VERBS['GET_COEF_INDEX'], 0)
+      return self.coefs.get((nid, idx), 0)
+    pos = self.cell(nid, verb, param)
+    if pos < 0:
+      return 0
+    return self.values[pos]
+
+  def store(self, nid, verb, param, value):
+    """set the response for the GET verb"""
+    if verb == VERBS['GET_PROC_COEF']:
+      idx = self.get(nid, VERBS['GET_COEF_INDEX'], 0)
+      self.coefs[(nid, idx)] = value
+      return
+    self.values[self.cell(nid, verb, param, True)] = value & 0xffffffff
+
+  def store_wcap(self, nid, value):
+    self.cell(nid, VERBS['PARAMETERS'], 0, True)
+    self.wcaps[nid] = value
+
+  def commit(self):
+    """remember the current state as the state after the codec reset"""
+    self.initial = (array('I', self.values), dict(self.coefs))
+
+  def reset(self):
+    if self.initial is None:
+      return
+    values, coefs = self.initial
+    self.values[:len(values)] = values
+    for pos in range(len(values), len(self.values)):
+      self.values[pos] = 0
+    self.coefs = dict(coefs)
+
+  def replace_bits(self, nid, verb, shift, mask, value):
+    old = self.get(nid, verb, 0) & ~(mask << shift)
+    self.store(nid, verb, 0, old | ((value & mask) << shift))
+
+  def set(self, nid, verb, word):
+    top = verb >> 8
+    if top == 0x2:
+      self.store(nid, VERBS['GET_STREAM_FORMAT'], 0, word & 0xffff)
+    elif top == 0x3:
+      idx = (word >> 8) & 0x0f
+      for dir in [0x8000, 0x0000]:
+        if not word & (dir and 0x8000 or 0x4000):
+          continue
+        for side in [0x2000, 0x0000]:
+          if not word & (side and 0x2000 or 0x1000):
+            continue
+          self.store(nid, VERBS['GET_AMP_GAIN_MUTE'], dir | side | idx,
+                     word & 0xff)
+    elif top == 0x4:
+      self.store(nid, VERBS['GET_PROC_COEF'], 0, word & 0xffff)
+    elif top == 0x5:
+      self.store(nid, VERBS['GET_COEF_INDEX'], 0, word & 0xffff)
+    elif verb == VERBS['SET_CODEC_RESET']:
+      self.reset()
+    elif verb == VERBS['SET_PIN_SENSE']:
+      pass				# only triggers the impedance sense
+    elif verb == VERBS['SET_POWER_STATE']:
+      state = word & 0x0f		# the actual state follows immediately
+      self.store(nid, VERBS['GET_POWER_STATE'], 0, state | (state << 4))
+    elif verb in (VERBS['SET_DIGI_CONVERT_1'], VERBS['SET_DIGI_CONVERT_2']):
+      shift = (verb - VERBS['SET_DIGI_CONVERT_1']) * 8
+      self.replace_bits(nid, VERBS['GET_DIGI_CONVERT_1'], shift, 0xff, word)
+    elif verb >= VERBS['SET_CONFIG_DEFAULT_BYTES_0'] and \
+         verb <= VERBS['SET_CONFIG_DEFAULT_BYTES_3']:
+      shift = (verb - VERBS['SET_CONFIG_DEFAULT_BYTES_0']) * 8
+      self.replace_bits(nid, VERBS['GET_CONFIG_DEFAULT'], shift, 0xff, word)
+    elif top == 0x7:
+      self.store(nid, verb | 0x800, 0, word & 0xff)
+
+  def verb(self, nid, verb, param):
+    if self.latency:
+      sleep(self.latency)
+    word = (verb << 8) | param
+    verb = (word >> 8) & 0xfff
+    if verb & 0x800:
+      return self.get(nid, verb, word & 0xff)
+    self.set(nid, verb, word & 0xffff)
+    return 0
+
+  def wcap(self, nid):
+    if self.latency:
+      sleep(self.latency)
+    if nid >= self.nids:
+      return 0
+    return self.wcaps[nid]
+
+class HDASimRecorder(HDABackend):
+
+  """pass verbs to other backend and store the GET responses to simulator"""
+
+  def __init__(self, backend, sim):
+    self.backend = backend
+    self.sim = sim
+    self.proc_codec = backend.proc_codec
+
+  def verb(self, nid, verb, param):
+    res = self.backend.verb(nid, verb, param)
+    if verb & 0x800:
+      self.sim.store(nid, verb, param, res)
+    return res
+
+  def wcap(self, nid):
+    res = self.backend.wcap(nid)
+    self.sim.store_wcap(nid, res)
+    return res
+
+def HDA_sim_snapshot(backend, latency=0.0):
+  """return simulator answering all verbs used by HDACodec.analyze()"""
+  sim = HDASimBackend(latency)
+  codec = HDACodec(0, 0, backend=HDASimRecorder(backend, sim))
+  codec.analyze()
+  sim.proc_codec = backend.proc_codec
+  sim.commit()
+  return sim
+
+# binary snapshot: header, then records sorted by (nid, verb, param);
+# verb 0 records hold the wcap() values
+HDA_SNAPSHOT_MAGIC = b'HDASNAP\0'
+HDA_SNAPSHOT_VERSION = 1
+HDA_SNAPSHOT_HEADER = struct.Struct('<8sII')	# magic, version, records
+HDA_SNAPSHOT_RECORD = struct.Struct('<HHII')	# nid, verb, param, value
+
+class HDASnapshotRecorder(HDABackend):
+
+  """pass verbs to other backend and collect all GET responses"""
+
+  def __init__(self, backend):
+    self.backend = backend
+    self.proc_codec = backend.proc_codec
+    self.records = {}
+
+  def verb(self, nid, verb, param):
+    res = self.backend.verb(nid, verb, param)
+    if verb & 0x800:
+      self.records[(nid, verb, param)] = res & 0xffffffff
+    return res
+
+  def wcap(self, nid):
+    res = self.backend.wcap(nid)
+    self.records[(nid, 0, 0)] = res & 0xffffffff
+    return res
+
+def HDA_snapshot_save(filename, backend):
+  """store all verb responses used by HDACodec.analyze() to the file"""
+  recorder = HDASnapshotRecorder(backend)
+  codec = HDACodec(0, 0, backend=recorder)
+  codec.analyze()
+  records = sorted(recorder.records.items())
+  data = [HDA_SNAPSHOT_HEADER.pack(HDA_SNAPSHOT_MAGIC, HDA_SNAPSHOT_VERSION,
+                                   len(records))]
+  for (nid, verb, param), value in records:
+    data.append(HDA_SNAPSHOT_RECORD.pack(nid, verb, param, value))
+  tmp = '%s.%i.tmp' % (filename, os.getpid())
+  with open(tmp, 'wb') as fd:
+    fd.write(b''.join(data))
+  os.replace(tmp, filename)
+  return len(records)
+
+class HDASnapshot:
+
+  """
+  Read-only view of the snapshot file. The file is mapped to memory, so
+  single fields can be looked up without loading the whole snapshot.
+  """
+
+  def __init__(self, filename):
+    with open(filename, 'rb') as fd:
+      self.map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(self.map) < HDA_SNAPSHOT_HEADER.size:
+      self.close()
+      raise ValueError("%s is not a codec snapshot" % filename)
+    magic, version, self.count = HDA_SNAPSHOT_HEADER.unpack_from(self.map)
+    if magic != HDA_SNAPSHOT_MAGIC or version != HDA_SNAPSHOT_VERSION or \
+       len(self.map) < HDA_SNAPSHOT_HEADER.size + \
+                       self.count * HDA_SNAPSHOT_RECORD.size:
+      self.close()
+      raise ValueError("%s is not a codec snapshot (version %i)" % \
+                       (filename, HDA_SNAPSHOT_VERSION))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __len__(self):
+    return self.count
+
+  def close(self):
+    self.map.close()
+
+  def record(self, idx):
+    """return (nid, verb, param, value) of the record idx"""
+    return HDA_SNAPSHOT_RECORD.unpack_from(self.map,
+              HDA_SNAPSHOT_HEADER.size + idx * HDA_SNAPSHOT_RECORD.size)
+
+  def records(self):
+    start = HDA_SNAPSHOT_HEADER.size
+    end = start + self.count * HDA_SNAPSHOT_RECORD.size
+    return HDA_SNAPSHOT_RECORD.iter_unpack(self.map[start:end])
+
+  def lookup(self, nid, verb, param=0):
+    """return the recorded response or None (binary search)"""
+    key = (nid, verb, param)
+    lo = 0
+    hi = self.count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self.record(mid)[:3] < key:
+        lo = mid + 1
+      else:
+        hi = mid
+    if lo < self.count:
+      rec = self.record(lo)
+      if rec[:3] == key:
+        return rec[3]
+    return None
+
+  def wcap(self, nid):
+    return self.lookup(nid, 0, 0)
+
+def HDA_snapshot_scan(filenames, nid, verb, param=0):
+  """yield (filename, response or None) for the field in snapshot files"""
+  for filename in filenames:
+    with HDASnapshot(filename) as snap:
+      yield filename, snap.lookup(nid, verb, param)
+
+class HDASnapshotBackend(HDABackend):
+
+  """
+  Replay of the snapshot file. Only the recorded GET verbs are answered,
+  SET verbs are ignored like for the proc file emulation (use
+  HDA_sim_load() for a writable simulator).
+  """
+
+  def __init__(self, filename):
+    with HDASnapshot(filename) as snap:
+      self.responses = dict(((nid, verb, param), value)
+                            for nid, verb, param, value in snap.records())
+
+  def verb(self, nid, verb, param):
+    if verb & 0x800:
+      return self.responses.get((nid, verb, param), 0)
+    return 0
+
+  def wcap(self, nid):
+    return self.responses.get((nid, 0, 0), 0)
+
+def HDA_sim_load(filename, latency=0.0):
+  """return simulator initialized from the snapshot file"""
+  sim = HDASimBackend(latency)
+  coefs = []
+  with HDASnapshot(filename) as snap:
+    for nid, verb, param, value in snap.records():
+      if verb == 0:
+        sim.store_wcap(nid, value)
+      elif verb == VERBS['GET_PROC_COEF']:
+        coefs.append((nid, param, value))	# needs GET_COEF_INDEX first
+      else:
+        sim.store(nid, verb, param, value)
+  for nid, param, value in coefs:
+    sim.store(nid, VERBS['GET_PROC_COEF'], param, value)
+  sim.commit()
+  return sim
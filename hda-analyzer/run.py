@@ -2,7 +2,8 @@
 
 URL="http://git.alsa-project.org/?p=alsa.git;a=blob_plain;f=hda-analyzer/"
 FILES=["hda_analyzer.py", "hda_guilib.py", "hda_codec.py", "hda_proc.py",
-       "hda_graph.py", "hda_mixer.py"]
+       "hda_graph.py", "hda_mixer.py", "hda_monitor.py", "hda_diff.py",
+       "hda_cache.py", "hda_layout.py"]
 
 try:
   import gi